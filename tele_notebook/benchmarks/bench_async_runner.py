@@ -0,0 +1,67 @@
+# benchmarks/bench_async_runner.py
+"""
+Compares concurrent Q&A throughput of the shared-event-loop worker mode against
+the old `-P solo` + asyncio.run-per-task mode.
+
+Each simulated Q&A task body awaits the same I/O waits the real one does
+(retrieval, the Gemini call, the Telegram send) with configurable latency.
+Solo mode runs the task bodies one after another on fresh event loops, exactly
+like `-P solo`; loop mode feeds them through a thread pool into the shared
+AsyncRunner, exactly like `-P threads -c N`.
+
+Usage: python -m tele_notebook.benchmarks.bench_async_runner [--tasks 64] [--llm-latency 0.5] [--concurrency 16]
+"""
+
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tele_notebook.tasks.async_runner import AsyncRunner
+
+
+async def fake_question_task(llm_latency: float, io_latency: float):
+    await asyncio.sleep(io_latency)   # send_chat_action
+    await asyncio.sleep(io_latency)   # retrieval (query embedding + Chroma)
+    await asyncio.sleep(llm_latency)  # gemini-2.5-pro
+    await asyncio.sleep(io_latency)   # send_message
+
+
+def bench_solo(n: int, llm_latency: float, io_latency: float) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        asyncio.run(fake_question_task(llm_latency, io_latency))
+    return time.perf_counter() - start
+
+
+def bench_loop(n: int, llm_latency: float, io_latency: float, concurrency: int) -> float:
+    runner = AsyncRunner(concurrency)
+    runner.run(asyncio.sleep(0))  # start the loop outside the timed section, as a warm worker would
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(runner.run, fake_question_task(llm_latency, io_latency)) for _ in range(n)]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - start
+    runner.shutdown()
+    return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=64)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--io-latency", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    solo = bench_solo(args.tasks, args.llm_latency, args.io_latency)
+    loop = bench_loop(args.tasks, args.llm_latency, args.io_latency, args.concurrency)
+    print(f"{args.tasks} Q&A tasks, LLM latency {args.llm_latency}s, I/O latency {args.io_latency}s")
+    print(f"  solo (asyncio.run per task): {solo:7.2f}s  {args.tasks / solo:7.2f} tasks/s")
+    print(f"  shared loop, concurrency {args.concurrency}: {loop:7.2f}s  {args.tasks / loop:7.2f} tasks/s")
+    print(f"  speed-up: {solo / loop:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# benchmarks/bench_layout.py
+"""
+Compares the two Chroma collection layouts at many projects: one collection
+per project (COLLECTION_LAYOUT=per_project) versus projects sharing
+COLLECTION_SHARDS collections (COLLECTION_LAYOUT=sharded).
+
+For each layout, child processes write `--projects` projects of `--chunks`
+random vectors each into a fresh Chroma directory, through the same
+locate_project() path ingestion uses, BUILD_BATCH projects per process (a
+Chroma client keeps every collection it has written loaded, which a single
+process cannot afford for thousands of collections). A fresh child then serves
+`--queries` vector searches against random projects, the way a worker does
+after a restart, and reports client startup time, query latency, resident
+memory and the on-disk size. Every hit is checked to belong to the queried
+project. A child that dies (typically of memory) is reported as failed. The
+lexical index is not involved: it is one file per project in both layouts.
+`--resident N` sets RESIDENT_COLLECTIONS for the serving process (0 keeps
+every collection it touches loaded).
+
+Usage: python -m tele_notebook.benchmarks.bench_layout [--projects 10000] [--chunks 20] [--queries 2000] [--resident 128]
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+LAYOUTS = ("per_project", "sharded")
+BUILD_BATCH = 1000
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # peak, on systems without /proc
+
+
+def dir_mb(path: str) -> float:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names) / 1e6
+
+
+def pct(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else values[0]
+
+
+def project_name(i: int) -> str:
+    return f"user_{1000 + i // 3}_project-{i % 3}"
+
+
+def build(args) -> dict:
+    import numpy as np
+    from tele_notebook.services import rag_service
+
+    rng = np.random.default_rng(7)
+    started = time.perf_counter()
+    for i in range(args.start, min(args.start + BUILD_BATCH, args.projects)):
+        name = project_name(i)
+        location = rag_service.locate_project(name, create=True)
+        vectors = rng.standard_normal((args.chunks, args.dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        ids = [f"c{j}" for j in range(args.chunks)]
+        location.collection.upsert(
+            ids=location.to_chroma(ids), embeddings=vectors.tolist(),
+            documents=[f"{name} chunk {j}" for j in ids],
+            metadatas=location.stamp({"source_id": "bench"} for _ in ids),
+        )
+    print(f"  {i + 1} projects written", file=sys.stderr)
+    return {"build_s": time.perf_counter() - started}
+
+
+def serve(args) -> dict:
+    import numpy as np
+
+    started = time.perf_counter()
+    from tele_notebook.services import rag_service
+    rag_service.client.list_collections()  # what a reconcile or startup scan touches
+    startup = time.perf_counter() - started
+    rss_start = rss_mb()
+
+    rng = random.Random(11)
+    vectors = np.random.default_rng(11).standard_normal((args.queries, args.dim)).astype(np.float32)
+    latencies = []
+    for vector in vectors:
+        name = project_name(rng.randrange(args.projects))
+        t = time.perf_counter()
+        hits = rag_service._vector_search(name, vector.tolist(), args.k)
+        latencies.append((time.perf_counter() - t) * 1000)
+        if len(hits) != min(args.k, args.chunks) or any(not text.startswith(f"{name} chunk") for _, text, _ in hits):
+            raise AssertionError(f"wrong hits for {name}: {[text for _, text, _ in hits]}")
+    return {
+        "collections": len(rag_service.client.list_collections()),
+        "evictions": rag_service.residency_stats()["collections"]["evictions"],
+        "startup_s": startup, "rss_start_mb": rss_start, "rss_end_mb": rss_mb(),
+        "p50_ms": pct(latencies, 50), "p95_ms": pct(latencies, 95),
+    }
+
+
+def run_child(args, layout: str, phase: str, path: str, start: int = 0) -> dict:
+    env = dict(os.environ, CHROMA_DB_PATH=path, COLLECTION_LAYOUT=layout, COLLECTION_SHARDS=str(args.shards),
+               EMBEDDING_CACHE_ENABLED="false")
+    if args.resident is not None and phase == "serve":
+        env["RESIDENT_COLLECTIONS"] = str(args.resident)
+    for name in ("TELEGRAM_BOT_TOKEN", "GOOGLE_API_KEY", "TAVILY_API_KEY", "REDIS_URL"):
+        env.setdefault(name, "offline")
+    command = [sys.executable, "-W", "ignore", "-m", "tele_notebook.benchmarks.bench_layout", "--phase", phase,
+               "--projects", str(args.projects), "--chunks", str(args.chunks), "--queries", str(args.queries),
+               "--dim", str(args.dim), "--k", str(args.k), "--start", str(start)]
+    result = subprocess.run(command, env=env, stdout=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{layout} {phase} child exited with {result.returncode}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def run_layout(args, layout: str) -> dict:
+    path = tempfile.mkdtemp(prefix=f"lumenote-layout-{layout}-")
+    print(f"{layout}: writing {args.projects} projects x {args.chunks} chunks into {path}", file=sys.stderr)
+    try:
+        build_s = sum(run_child(args, layout, "build", path, start)["build_s"] for start in range(0, args.projects, BUILD_BATCH))
+        return {"build_s": build_s, **run_child(args, layout, "serve", path), "disk_mb": dir_mb(path)}
+    except RuntimeError as e:
+        print(f"  {e}", file=sys.stderr)
+        return {"failed": str(e), "disk_mb": dir_mb(path)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--projects", type=int, default=10000)
+    parser.add_argument("--chunks", type=int, default=20, help="chunks per project")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--dim", type=int, default=64, help="vector size (the production model uses 768)")
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--shards", type=int, default=16)
+    parser.add_argument("--layout", choices=LAYOUTS, default=None, help="run only this layout")
+    parser.add_argument("--resident", type=int, default=None, help="RESIDENT_COLLECTIONS while serving (0 = unbounded)")
+    parser.add_argument("--phase", choices=("build", "serve"), default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--start", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.phase:
+        print(json.dumps(build(args) if args.phase == "build" else serve(args)))
+        return
+
+    results = {layout: run_layout(args, layout) for layout in ([args.layout] if args.layout else LAYOUTS)}
+
+    print(f"{args.projects} projects x {args.chunks} chunks, dim {args.dim}, {args.queries} queries (k={args.k})")
+    print(f"{'layout':<12} {'collections':>11} {'build':>8} {'startup':>8} {'p50':>8} {'p95':>8} "
+          f"{'RSS start':>10} {'RSS end':>8} {'disk':>8} {'evictions':>10}")
+    for layout, r in results.items():
+        if "failed" in r:
+            print(f"{layout:<12} failed: {r['failed']}")
+            continue
+        print(f"{layout:<12} {r['collections']:>11} {r['build_s']:>7.0f}s {r['startup_s']:>7.2f}s "
+              f"{r['p50_ms']:>6.1f}ms {r['p95_ms']:>6.1f}ms {r['rss_start_mb']:>8.0f}MB {r['rss_end_mb']:>6.0f}MB "
+              f"{r['disk_mb']:>6.0f}MB {r['evictions']:>10}")
+
+
+if __name__ == "__main__":
+    main()
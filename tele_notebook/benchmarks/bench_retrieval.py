@@ -0,0 +1,152 @@
+# benchmarks/bench_retrieval.py
+"""
+Offline evaluation and latency benchmark for hybrid retrieval.
+
+Builds a synthetic corpus in a temporary Chroma directory through the real
+ingest path (so the lexical index is maintained exactly as in production) and
+queries it with a fake embedding model:
+
+- Each topic has a vocabulary; every vocabulary word has a synonym that the
+  fake model maps to the same vector, like a real model would for paraphrases.
+- Every document also mentions a unique identifier (a part number) that the
+  fake model does not know, just as real embeddings blur codes and names.
+
+"exact" queries ask about an identifier, which BM25 should find and vectors
+miss; "paraphrase" queries use only synonyms of a document's words, which
+vectors should find and BM25 miss. Reports recall@k and MRR for vector-only,
+BM25-only and fused retrieval, plus per-stage latency of the hybrid retriever.
+
+Usage: python -m tele_notebook.benchmarks.bench_retrieval [--docs 2000] [--queries 200]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+import statistics
+import tempfile
+import time
+
+os.environ["CHROMA_DB_PATH"] = tempfile.mkdtemp(prefix="lumenote-bench-")
+os.environ["EMBEDDING_CACHE_ENABLED"] = "false"
+for name in ("TELEGRAM_BOT_TOKEN", "GOOGLE_API_KEY", "TAVILY_API_KEY", "REDIS_URL"):
+    os.environ.setdefault(name, "offline")
+
+import numpy as np  # noqa: E402
+from langchain_core.embeddings import Embeddings  # noqa: E402
+
+from tele_notebook.core.config import settings  # noqa: E402
+from tele_notebook.services import lexical_index, rag_service  # noqa: E402
+from tele_notebook.utils import metrics  # noqa: E402
+
+DIM = 64
+USER_ID, PROJECT = 1, "bench"
+
+
+class FakeEmbeddings(Embeddings):
+    """Mean of per-word vectors; synonyms share a vector and unknown words are ignored."""
+
+    def __init__(self, synonyms: dict):
+        self.synonyms = synonyms
+
+    def _word_vector(self, word: str) -> np.ndarray:
+        seed = int(hashlib.sha256(self.synonyms.get(word, word).encode()).hexdigest()[:8], 16)
+        return np.random.default_rng(seed).standard_normal(DIM)
+
+    def _embed(self, text: str) -> list:
+        words = [w for w in text.lower().replace("?", " ").split() if w in self.synonyms]
+        if not words:
+            return np.random.default_rng(0).standard_normal(DIM).tolist()
+        vector = np.mean([self._word_vector(w) for w in words], axis=0)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def make_corpus(n_docs: int, n_topics: int, rng: random.Random):
+    synonyms = {}
+    vocab = []
+    for t in range(n_topics):
+        words = [f"t{t}w{i}" for i in range(30)]
+        vocab.append(words)
+        for w in words:
+            synonyms[w] = w
+            synonyms[f"{w}syn"] = w  # paraphrase
+    docs = []
+    for d in range(n_docs):
+        words = rng.sample(vocab[d % n_topics], 8)
+        part = f"qx{d:05d}"
+        docs.append((" ".join(words) + f" part {part} specification", words, part))
+    return docs, synonyms
+
+
+def rank_of(chunk_texts, target_text):
+    for rank, text in enumerate(chunk_texts, start=1):
+        if text == target_text:
+            return rank
+    return None
+
+
+def pct(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else values[0]
+
+
+async def run(args):
+    rng = random.Random(7)
+    docs, synonyms = make_corpus(args.docs, args.topics, rng)
+    rag_service.embeddings = FakeEmbeddings(synonyms)
+    collection_name = rag_service.get_collection_name(USER_ID, PROJECT)
+
+    sources = [(text, {"source": f"doc-{i}"}) for i, (text, _, _) in enumerate(docs)]
+    for start in range(0, len(sources), 500):
+        await rag_service.async_add_texts_to_project(USER_ID, PROJECT, sources[start:start + 500])
+
+    queries = []
+    for text, words, part in rng.sample(docs, args.queries):
+        queries.append(("exact", f"what does the document say about {part}", text))
+        queries.append(("paraphrase", " ".join(f"{w}syn" for w in rng.sample(words, 4)), text))
+
+    retriever = rag_service.HybridRetriever(collection_name=collection_name, k=args.k, fetch_k=settings.RETRIEVAL_FETCH_K)
+    results = {}
+    stage_timings = {}
+    for kind, query, target in queries:
+        vector = rag_service._vector_search(collection_name, rag_service.embeddings.embed_query(query), args.k)
+        lexical = lexical_index.search(collection_name, query, args.k)
+        started = time.perf_counter()
+        with metrics.collect() as trace:
+            hybrid = await retriever.ainvoke(query)
+        stage_timings.setdefault("total", []).append((time.perf_counter() - started) * 1000)
+        for stage, seconds in trace.stages:
+            stage_timings.setdefault(stage.removeprefix("retrieve."), []).append(seconds * 1000)
+        for mode, texts in (("vector", [t for _, t, _ in vector]), ("bm25", [t for _, t, _ in lexical]),
+                            ("hybrid", [d.page_content for d in hybrid])):
+            results.setdefault((kind, mode), []).append(rank_of(texts, target))
+
+    print(f"{args.docs} documents, {len(queries)} queries, k={args.k}")
+    print(f"{'queries':<11} {'mode':<7} {'recall@k':>9} {'MRR':>6}")
+    for (kind, mode), ranks in sorted(results.items()):
+        recall = sum(r is not None for r in ranks) / len(ranks)
+        mrr = sum(1 / r for r in ranks if r) / len(ranks)
+        print(f"{kind:<11} {mode:<7} {recall:9.2f} {mrr:6.2f}")
+    print("hybrid retriever latency (ms):")
+    for stage, values in stage_timings.items():
+        print(f"  {stage:<8} p50 {pct(values, 50):7.2f}  p95 {pct(values, 95):7.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--topics", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
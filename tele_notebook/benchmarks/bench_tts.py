@@ -0,0 +1,57 @@
+# benchmarks/bench_tts.py
+"""
+Measures the podcast TTS pipeline offline with the stub backend: the same
+script synthesized one turn at a time versus with a bounded parallel pool.
+
+The stub sleeps `--latency + --latency-per-char * len(turn)` per turn, roughly
+like a streaming TTS call whose time grows with the text it speaks.
+
+Usage: python -m tele_notebook.benchmarks.bench_tts [--turns 12] [--concurrency 4]
+"""
+
+import argparse
+import asyncio
+import time
+
+from tele_notebook.services.gemini_tts_service import StubTTSBackend, parse_speaker_turns, synthesize_script
+
+LINES = [
+    "Welcome back to the show. Today we are digging into how retrieval works.",
+    "Thanks for having me. Let's start with why chunking matters at all.",
+    "Sure. Long documents have to be split before they can be embedded.",
+    "And the size of those pieces changes what the model gets to see.",
+]
+
+
+def make_script(turns: int) -> str:
+    return "\n".join(f"Speaker {i % 2 + 1}: {LINES[i % len(LINES)]}" for i in range(turns))
+
+
+def bench(script: str, backend: StubTTSBackend, concurrency: int) -> float:
+    start = time.perf_counter()
+    asyncio.run(synthesize_script(script, backend=backend, concurrency=concurrency))
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=12)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--latency-per-char", type=float, default=0.01)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    script = make_script(args.turns)
+    backend = StubTTSBackend(latency=args.latency, latency_per_char=args.latency_per_char)
+    slowest = max(args.latency + args.latency_per_char * len(text) for _, text in parse_speaker_turns(script))
+
+    sequential = bench(script, backend, 1)
+    parallel = bench(script, backend, args.concurrency)
+    print(f"{args.turns} speaker turns, slowest turn {slowest:.2f}s")
+    print(f"  sequential:             {sequential:6.2f}s")
+    print(f"  parallel, {args.concurrency:2d} at a time: {parallel:6.2f}s")
+    print(f"  speed-up: {sequential / parallel:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
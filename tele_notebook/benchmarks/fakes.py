@@ -0,0 +1,238 @@
+# benchmarks/fakes.py
+"""
+Deterministic local stand-ins for the paid/remote services, for offline benchmarks.
+
+Each fake sleeps for a configurable latency and returns output derived only
+from its input, so runs are repeatable. install() swaps them in at the points
+where the real code obtains its clients (client_registry and
+rag_service.embeddings), so the code under test is otherwise unchanged:
+
+    ChatGoogleGenerativeAI       -> FakeChatModel
+    GoogleGenerativeAIEmbeddings -> FakeEmbeddings
+    genai.Client                 -> FakeGenaiClient (TTS audio)
+    TavilyClient                 -> FakeTavilyClient
+    telegram.Bot                 -> FakeBot
+"""
+
+import asyncio
+import hashlib
+import itertools
+import time
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+@dataclass
+class Latencies:
+    """Seconds each fake waits. Defaults are in the range of the real services."""
+    llm_first_token: float = 0.8
+    llm_per_token: float = 0.01
+    embed_batch: float = 0.15
+    embed_query: float = 0.1
+    tts_per_char: float = 0.002
+    search: float = 1.0
+    telegram: float = 0.05
+
+
+def _seed(text: str) -> int:
+    return int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16)
+
+
+def _words(seed_text: str, count: int) -> List[str]:
+    rng = np.random.default_rng(_seed(seed_text))
+    vocabulary = ["the", "model", "source", "project", "answer", "context", "chunk", "retrieval",
+                  "summary", "topic", "document", "evidence", "result", "method", "data", "shows"]
+    return [vocabulary[i] for i in rng.integers(0, len(vocabulary), count)]
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model whose reply depends on the prompt kind (Q&A, podcast script or DOT mind map)."""
+
+    latency: float = 0.8
+    token_latency: float = 0.01
+    answer_words: int = 80
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-gemini"
+
+    def _reply(self, messages: List[BaseMessage]) -> str:
+        prompt = "\n".join(str(m.content) for m in messages)
+        if "Graphviz DOT" in prompt:
+            nodes = _words(prompt, 6)
+            edges = "\n".join(f'    "Topic" -> "{word} {i}";' for i, word in enumerate(nodes))
+            return f"```dot\ndigraph G {{\n    rankdir=LR;\n{edges}\n}}\n```"
+        if "podcast script" in prompt:
+            return "\n".join(f"Speaker {i % 2 + 1}: " + " ".join(_words(f"{prompt}{i}", 18)) + "." for i in range(8))
+        return " ".join(_words(prompt, self.answer_words)) + "."
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        reply = self._reply(messages)
+        time.sleep(self.latency + self.token_latency * len(reply.split()))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=reply))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        reply = self._reply(messages)
+        await asyncio.sleep(self.latency + self.token_latency * len(reply.split()))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=reply))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency)
+        for word in self._reply(messages).split(" "):
+            time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency)
+        for word in self._reply(messages).split(" "):
+            await asyncio.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+
+
+class FakeEmbeddings(Embeddings):
+    """Unit vectors seeded from the text; one sleep per batch call, like one API request."""
+
+    def __init__(self, batch_latency: float, query_latency: float, dim: int = 768):
+        self.batch_latency = batch_latency
+        self.query_latency = query_latency
+        self.dim = dim
+        self.calls = 0
+        self.texts = 0
+
+    def _vector(self, text: str) -> List[float]:
+        vector = np.random.default_rng(_seed(text)).standard_normal(self.dim)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.texts += len(texts)
+        time.sleep(self.batch_latency)
+        return [self._vector(t) for t in texts]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.texts += len(texts)
+        await asyncio.sleep(self.batch_latency)
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.query_latency)
+        return self._vector(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        await asyncio.sleep(self.query_latency)
+        return self._vector(text)
+
+
+class FakeGenaiClient:
+    """Mimics client.models.generate_content_stream() with audio output: silent 24 kHz L16 PCM."""
+
+    def __init__(self, per_char: float, chars_per_second: float = 15.0):
+        self.models = self
+        self.per_char = per_char
+        self.chars_per_second = chars_per_second
+
+    def generate_content_stream(self, model: str, contents: Any, config: Any = None):
+        text = " ".join(part.text or "" for content in contents for part in content.parts)
+        size = int(24000 * 2 * max(len(text), 1) / self.chars_per_second) // 2 * 2
+        time.sleep(self.per_char * len(text))
+        for start in range(0, size, 32768):
+            data = bytes(min(32768, size - start))
+            part = SimpleNamespace(inline_data=SimpleNamespace(data=data, mime_type="audio/L16;rate=24000"))
+            yield SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))])
+
+
+class FakeTavilyClient:
+    def __init__(self, latency: float, results: int = 5, words_per_result: int = 1200):
+        self.latency = latency
+        self.results = results
+        self.words_per_result = words_per_result
+
+    def search(self, query: str, **kwargs) -> dict:
+        time.sleep(self.latency)
+        return {"results": [
+            {"title": f"{query} #{i}", "url": f"https://example.com/{_seed(query)}/{i}",
+             "content": " ".join(_words(f"{query}{i}", self.words_per_result))}
+            for i in range(self.results)
+        ]}
+
+
+class FakeBot:
+    """Async telegram.Bot stand-in that records how many calls of each kind were made."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls: dict = {}
+        self._ids = itertools.count(1)
+
+    async def _call(self, method: str):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        await asyncio.sleep(self.latency)
+        message_id = next(self._ids)
+        file_id = f"file-{message_id}"
+        return SimpleNamespace(
+            message_id=message_id,
+            voice=SimpleNamespace(file_id=file_id), audio=SimpleNamespace(file_id=file_id),
+            photo=[SimpleNamespace(file_id=file_id)], document=SimpleNamespace(file_id=file_id),
+        )
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        return await self._call("send_message")
+
+    async def edit_message_text(self, text: str, chat_id: int = None, message_id: int = None, **kwargs):
+        return await self._call("edit_message_text")
+
+    async def send_chat_action(self, chat_id: int, action: str, **kwargs):
+        return await self._call("send_chat_action")
+
+    async def send_voice(self, chat_id: int, voice: Any, **kwargs):
+        return await self._call("send_voice")
+
+    async def send_audio(self, chat_id: int, audio: Any, **kwargs):
+        return await self._call("send_audio")
+
+    async def send_photo(self, chat_id: int, photo: Any, **kwargs):
+        return await self._call("send_photo")
+
+    async def send_document(self, chat_id: int, document: Any, **kwargs):
+        return await self._call("send_document")
+
+
+@dataclass
+class Fakes:
+    chat_model: FakeChatModel
+    embeddings: FakeEmbeddings
+    genai: FakeGenaiClient
+    tavily: FakeTavilyClient
+    bot: FakeBot
+
+
+def install(latencies: Optional[Latencies] = None) -> Fakes:
+    """Routes every remote client the services use to a fake. Call before running any task coroutine."""
+    from tele_notebook.services import client_registry, embedding_cache, rag_service
+
+    latencies = latencies or Latencies()
+    fakes = Fakes(
+        chat_model=FakeChatModel(latency=latencies.llm_first_token, token_latency=latencies.llm_per_token),
+        embeddings=FakeEmbeddings(latencies.embed_batch, latencies.embed_query),
+        genai=FakeGenaiClient(latencies.tts_per_char),
+        tavily=FakeTavilyClient(latencies.search),
+        bot=FakeBot(latencies.telegram),
+    )
+    client_registry._process_clients["genai"] = fakes.genai
+    client_registry._process_clients["tavily"] = fakes.tavily
+    client_registry.get_chat_model = lambda model="gemini-2.5-pro": fakes.chat_model
+
+    async def get_bot():
+        return fakes.bot
+    client_registry.get_bot = get_bot
+    # Keep the embedding cache in the loop, as in production.
+    rag_service.embeddings = embedding_cache.with_cache(fakes.embeddings, "fake-embedding")
+    return fakes
@@ -0,0 +1,213 @@
+# benchmarks/suite.py
+"""
+Offline end-to-end benchmark suite.
+
+Runs the real task coroutines from tasks/tasks.py and the real user_service
+against a temporary Chroma directory and state store, with Gemini, Tavily,
+Telegram and the embedding model replaced by the latency-faithful fakes in
+benchmarks/fakes.py. Nothing leaves the machine and nothing is billed.
+
+Reports:
+    ingest_chunks_per_s  documents through _async_process_document
+    discover_s           one /discover (search + batched ingest of the results)
+    qa_p50_s, qa_p95_s   questions through _async_handle_question, concurrently
+    podcast_s            script + multi-speaker TTS through _async_generate_podcast
+    state_ops_per_s      get_user_state/set_user_state on USER_STATE_BACKEND
+    peak_rss_mb          peak resident memory of the process
+
+Results can be saved as a named baseline (benchmarks/baselines/<name>.json)
+and later runs compared against it; a metric that got worse by more than
+--tolerance is reported as a regression and the exit code is 1.
+
+Usage:
+    python -m tele_notebook.benchmarks.suite [--save-baseline default] [--compare default]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+_workdir = tempfile.mkdtemp(prefix="lumenote-suite-")
+os.environ["CHROMA_DB_PATH"] = os.path.join(_workdir, "chroma")
+os.environ.setdefault("USER_STATE_BACKEND", "sqlite")
+os.environ["USER_STATE_DB_PATH"] = os.path.join(_workdir, "user_states.sqlite3")
+# Every question and podcast should exercise the full pipeline.
+os.environ.setdefault("ANSWER_CACHE_ENABLED", "false")
+os.environ.setdefault("ARTIFACT_CACHE_ENABLED", "false")
+os.environ.setdefault("PODCAST_AUDIO_FORMAT", "wav")  # Opus needs ffmpeg
+for _name in ("TELEGRAM_BOT_TOKEN", "GOOGLE_API_KEY", "TAVILY_API_KEY"):
+    os.environ.setdefault(_name, "offline")
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
+os.chdir(_workdir)  # keep legacy user_states.json lookups away from the real tree
+
+from tele_notebook.benchmarks import fakes  # noqa: E402
+from tele_notebook.core.config import settings  # noqa: E402
+from tele_notebook.services import rag_service, user_service  # noqa: E402
+from tele_notebook.tasks import tasks  # noqa: E402
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+HIGHER_IS_BETTER = {"ingest_chunks_per_s", "state_ops_per_s"}
+CHAT_ID, USER_ID, PROJECT = 1, 1, "bench"
+
+
+def _percentile(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else values[0]
+
+
+def _document(index: int, words: int) -> str:
+    rng = random.Random(index)
+    vocabulary = [f"term{i}" for i in range(2000)]
+    sentences = []
+    while sum(len(s.split()) for s in sentences) < words:
+        sentences.append(" ".join(rng.choice(vocabulary) for _ in range(rng.randint(8, 20))).capitalize() + ".")
+    return " ".join(sentences)
+
+
+async def bench_ingest(args) -> dict:
+    paths = []
+    for i in range(args.docs):
+        path = os.path.join(_workdir, f"doc-{i}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(_document(i, args.doc_words))
+        paths.append(path)
+    user_service.register_project(USER_ID, PROJECT, "benchmarks")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        tasks._async_process_document(CHAT_ID, USER_ID, PROJECT, path, "txt", os.path.basename(path)) for path in paths
+    ))
+    elapsed = time.perf_counter() - start
+    chunks = rag_service.count_project_chunks(USER_ID, PROJECT)
+
+    start = time.perf_counter()
+    await tasks._async_discover_and_ingest(CHAT_ID, USER_ID, PROJECT, "retrieval augmented generation")
+    return {"ingest_chunks_per_s": chunks / elapsed, "discover_s": time.perf_counter() - start}
+
+
+async def bench_qa(args) -> dict:
+    semaphore = asyncio.Semaphore(args.qa_concurrency)
+    latencies = []
+
+    async def ask(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            await tasks._async_handle_question(CHAT_ID, USER_ID, PROJECT, f"What does term{i} have to do with term{i * 7}?", "en", i + 1)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(ask(i) for i in range(args.questions)))
+    return {"qa_p50_s": _percentile(latencies, 50), "qa_p95_s": _percentile(latencies, 95)}
+
+
+async def bench_podcast(args) -> dict:
+    durations = []
+    for i in range(args.podcasts):
+        start = time.perf_counter()
+        await tasks._async_generate_podcast(CHAT_ID, USER_ID, PROJECT, f"term{i}", "en")
+        durations.append(time.perf_counter() - start)
+    return {"podcast_s": statistics.mean(durations)}
+
+
+def bench_state(args) -> dict:
+    """One write per four reads over `state_users` users; best of three passes, since a pass takes well under a second."""
+    best = 0.0
+    for _ in range(3):
+        rng = random.Random(0)
+        start = time.perf_counter()
+        for i in range(args.state_ops):
+            user_id = 1000 + rng.randrange(args.state_users)
+            if i % 5 == 0:
+                user_service.set_user_state(user_id, project=f"p{i % 7}", lang="en")
+            else:
+                user_service.get_user_state(user_id)
+        best = max(best, args.state_ops / (time.perf_counter() - start))
+    return {"state_ops_per_s": best}
+
+
+async def run(args) -> dict:
+    fake = fakes.install(fakes.Latencies(
+        llm_first_token=args.llm_latency, embed_batch=args.embed_latency, telegram=args.telegram_latency,
+    ))
+    results = {}
+    results.update(await bench_ingest(args))
+    results.update(await bench_qa(args))
+    results.update(await bench_podcast(args))
+    results.update(await asyncio.to_thread(bench_state, args))
+    results["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results["embedding_calls"] = fake.embeddings.calls
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> bool:
+    """Prints each metric against the baseline; returns True if any regressed beyond `tolerance`."""
+    regressed = False
+    print(f"\n{'metric':<22} {'baseline':>10} {'now':>10} {'change':>8}")
+    for metric, value in results.items():
+        old = baseline.get(metric)
+        if not old:
+            continue
+        change = (value - old) / old
+        worse = -change if metric in HIGHER_IS_BETTER else change
+        flag = "  REGRESSION" if worse > tolerance else ""
+        regressed |= bool(flag)
+        print(f"{metric:<22} {old:10.3f} {value:10.3f} {change:+8.1%}{flag}")
+    return regressed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=20)
+    parser.add_argument("--doc-words", type=int, default=3000)
+    parser.add_argument("--questions", type=int, default=40)
+    parser.add_argument("--qa-concurrency", type=int, default=8)
+    parser.add_argument("--podcasts", type=int, default=2)
+    parser.add_argument("--state-ops", type=int, default=20000)
+    parser.add_argument("--state-users", type=int, default=1000)
+    parser.add_argument("--llm-latency", type=float, default=0.8)
+    parser.add_argument("--embed-latency", type=float, default=0.15)
+    parser.add_argument("--telegram-latency", type=float, default=0.05)
+    parser.add_argument("--save-baseline", metavar="NAME")
+    parser.add_argument("--compare", metavar="NAME")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument("--verbose", action="store_true", help="Show the services' own log output.")
+    args = parser.parse_args()
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    if not args.verbose:
+        # Without a Redis server every state write logs a failed invalidation publish.
+        logging.getLogger(user_service.__name__).setLevel(logging.ERROR)
+    with output:
+        results = asyncio.run(run(args))
+
+    print(f"Offline suite ({settings.USER_STATE_BACKEND} state store, workdir {_workdir})")
+    for metric, value in results.items():
+        print(f"  {metric:<22} {value:10.3f}")
+
+    config = {k: v for k, v in vars(args).items() if k not in ("save_baseline", "compare", "tolerance", "verbose")}
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f"{args.save_baseline}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"config": config, "python": platform.python_version(), "results": results}, f, indent=2)
+        print(f"Saved baseline to {path}")
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json"), encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["config"] != config:
+            print("Note: the baseline was recorded with different options; comparisons may not be meaningful.")
+        if compare(results, baseline["results"], args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
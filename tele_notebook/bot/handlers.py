@@ -1,42 +1,97 @@
 # handlers.py
 
+import asyncio
+import contextlib
+import contextvars
+import functools
 import logging
+import math
 import os
+import time
 import uuid
-import requests
-from bs4 import BeautifulSoup
-import re 
 
 from telegram import Update
 from telegram.ext import ContextTypes
 from telegram.helpers import escape_markdown
 
-from tele_notebook.services import user_service, rag_service
+from tele_notebook.services import user_service, rag_service, admission, web_fetcher
 from tele_notebook.tasks import tasks
+from tele_notebook.tasks.celery_app import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL
 from tele_notebook.utils.prompts import SUPPORTED_LANGUAGES
+from tele_notebook.utils import metrics
 from tele_notebook.utils.localization import get_text
+from tele_notebook.services.answer_cache import normalize_question
 
 logger = logging.getLogger(__name__)
 
-def _get_lang(user_id: int) -> str:
-    return user_service.get_user_state(user_id).get("language", "en")
+# The language of the user whose update is being handled, for timed()'s metric labels.
+_update_language: contextvars.ContextVar = contextvars.ContextVar("lumenote_update_language", default=None)
+
+def _get_state(user_id: int) -> dict:
+    """Loads the user's state once per update; handlers pass this snapshot around."""
+    state = user_service.get_user_state(user_id)
+    _update_language.set(state["language"])
+    return state
+
+async def _admit(update: Update, lang_code: str, command_class: str, project_name: str, command: str, topic: str):
+    """
+    Returns the apply_async headers for an admitted request. Duplicates of an
+    in-flight request and rate-limited ones get a reply instead, and None.
+    """
+    result = await asyncio.to_thread(admission.admit, update.effective_user.id, command_class, project_name, command, topic)
+    if result.status == "duplicate":
+        await update.message.reply_markdown_v2(get_text("already_working", lang_code)); return None
+    if result.status == "rate_limited":
+        await update.message.reply_markdown_v2(get_text("slow_down", lang_code, seconds=math.ceil(result.retry_after))); return None
+    return result.headers
+
+@contextlib.asynccontextmanager
+async def _enqueuing(headers: dict):
+    """
+    Wraps the work between admission and apply_async. If it fails, the
+    in-flight key is released right away instead of blocking retries until it
+    expires (the worker only releases it for tasks that actually ran).
+    """
+    try:
+        yield
+    except BaseException:
+        await asyncio.to_thread(admission.release_headers, headers)
+        raise
+
+def timed(command: str, handler):
+    """Wraps a handler so its latency and outcome are recorded per command and user language."""
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        started = time.perf_counter()
+        status = "ok"
+        token = _update_language.set(None)
+        try:
+            return await handler(update, context)
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            # Labelled with the language the handler loaded, if any: no second state read.
+            metrics.observe_handler(command, _update_language.get(), time.perf_counter() - started, status)
+            _update_language.reset(token)
+    return wrapper
 
 # --- CORE COMMANDS ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    lang_code = _get_lang(user.id)
+    lang_code = _get_state(user.id)["language"]
     text = get_text("welcome", lang_code, user_mention=user.mention_markdown_v2())
     await update.message.reply_markdown_v2(text)
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang_code = _get_lang(update.effective_user.id)
+    lang_code = _get_state(update.effective_user.id)["language"]
     text = get_text("help", lang_code)
     await update.message.reply_markdown_v2(text)
 
 async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    response_lang_code = _get_lang(user_id) 
-    state = user_service.get_user_state(user_id)
+    state = _get_state(user_id)
+    response_lang_code = state["language"]
     project = state.get('active_project', 'default')
     main_topic = state.get('main_topic', 'Not set')
     user_lang_setting = state.get('language', 'en') 
@@ -55,19 +110,20 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # --- PROJECT MANAGEMENT ---
 async def new_project(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    lang_code = _get_lang(user_id)
+    lang_code = _get_state(user_id)["language"]
     main_topic = " ".join(context.args)
     if not main_topic:
         text = get_text("provide_project_topic", lang_code)
         await update.message.reply_markdown_v2(text); return
     project_name = rag_service.get_collection_name(user_id, main_topic)
     user_service.set_user_state(user_id, project=project_name, main_topic=main_topic)
+    user_service.register_project(user_id, project_name, main_topic)
     text = get_text("project_topic_created", lang_code, project_name=project_name, main_topic=main_topic)
     await update.message.reply_text(text)
 
 async def list_projects(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    lang_code = _get_lang(user_id)
+    lang_code = _get_state(user_id)["language"]
     projects = user_service.get_user_display_projects(user_id) 
     if not projects:
         text = get_text("no_projects", lang_code); await update.message.reply_markdown_v2(text); return
@@ -78,13 +134,14 @@ async def list_projects(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def switch_project(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    lang_code = _get_lang(user_id)
+    lang_code = _get_state(user_id)["language"]
     project_name = " ".join(context.args)
     if not project_name:
         text = get_text("switch_provide_name", lang_code); await update.message.reply_markdown_v2(text); return
-    if project_name not in user_service.get_user_projects(user_id):
+    project = user_service.get_project(user_id, project_name)
+    if project is None:
         text = get_text("project_not_found", lang_code, project_name=project_name); await update.message.reply_text(text); return
-    user_service.set_user_state(user_id, project=project_name)
+    user_service.set_user_state(user_id, project=project_name, main_topic=project.get("main_topic"))
     text = get_text("switched_project", lang_code, project_name=project_name)
     await update.message.reply_text(text)
 
@@ -93,7 +150,7 @@ async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     supported_codes = ", ".join(f"`{key}`" for key in SUPPORTED_LANGUAGES.keys())
     if not context.args or context.args[0] not in SUPPORTED_LANGUAGES:
-        text = get_text("lang_usage", lang_code=_get_lang(user_id), supported_codes=supported_codes); await update.message.reply_markdown_v2(text); return
+        text = get_text("lang_usage", lang_code=_get_state(user_id)["language"], supported_codes=supported_codes); await update.message.reply_markdown_v2(text); return
     new_lang_code = context.args[0]
     user_service.set_user_state(user_id, lang=new_lang_code)
     lang_name = SUPPORTED_LANGUAGES[new_lang_code]['name']
@@ -103,19 +160,22 @@ async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # --- FEATURE HANDLERS ---
 async def discover(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    lang_code = _get_lang(user_id)
-    state = user_service.get_user_state(user_id)
+    state = _get_state(user_id)
+    lang_code = state["language"]
     project_name = state.get("active_project")
     main_topic = state.get("main_topic")
     if not main_topic or not project_name or project_name == "default":
         await update.message.reply_text(get_text("create_project_first", lang_code)); return
-    await update.message.reply_text(f"🔍 Starting discovery for '{main_topic}'. I'll report back as I find and process sources.")
-    tasks.discover_sources_task.delay(update.effective_chat.id, user_id, project_name, main_topic)
+    headers = await _admit(update, lang_code, "ingest", project_name, "discover", main_topic)
+    if headers is None: return
+    async with _enqueuing(headers):
+        await update.message.reply_text(f"🔍 Starting discovery for '{main_topic}'. I'll report back as I find and process sources.")
+        tasks.discover_sources_task.apply_async((update.effective_chat.id, user_id, project_name, main_topic), priority=PRIORITY_LOW, headers=headers)
 
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    lang_code = _get_lang(user_id)
-    state = user_service.get_user_state(user_id)
+    state = _get_state(user_id)
+    lang_code = state["language"]
     project_name = state.get("active_project")
     if not project_name or project_name == "default":
         await update.message.reply_text(get_text("create_project_first", lang_code)); return
@@ -123,19 +183,22 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     file_ext = doc.file_name.split('.')[-1].lower()
     if file_ext not in ['pdf', 'txt', 'md']:
         await update.message.reply_text(get_text("unsupported_file_type", lang_code, supported_types='pdf, txt, md')); return
-    await update.message.reply_text(get_text("processing_file", lang_code, file_name=doc.file_name))
-    shared_uploads_dir = "/app/uploads"
-    os.makedirs(shared_uploads_dir, exist_ok=True)
-    temp_file_path = f"{shared_uploads_dir}/{uuid.uuid4()}_{doc.file_name}"
-    file = await context.bot.get_file(doc.file_id)
-    await file.download_to_drive(temp_file_path)
-    tasks.process_document_task.delay(update.effective_chat.id, user_id, project_name, temp_file_path, file_ext)
+    headers = await _admit(update, lang_code, "ingest", project_name, "document", doc.file_unique_id)
+    if headers is None: return
+    async with _enqueuing(headers):
+        await update.message.reply_text(get_text("processing_file", lang_code, file_name=doc.file_name))
+        shared_uploads_dir = "/app/uploads"
+        os.makedirs(shared_uploads_dir, exist_ok=True)
+        temp_file_path = f"{shared_uploads_dir}/{uuid.uuid4()}_{doc.file_name}"
+        file = await context.bot.get_file(doc.file_id)
+        await file.download_to_drive(temp_file_path)
+        tasks.process_document_task.apply_async((update.effective_chat.id, user_id, project_name, temp_file_path, file_ext, doc.file_name), priority=PRIORITY_HIGH, headers=headers)
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    lang_code = _get_lang(user_id)
-    state = user_service.get_user_state(user_id)
+    state = _get_state(user_id)
+    lang_code = state["language"]
     project_name = state.get("active_project")
     question = update.message.text
     chat_id = update.effective_chat.id
@@ -150,13 +213,17 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     #     await update.message.reply_text(get_text("no_documents_in_project", lang_code))
     #     return
 
-    await update.message.reply_text(get_text("thinking", lang_code))
-    tasks.answer_question_task.delay(chat_id, user_id, project_name, question, lang_code)
+    headers = await _admit(update, lang_code, "qa", project_name, "question", normalize_question(question))
+    if headers is None: return
+    async with _enqueuing(headers):
+        placeholder = await update.message.reply_text(get_text("thinking", lang_code))
+        # The worker streams the answer into this message.
+        tasks.answer_question_task.apply_async((chat_id, user_id, project_name, question, lang_code, placeholder.message_id), priority=PRIORITY_HIGH, headers=headers)
 
 async def generate_content_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, task_function, command_name: str):
     user_id = update.effective_user.id
-    lang_code = _get_lang(user_id)
-    state = user_service.get_user_state(user_id)
+    state = _get_state(user_id)
+    lang_code = state["language"]
     project_name = state.get("active_project")
     if not project_name or project_name == "default":
         await update.message.reply_text(get_text("select_project_first", lang_code)); return
@@ -166,15 +233,20 @@ async def generate_content_handler(update: Update, context: ContextTypes.DEFAULT
             await update.message.reply_text("No topic given and project has no main topic."); return
     else:
         topic = " ".join(context.args)
-    content_type = "podcast" if command_name == "podcast" else "mind map"
-    await update.message.reply_text(get_text("generating_content", lang_code, content_type=content_type, topic=topic))
-    task_function.delay(update.effective_chat.id, user_id, project_name, topic, lang_code)
+    headers = await _admit(update, lang_code, "media", project_name, command_name, topic)
+    if headers is None: return
+    async with _enqueuing(headers):
+        content_type = "podcast" if command_name == "podcast" else "mind map"
+        await update.message.reply_text(get_text("generating_content", lang_code, content_type=content_type, topic=topic))
+        # Mind maps take seconds, podcasts minutes: let mind maps overtake queued podcasts.
+        priority = PRIORITY_LOW if command_name == "podcast" else PRIORITY_NORMAL
+        task_function.apply_async((update.effective_chat.id, user_id, project_name, topic, lang_code), priority=priority, headers=headers)
 
 # In handlers.py, add this entire function
 async def add_source(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    lang_code = _get_lang(user_id)
-    state = user_service.get_user_state(user_id)
+    state = _get_state(user_id)
+    lang_code = state["language"]
     project_name = state.get("active_project")
     
     if not project_name or project_name == "default":
@@ -186,34 +258,14 @@ async def add_source(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Please provide a URL. Usage: /addsource <url>")
         return
     
-    url = context.args[0]
-    await update.message.reply_text(f"Fetching content from {url}...")
-
     try:
-        # Fetch and parse web page content
-        response = requests.get(url, timeout=15)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # A simple way to get cleaner text
-        for script_or_style in soup(["script", "style"]):
-            script_or_style.decompose()
-        page_text = soup.get_text(separator='\n', strip=True)
-
-        # Save content to a temporary .txt file
-        shared_uploads_dir = "/app/uploads"
-        os.makedirs(shared_uploads_dir, exist_ok=True)
-        # Use the URL to create a somewhat readable filename
-        safe_filename = re.sub(r'[^a-zA-Z0-9]', '_', url)
-        temp_file_path = os.path.join(shared_uploads_dir, f"{uuid.uuid4()}_{safe_filename[:50]}.txt")
-
-        with open(temp_file_path, 'w', encoding='utf-8') as f:
-            f.write(f"Source URL: {url}\n\n{page_text}")
-        
-        # Use the existing task to process the file. This is efficient.
-        tasks.process_document_task.delay(update.effective_chat.id, user_id, project_name, temp_file_path, 'txt')
-        await update.message.reply_text(f"Successfully queued source from URL for processing. I'll let you know when it's added to project '{project_name}'.")
-
-    except Exception as e:
-        logger.error(f"Failed to add source from URL {url}: {e}")
-        await update.message.reply_text(f"Failed to add source: {e}")
\ No newline at end of file
+        url = web_fetcher.validate_url(context.args[0])
+    except web_fetcher.FetchError as e:
+        await update.message.reply_text(str(e))
+        return
+    headers = await _admit(update, lang_code, "ingest", project_name, "addsource", url)
+    if headers is None: return
+    # Downloading and parsing happen in the worker, so a slow site never blocks the bot.
+    async with _enqueuing(headers):
+        tasks.add_source_task.apply_async((update.effective_chat.id, user_id, project_name, url), priority=PRIORITY_HIGH, headers=headers)
+    await update.message.reply_text(f"Fetching content from {url}... I'll let you know when it's added to project '{project_name}'.", disable_web_page_preview=True)
@@ -2,7 +2,7 @@ import logging
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters
 from tele_notebook.core.config import settings
 from tele_notebook.bot import handlers
-from tele_notebook.utils import localization # <-- ADD THIS IMPORT
+from tele_notebook.utils import localization, metrics # <-- ADD THIS IMPORT
 
 # Enable logging
 logging.basicConfig(
@@ -14,6 +14,7 @@ logger = logging.getLogger(__name__)
 def main() -> None:
     """Run the bot."""
     localization.load_translations()
+    metrics.start_server()
     logger.info("Starting bot...")
     
     # --- THIS IS THE FIX ---
@@ -27,32 +28,32 @@ def main() -> None:
     )
 
     # Command Handlers
-    application.add_handler(CommandHandler("start", handlers.start))
-    application.add_handler(CommandHandler("help", handlers.help_command))
-    application.add_handler(CommandHandler("status", handlers.status))
+    application.add_handler(CommandHandler("start", handlers.timed("start", handlers.start)))
+    application.add_handler(CommandHandler("help", handlers.timed("help", handlers.help_command)))
+    application.add_handler(CommandHandler("status", handlers.timed("status", handlers.status)))
     
     # Project Management
-    application.add_handler(CommandHandler("newproject", handlers.new_project))
-    application.add_handler(CommandHandler("listprojects", handlers.list_projects))
-    application.add_handler(CommandHandler("switchproject", handlers.switch_project))
+    application.add_handler(CommandHandler("newproject", handlers.timed("newproject", handlers.new_project)))
+    application.add_handler(CommandHandler("listprojects", handlers.timed("listprojects", handlers.list_projects)))
+    application.add_handler(CommandHandler("switchproject", handlers.timed("switchproject", handlers.switch_project)))
 
     # Language
-    application.add_handler(CommandHandler("lang", handlers.set_language))
+    application.add_handler(CommandHandler("lang", handlers.timed("lang", handlers.set_language)))
 
-    application.add_handler(CommandHandler("discover", handlers.discover))
-    application.add_handler(CommandHandler("addsource", handlers.add_source))
+    application.add_handler(CommandHandler("discover", handlers.timed("discover", handlers.discover)))
+    application.add_handler(CommandHandler("addsource", handlers.timed("addsource", handlers.add_source)))
 
     # Content Generation (using the generic handler)
     application.add_handler(CommandHandler(
-        "podcast", lambda u, c: handlers.generate_content_handler(u, c, handlers.tasks.generate_podcast_task, "podcast")
+        "podcast", handlers.timed("podcast", lambda u, c: handlers.generate_content_handler(u, c, handlers.tasks.generate_podcast_task, "podcast"))
     ))
     application.add_handler(CommandHandler(
-        "mindmap", lambda u, c: handlers.generate_content_handler(u, c, handlers.tasks.generate_mindmap_task, "mindmap")
+        "mindmap", handlers.timed("mindmap", lambda u, c: handlers.generate_content_handler(u, c, handlers.tasks.generate_mindmap_task, "mindmap"))
     ))
 
     # Message Handlers
-    application.add_handler(MessageHandler(filters.Document.ALL, handlers.handle_document))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.handle_message))
+    application.add_handler(MessageHandler(filters.Document.ALL, handlers.timed("document", handlers.handle_document)))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.timed("question", handlers.handle_message)))
 
     # Run the bot until the user presses Ctrl-C
     application.run_polling()
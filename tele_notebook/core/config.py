@@ -6,8 +6,114 @@ class Settings(BaseSettings):
 
     TELEGRAM_BOT_TOKEN: str
     GOOGLE_API_KEY: str
-    TAVILY_API_KEY: str # <--- ADD THIS LINE
+    TAVILY_API_KEY: str
     REDIS_URL: str
     CHROMA_DB_PATH: str
 
-settings = Settings()
\ No newline at end of file
+    # --- User state ---
+    USER_STATE_BACKEND: str = "redis"  # "redis", "sqlite" or "json" (legacy whole-file store)
+    USER_STATE_DB_PATH: str = "user_states.sqlite3"
+    USER_STATE_CACHE_SIZE: int = 10000  # 0 disables the in-process cache
+    USER_STATE_CACHE_TTL: float = 300.0
+
+    # --- Worker ---
+    CELERY_ASYNC_MODE: str = "loop"  # "loop": shared event loop (-P threads); "run": asyncio.run per task (-P solo)
+    ASYNC_TASK_CONCURRENCY: int = 16
+    ASYNC_SHUTDOWN_TIMEOUT: float = 30.0
+    HTTP_POOL_SIZE: int = 32  # keep-alive connections per pooled client (Telegram, aiohttp)
+
+    # --- Queues (per-queue concurrency and prefetch are set on each worker in docker-compose.yml) ---
+    INTERACTIVE_TASK_TIME_LIMIT: float = 180.0  # seconds
+    INGEST_TASK_TIME_LIMIT: float = 1800.0
+    MEDIA_TASK_TIME_LIMIT: float = 900.0
+    QUEUE_WAIT_WARN_SECONDS: float = 10.0  # log tasks that waited longer than this in their queue
+
+    # --- Metrics ---
+    METRICS_PORT: int = 9100  # Prometheus /metrics port of each process (bot, every worker); 0 disables
+    SLOW_TASK_SECONDS: float = 60.0  # log tasks slower than this with their per-stage breakdown
+
+    # --- Admission control (per user, per command class) ---
+    ADMISSION_CONTROL_ENABLED: bool = True
+    RATE_LIMIT_QA_BURST: int = 5
+    RATE_LIMIT_QA_PER_MINUTE: float = 10.0
+    RATE_LIMIT_INGEST_BURST: int = 5
+    RATE_LIMIT_INGEST_PER_MINUTE: float = 5.0
+    RATE_LIMIT_MEDIA_BURST: int = 2
+    RATE_LIMIT_MEDIA_PER_MINUTE: float = 1.0
+
+    # --- Q&A ---
+    QA_STREAMING: bool = True  # stream answers into the "Thinking..." message as tokens arrive
+    STREAM_EDIT_INTERVAL: float = 1.0  # min seconds between edits of a streamed answer
+
+    # --- Retrieval ---
+    RETRIEVAL_MODE: str = "hybrid"  # "hybrid": BM25 + vector with rank fusion; "vector": dense search only
+    RETRIEVAL_K: int = 12  # chunks retrieved per query; the context packer trims them to the budget below
+    RETRIEVAL_FETCH_K: int = 20  # candidates taken from each search before fusion
+    RRF_K: int = 60  # reciprocal rank fusion constant
+    COLLECTION_LAYOUT: str = "per_project"  # "per_project": one Chroma collection per project; "sharded": projects share COLLECTION_SHARDS collections
+    COLLECTION_SHARDS: int = 16  # fixed once data is written; changing it orphans sharded projects
+    LEXICAL_INDEX_DIR: str = ""  # defaults to <CHROMA_DB_PATH>/lexical
+    CONTEXT_PACKING: bool = True  # merge overlapping chunks, drop duplicates, MMR, token budget
+    CONTEXT_BUDGET_QA: int = 1000  # approx. prompt tokens of context per task
+    CONTEXT_BUDGET_PODCAST: int = 1500
+    CONTEXT_BUDGET_MINDMAP: int = 1200
+    CONTEXT_DEDUP_THRESHOLD: float = 0.8  # shingle containment above which a passage is a near-duplicate
+    CONTEXT_MMR_LAMBDA: float = 0.7  # 1.0 = pure relevance, lower = more diversity
+
+    # --- Collection residency (per worker process) ---
+    RESIDENT_COLLECTIONS: int = 128  # Chroma collections kept loaded; least recently used ones are unloaded (0 = no count bound)
+    RESIDENT_COLLECTION_BYTES: int = 0  # bound on their total vector index size (0 = no byte bound)
+    RESIDENT_RETRIEVERS: int = 512  # retrievers reused across questions
+    RESIDENCY_WARMUP: int = 32  # most recently active projects loaded when a worker starts (0 = off)
+
+    # --- Podcasts (TTS) ---
+    TTS_BACKEND: str = "gemini"  # "gemini", or "stub" for an offline sine-tone backend
+    TTS_VOICES: str = "Zephyr,Puck"  # prebuilt voices, assigned to speakers in order of appearance
+    TTS_CONCURRENCY: int = 4  # speaker turns synthesized in parallel per podcast
+    TTS_TURN_PAUSE_MS: int = 300  # silence between speaker turns
+    PODCAST_AUDIO_FORMAT: str = "opus"  # "opus": OGG/Opus voice message (needs ffmpeg); "wav": uncompressed audio file
+    PODCAST_OPUS_BITRATE: str = "32k"
+
+    # --- Mind maps ---
+    MINDMAP_FORMAT: str = "png"  # "png": sent as a photo; "svg": sent as a document
+    MINDMAP_DPI: int = 96
+    MINDMAP_RENDER_CONCURRENCY: int = 2  # `dot` processes rendering at once per worker
+    MINDMAP_RENDER_TIMEOUT: float = 30.0  # seconds per render
+    MINDMAP_MAX_DOT_BYTES: int = 100_000
+    MINDMAP_MAX_OUTPUT_BYTES: int = 10_000_000  # Telegram's photo size limit
+    MINDMAP_MAX_DIMENSIONS: int = 10_000  # max width + height of a PNG in pixels (Telegram's photo limit)
+    MINDMAP_CACHE_ENABLED: bool = True  # rendered images by hash of the normalized DOT
+    MINDMAP_CACHE_MAX_ENTRIES: int = 1000
+
+    # --- Ingestion ---
+    INGEST_BATCH_SIZE: int = 64  # chunks embedded and upserted per batch
+    PDF_PAGES_PER_BATCH: int = 10
+    EMBED_CONCURRENCY: int = 4  # embedding batches in flight at once
+    PROGRESS_UPDATE_INTERVAL: float = 3.0  # min seconds between progress message edits
+
+    # --- Web sources (/addsource) ---
+    FETCH_TIMEOUT: float = 15.0  # seconds for the whole download
+    FETCH_MAX_BYTES: int = 5_000_000
+    FETCH_USER_AGENT: str = "LumeNote/1.0 (+https://github.com/k0luchiy/LumeNote)"
+    FETCH_CACHE_ENABLED: bool = True  # keep extracted text per URL and revalidate it with ETag/Last-Modified
+    FETCH_CACHE_MAX_ENTRIES: int = 2000
+
+    # --- Caches (shared by the bot and workers) ---
+    CACHE_DIR: str = ""  # defaults to <CHROMA_DB_PATH>/cache
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 500000
+
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_SIMILARITY_THRESHOLD: float = 0.0  # cosine similarity for near-duplicate questions; 0 = exact match only
+    ANSWER_CACHE_MAX_ENTRIES: int = 20000
+    ANSWER_CACHE_MAX_PER_PROJECT: int = 200
+
+    ARTIFACT_CACHE_ENABLED: bool = True
+    ARTIFACT_CACHE_MAX_ENTRIES: int = 5000
+
+    # --- Global source store (web sources shared across users and projects) ---
+    SOURCE_STORE_ENABLED: bool = True
+    SOURCE_URL_MAX_AGE: float = 86400.0  # seconds a fetched URL's text is reused without asking the server
+    SOURCE_GC_GRACE_SECONDS: float = 7 * 86400.0  # unreferenced sources are kept this long after their last use
+
+settings = Settings()
@@ -0,0 +1,115 @@
+# tele_notebook/manage.py
+"""
+Maintenance commands for Lumenote.
+
+Usage: python -m tele_notebook.manage <command> [options]
+"""
+
+import argparse
+
+from tele_notebook.core.config import settings
+from tele_notebook.services import user_service
+
+
+def migrate_state(args):
+    backend = user_service.get_backend()
+    imported = user_service.migrate_legacy_states(backend, force=True)
+    print(f"Imported {imported} user states into the '{settings.USER_STATE_BACKEND}' backend.")
+
+
+def reconcile_projects(args):
+    found = user_service.reconcile_projects(args.user_id)
+    print(f"Project registry rebuilt from Chroma: {found} projects.")
+
+
+def rebuild_lexical_index(args):
+    from tele_notebook.services import rag_service
+
+    names = list(rag_service.list_project_collections())
+    if args.user_id is not None:
+        names = [n for n in names if n.startswith(f"user_{args.user_id}_")]
+    for name in names:
+        rag_service.ensure_lexical_index(name, force=True)
+    print(f"Rebuilt the lexical index of {len(names)} collections.")
+
+
+def migrate_layout(args):
+    from tele_notebook.services import rag_service
+
+    if settings.COLLECTION_LAYOUT != "sharded":
+        print("Set COLLECTION_LAYOUT=sharded for the bot and every worker first, then run this again.")
+        return
+    names = [c.name for c in rag_service.client.list_collections() if c.name.startswith("user_")]
+    if args.user_id is not None:
+        names = [n for n in names if n.startswith(f"user_{args.user_id}_")]
+    moved = 0
+    for name in names:
+        copied, done = rag_service.migrate_collection_to_shard(name)
+        moved += done
+        state = "moved" if done else "still being written to, left in place"
+        print(f"{name} -> {rag_service.shard_name(name)}: {copied} chunks copied, {state}")
+    print(f"Moved {moved}/{len(names)} projects into {settings.COLLECTION_SHARDS} shards.")
+
+
+def source_store_stats(args):
+    from tele_notebook.services import source_store
+
+    for name, value in source_store.stats().items():
+        print(f"{name:<22} {value}")
+
+
+def gc_sources(args):
+    from tele_notebook.services import rag_service, source_store
+
+    grace = settings.SOURCE_GC_GRACE_SECONDS if args.grace is None else args.grace
+    removed = source_store.collect_garbage(rag_service.list_project_collections(), grace)
+    print(f"Dropped references of {removed['stale_collections']} deleted collections, "
+          f"deleted {removed['sources_deleted']} unreferenced sources.")
+
+
+def queue_stats(args):
+    from tele_notebook.tasks.celery_app import QUEUES
+    from tele_notebook.tasks.queue_stats import queue_report
+
+    fmt = lambda v: "-" if v is None else f"{v:.1f}s"
+    print(f"{'queue':<12} {'depth':>6} {'wait p50':>9} {'wait p95':>9} {'wait max':>9} {'samples':>8}")
+    for queue, stats in queue_report(QUEUES).items():
+        print(f"{queue:<12} {stats['depth']:>6} {fmt(stats['wait_p50']):>9} {fmt(stats['wait_p95']):>9} "
+              f"{fmt(stats['wait_max']):>9} {stats['samples']:>8}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m tele_notebook.manage")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("migrate-state", help="Import user_states.json into the configured state backend.")
+    p.set_defaults(func=migrate_state)
+
+    p = subparsers.add_parser("reconcile-projects", help="Rebuild the project registry from Chroma collections.")
+    p.add_argument("--user-id", type=int, default=None, help="Only reconcile this user's projects.")
+    p.set_defaults(func=reconcile_projects)
+
+    p = subparsers.add_parser("rebuild-lexical-index", help="Rebuild the BM25 indexes from the Chroma collections.")
+    p.add_argument("--user-id", type=int, default=None, help="Only rebuild this user's projects.")
+    p.set_defaults(func=rebuild_lexical_index)
+
+    p = subparsers.add_parser("migrate-layout", help="Move per-project Chroma collections into the shared shards.")
+    p.add_argument("--user-id", type=int, default=None, help="Only migrate this user's projects.")
+    p.set_defaults(func=migrate_layout)
+
+    p = subparsers.add_parser("source-store-stats", help="Show the global source store's size, sharing and work avoided.")
+    p.set_defaults(func=source_store_stats)
+
+    p = subparsers.add_parser("gc-sources", help="Delete global sources no project references any more.")
+    p.add_argument("--grace", type=float, default=None, help="Seconds an unreferenced source is kept after its last use.")
+    p.set_defaults(func=gc_sources)
+
+    p = subparsers.add_parser("queue-stats", help="Show depth and recent wait times of the Celery queues.")
+    p.set_defaults(func=queue_stats)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# services/admission.py
+
+import hashlib
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Tuple
+
+import redis
+from celery.signals import task_postrun
+
+from tele_notebook.core.config import settings
+
+"""
+Admission control for the bot: decides whether a request may enqueue a task.
+
+Two checks, both in Redis so they hold across bot restarts and instances:
+- In-flight deduplication. A request identical to one still being processed
+  (same user, project, command and topic) is not enqueued again. The key is
+  claimed with SET NX by the bot, travels with the task as the `inflight_key`
+  header and is released by the worker when the task finishes (or expires).
+- A token bucket per user and command class ("qa", "ingest", "media") with a
+  burst size and a refill rate per minute.
+
+If Redis is unreachable, requests are admitted rather than dropped.
+"""
+
+logger = logging.getLogger(__name__)
+
+INFLIGHT_PREFIX = "lumenote:inflight:"
+BUCKET_PREFIX = "lumenote:ratelimit:"
+
+# KEYS[1] = bucket; ARGV = capacity, refill per second, now.
+# Returns {1, 0} when a token was taken, else {0, seconds until the next token}.
+_TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - ts, 0) * rate)
+local allowed, wait = 0, 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(wait)}
+"""
+
+
+def _limits(command_class: str) -> Tuple[int, float, float]:
+    """(burst, refills per minute, task time limit) for a command class."""
+    if command_class == "qa":
+        return settings.RATE_LIMIT_QA_BURST, settings.RATE_LIMIT_QA_PER_MINUTE, settings.INTERACTIVE_TASK_TIME_LIMIT
+    if command_class == "ingest":
+        return settings.RATE_LIMIT_INGEST_BURST, settings.RATE_LIMIT_INGEST_PER_MINUTE, settings.INGEST_TASK_TIME_LIMIT
+    return settings.RATE_LIMIT_MEDIA_BURST, settings.RATE_LIMIT_MEDIA_PER_MINUTE, settings.MEDIA_TASK_TIME_LIMIT
+
+
+_redis = None
+_token_bucket = None
+
+
+def _get_redis() -> redis.Redis:
+    global _redis, _token_bucket
+    if _redis is None:
+        _redis = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+        _token_bucket = _redis.register_script(_TOKEN_BUCKET_LUA)
+    return _redis
+
+
+@dataclass
+class Admission:
+    status: str  # "ok", "duplicate" or "rate_limited"
+    headers: dict = field(default_factory=dict)  # pass to apply_async(headers=...)
+    retry_after: float = 0.0
+
+
+def inflight_key(user_id: int, project_name: str, command: str, topic: str) -> str:
+    digest = hashlib.sha256(f"{project_name}\0{command}\0{topic.strip().lower()}".encode("utf-8")).hexdigest()[:32]
+    return f"{INFLIGHT_PREFIX}{user_id}:{digest}"
+
+
+def admit(user_id: int, command_class: str, project_name: str, command: str, topic: str) -> Admission:
+    """Claims the in-flight slot for this request and takes a token from the user's bucket."""
+    if not settings.ADMISSION_CONTROL_ENABLED:
+        return Admission("ok")
+    burst, per_minute, time_limit = _limits(command_class)
+    key = inflight_key(user_id, project_name, command, topic)
+    try:
+        r = _get_redis()
+        # The TTL covers time in the queue plus the task's own time limit.
+        if not r.set(key, "1", nx=True, ex=int(time_limit * 2)):
+            return Admission("duplicate")
+        allowed, wait = _token_bucket(keys=[f"{BUCKET_PREFIX}{command_class}:{user_id}"], args=[burst, per_minute / 60.0, time.time()])
+        if not allowed:
+            r.delete(key)
+            return Admission("rate_limited", retry_after=float(wait))
+    except redis.RedisError as e:
+        logger.warning(f"Admission control unavailable, admitting request: {e}")
+        return Admission("ok")
+    return Admission("ok", headers={"inflight_key": key})
+
+
+def release(key: str) -> None:
+    try:
+        _get_redis().delete(key)
+    except redis.RedisError as e:
+        print(f"Could not release in-flight key {key}: {e}")
+
+
+def release_headers(headers: dict) -> None:
+    """Releases the in-flight key of an admitted request whose task was never enqueued."""
+    key = (headers or {}).get("inflight_key")
+    if key:
+        release(key)
+
+
+@task_postrun.connect
+def _release_inflight(task=None, **kwargs):
+    key = getattr(task.request, "inflight_key", None)
+    if key:
+        release(key)
@@ -0,0 +1,164 @@
+# services/answer_cache.py
+
+import asyncio
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+import numpy as np
+
+from tele_notebook.core.config import settings
+from tele_notebook.utils import sqlite_utils
+from tele_notebook.utils.disk_cache import cache_path
+
+"""
+Per-project cache of Q&A answers.
+
+Entries are scoped by (project, project version, language). The version is bumped
+on every ingest, so answers computed before new sources were added simply stop
+matching and are purged the next time that project stores an answer. A question
+hits the cache either by exact match of its normalized text or, when
+ANSWER_CACHE_SIMILARITY_THRESHOLD > 0, by cosine similarity of its embedding to
+a cached question of the same scope.
+"""
+
+EmbedQuery = Callable[[str], Awaitable[List[float]]]
+
+
+def normalize_question(question: str) -> str:
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip("?!. ")
+
+
+class AnswerCache:
+    def __init__(self, path: str, max_entries: int, max_per_project: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_per_project = max_per_project
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                " project TEXT NOT NULL, version INTEGER NOT NULL, language TEXT NOT NULL,"
+                " question_hash TEXT NOT NULL, question TEXT NOT NULL, embedding BLOB,"
+                " answer TEXT NOT NULL, last_access REAL NOT NULL,"
+                " PRIMARY KEY (project, version, language, question_hash))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS answers_last_access ON answers (last_access)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite_utils.connect(self.path)
+            self._local.conn = conn
+        return conn
+
+    def _get_exact(self, project: str, version: int, language: str, question_hash: str) -> Optional[str]:
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT answer FROM answers WHERE project = ? AND version = ? AND language = ? AND question_hash = ?",
+            (project, version, language, question_hash),
+        ).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute(
+                "UPDATE answers SET last_access = ? WHERE project = ? AND version = ? AND language = ? AND question_hash = ?",
+                (time.time(), project, version, language, question_hash),
+            )
+        return row[0]
+
+    def _get_nearest(self, project: str, version: int, language: str, embedding: List[float]) -> Optional[str]:
+        rows = self._conn().execute(
+            "SELECT answer, embedding FROM answers"
+            " WHERE project = ? AND version = ? AND language = ? AND embedding IS NOT NULL",
+            (project, version, language),
+        ).fetchall()
+        if not rows:
+            return None
+        matrix = np.stack([np.frombuffer(blob, dtype=np.float32) for _, blob in rows])
+        query = np.asarray(embedding, dtype=np.float32)
+        scores = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12)
+        best = int(np.argmax(scores))
+        if scores[best] >= settings.ANSWER_CACHE_SIMILARITY_THRESHOLD:
+            return rows[best][0]
+        return None
+
+    async def lookup(self, project: str, version: int, language: str, question: str,
+                     embed_query: Optional[EmbedQuery] = None) -> Tuple[Optional[str], Optional[List[float]]]:
+        """
+        Returns (answer or None, question embedding or None). The embedding is only
+        computed when similarity matching is on; pass it back to store() to reuse it.
+        """
+        question_hash = hashlib.sha256(normalize_question(question).encode("utf-8")).hexdigest()
+        answer = await asyncio.to_thread(self._get_exact, project, version, language, question_hash)
+        if answer is not None:
+            with self._lock:
+                self.exact_hits += 1
+            return answer, None
+
+        embedding = None
+        if settings.ANSWER_CACHE_SIMILARITY_THRESHOLD > 0 and embed_query is not None:
+            embedding = await embed_query(question)
+            answer = await asyncio.to_thread(self._get_nearest, project, version, language, embedding)
+            if answer is not None:
+                with self._lock:
+                    self.semantic_hits += 1
+                return answer, embedding
+        with self._lock:
+            self.misses += 1
+        return None, embedding
+
+    def _store(self, project: str, version: int, language: str, question: str, answer: str, embedding: Optional[List[float]]):
+        normalized = normalize_question(question)
+        question_hash = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        blob = np.asarray(embedding, dtype=np.float32).tobytes() if embedding is not None else None
+        with self._conn() as conn:
+            # Answers computed against older sources can never match again.
+            conn.execute("DELETE FROM answers WHERE project = ? AND version < ?", (project, version))
+            conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (project, version, language, question_hash, normalized, blob, answer, time.time()),
+            )
+            conn.execute(
+                "DELETE FROM answers WHERE rowid IN ("
+                " SELECT rowid FROM answers WHERE project = ? ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (project, self.max_per_project),
+            )
+            conn.execute(
+                "DELETE FROM answers WHERE rowid IN ("
+                " SELECT rowid FROM answers ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    async def store(self, project: str, version: int, language: str, question: str, answer: str,
+                    embedding: Optional[List[float]] = None) -> None:
+        await asyncio.to_thread(self._store, project, version, language, question, answer, embedding)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+            }
+
+
+_cache: Optional[AnswerCache] = None
+
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """The process-wide answer cache, or None when ANSWER_CACHE_ENABLED is off."""
+    global _cache
+    if _cache is None and settings.ANSWER_CACHE_ENABLED:
+        _cache = AnswerCache(cache_path("answers.sqlite3"), settings.ANSWER_CACHE_MAX_ENTRIES, settings.ANSWER_CACHE_MAX_PER_PROJECT)
+    return _cache
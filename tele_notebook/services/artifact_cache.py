@@ -0,0 +1,56 @@
+# services/artifact_cache.py
+
+import hashlib
+import json
+from typing import Optional
+
+from tele_notebook.core.config import settings
+from tele_notebook.utils.disk_cache import DiskLRUCache, cache_path
+
+"""
+Cache of generated podcasts and mind maps.
+
+An entry is keyed by (project, project version, kind, topic, language) and holds
+the generated source (podcast script or DOT) plus the Telegram file_id returned
+when the result was first uploaded. A repeat request resends the file_id, which
+costs no LLM, TTS, rendering or upload work. New ingests bump the project
+version, so they never hit artifacts built from older sources.
+"""
+
+_store: Optional[DiskLRUCache] = None
+
+
+def _get_store() -> Optional[DiskLRUCache]:
+    global _store
+    if _store is None and settings.ARTIFACT_CACHE_ENABLED:
+        _store = DiskLRUCache(cache_path("artifacts.sqlite3"), settings.ARTIFACT_CACHE_MAX_ENTRIES)
+    return _store
+
+
+def artifact_key(project: str, version: int, kind: str, topic: str, language: str) -> str:
+    topic = " ".join(topic.lower().split())
+    return hashlib.sha256(f"{project}\0{version}\0{kind}\0{topic}\0{language}".encode("utf-8")).hexdigest()
+
+
+def get(key: str) -> Optional[dict]:
+    """Returns {"source": ..., "file_id": ..., "send_as": ...} (file_id and send_as may be missing) or None."""
+    store = _get_store()
+    if store is None:
+        return None
+    value = store.get(key)
+    return json.loads(value) if value is not None else None
+
+
+def put(key: str, source: str, file_id: Optional[str] = None, send_as: Optional[str] = None) -> None:
+    """`send_as` records how file_id was sent (e.g. "photo" or "document"); Telegram only accepts it back the same way."""
+    store = _get_store()
+    if store is not None:
+        entry = {"source": source, "file_id": file_id}
+        if send_as is not None:
+            entry["send_as"] = send_as
+        store.set(key, json.dumps(entry).encode("utf-8"))
+
+
+def stats() -> dict:
+    store = _get_store()
+    return store.stats() if store is not None else {}
@@ -0,0 +1,95 @@
+# services/client_registry.py
+
+import asyncio
+import threading
+import weakref
+from typing import Any, Callable, Dict, Hashable
+
+import aiohttp
+from google import genai
+from langchain_google_genai import ChatGoogleGenerativeAI
+from tavily import TavilyClient
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+from tele_notebook.core.config import settings
+
+"""
+Long-lived API clients for worker processes.
+
+Clients are created lazily on first use and then reused across tasks, so their
+connection pools (and TLS sessions) stay warm. Thread-safe synchronous clients
+(genai.Client, TavilyClient) are shared by the whole process. Clients tied to an
+event loop (telegram.Bot, ChatGoogleGenerativeAI's async gRPC channel, aiohttp
+sessions, chains built on them) are kept per loop; with the shared worker loop
+that means once per process. aclose() tears down the current loop's clients and
+is registered as an AsyncRunner shutdown hook.
+"""
+
+_process_clients: Dict[Hashable, Any] = {}
+_process_lock = threading.Lock()
+_loop_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Hashable, Any]]" = weakref.WeakKeyDictionary()
+
+
+def _get_process_client(key: Hashable, factory: Callable[[], Any]) -> Any:
+    client = _process_clients.get(key)
+    if client is None:
+        with _process_lock:
+            client = _process_clients.get(key)
+            if client is None:
+                client = _process_clients[key] = factory()
+    return client
+
+
+def get_for_loop(key: Hashable, factory: Callable[[], Any]) -> Any:
+    """Returns the object cached under `key` for the running event loop, creating it if needed."""
+    clients = _loop_clients.setdefault(asyncio.get_running_loop(), {})
+    if key not in clients:
+        clients[key] = factory()
+    return clients[key]
+
+
+def get_genai_client() -> genai.Client:
+    return _get_process_client("genai", genai.Client)
+
+
+def get_tavily_client() -> TavilyClient:
+    return _get_process_client("tavily", lambda: TavilyClient(api_key=settings.TAVILY_API_KEY))
+
+
+def get_chat_model(model: str = "gemini-2.5-pro") -> ChatGoogleGenerativeAI:
+    return get_for_loop(("chat_model", model), lambda: ChatGoogleGenerativeAI(model=model))
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    return get_for_loop("http_session", lambda: aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=settings.HTTP_POOL_SIZE, keepalive_timeout=60)
+    ))
+
+
+async def get_bot() -> Bot:
+    """Returns the running loop's Bot; it is only published once initialize() has finished."""
+    clients = _loop_clients.setdefault(asyncio.get_running_loop(), {})
+    bot = clients.get("bot")
+    if bot is None:
+        async with get_for_loop("bot_lock", asyncio.Lock):
+            bot = clients.get("bot")
+            if bot is None:
+                bot = Bot(
+                    token=settings.TELEGRAM_BOT_TOKEN,
+                    request=HTTPXRequest(connection_pool_size=settings.HTTP_POOL_SIZE),
+                )
+                await bot.initialize()
+                clients["bot"] = bot
+    return bot
+
+
+async def aclose() -> None:
+    """Closes the clients that belong to the running event loop."""
+    clients = _loop_clients.pop(asyncio.get_running_loop(), {})
+    bot = clients.get("bot")
+    if bot is not None:
+        await bot.shutdown()
+    session = clients.get("http_session")
+    if session is not None:
+        await session.close()
@@ -0,0 +1,147 @@
+# services/context_packer.py
+
+import math
+import re
+from collections import Counter
+from typing import List, Optional
+
+from langchain_core.documents import Document
+
+from tele_notebook.core.config import settings
+
+"""
+Turns retrieved chunks into the context block of a prompt, for Q&A, podcasts
+and mind maps alike:
+
+1. Neighbouring chunks of the same source that overlap (the splitter repeats
+   up to chunk_overlap characters between chunks) are merged into one passage.
+2. Near-duplicate passages (mostly the same word shingles) are dropped.
+3. Passages are ordered by maximal marginal relevance: retrieval rank traded
+   off against similarity to the passages already picked.
+4. Passages are added in that order while they fit the task's token budget.
+"""
+
+CHARS_PER_TOKEN = 4  # rough estimate for Gemini tokenizers
+MIN_OVERLAP = 20  # shorter suffix/prefix matches are treated as coincidence
+MAX_OVERLAP = 400
+
+
+class _Passage:
+    def __init__(self, doc: Document, rank: int):
+        self.text = doc.page_content
+        self.source = doc.metadata.get("source_id") or doc.metadata.get("source")
+        self.rank = rank  # best retrieval rank among the chunks merged into it
+        self._terms: Optional[Counter] = None
+
+    @property
+    def terms(self) -> Counter:
+        if self._terms is None:
+            self._terms = Counter(re.findall(r"\w+", self.text.lower()))
+        return self._terms
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _overlap(a: str, b: str) -> int:
+    """Length of the longest suffix of `a` that is a prefix of `b` (0 if under MIN_OVERLAP)."""
+    tail = a[-MAX_OVERLAP:]
+    probe = b[:MIN_OVERLAP]
+    if len(probe) < MIN_OVERLAP:
+        return 0
+    index = tail.find(probe)
+    while index != -1:
+        if b.startswith(tail[index:]):
+            return len(tail) - index
+        index = tail.find(probe, index + 1)
+    return 0
+
+
+def _merge_neighbours(passages: List[_Passage]) -> List[_Passage]:
+    merged = True
+    while merged:
+        merged = False
+        for a in passages:
+            for b in passages:
+                if a is b or a.source is None or a.source != b.source:
+                    continue
+                size = _overlap(a.text, b.text)
+                if size:
+                    a.text += b.text[size:]
+                    a.rank = min(a.rank, b.rank)
+                    a._terms = None
+                    passages.remove(b)
+                    merged = True
+                    break
+            if merged:
+                break
+    return passages
+
+
+def _shingles(text: str, size: int = 5) -> set:
+    words = re.findall(r"\w+", text.lower())
+    return {" ".join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+
+
+def _drop_near_duplicates(passages: List[_Passage]) -> List[_Passage]:
+    """Keeps the better-ranked of two passages whose shingles mostly contain one another."""
+    kept, kept_shingles = [], []
+    for passage in sorted(passages, key=lambda p: p.rank):
+        shingles = _shingles(passage.text)
+        if any(len(shingles & other) / max(min(len(shingles), len(other)), 1) >= settings.CONTEXT_DEDUP_THRESHOLD
+               for other in kept_shingles):
+            continue
+        kept.append(passage)
+        kept_shingles.append(shingles)
+    return kept
+
+
+def _cosine(a: Counter, b: Counter) -> float:
+    dot = sum(count * b[term] for term, count in a.items() if term in b)
+    norm = math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values()))
+    return dot / norm if norm else 0.0
+
+
+def _mmr_order(passages: List[_Passage]) -> List[_Passage]:
+    """Orders passages by MMR; relevance comes from the retrieval rank, redundancy from term cosine."""
+    if not passages:
+        return []
+    worst = max(p.rank for p in passages) + 1
+    relevance = {id(p): 1.0 - p.rank / worst for p in passages}
+    remaining = sorted(passages, key=lambda p: p.rank)
+    ordered = [remaining.pop(0)]
+    lam = settings.CONTEXT_MMR_LAMBDA
+    while remaining:
+        best = max(remaining, key=lambda p: lam * relevance[id(p)] - (1 - lam) * max(_cosine(p.terms, q.terms) for q in ordered))
+        remaining.remove(best)
+        ordered.append(best)
+    return ordered
+
+
+def _budget(kind: str) -> int:
+    return {
+        "qa": settings.CONTEXT_BUDGET_QA,
+        "podcast": settings.CONTEXT_BUDGET_PODCAST,
+        "mindmap": settings.CONTEXT_BUDGET_MINDMAP,
+    }[kind]
+
+
+def pack_context(docs: List[Document], kind: str) -> str:
+    """Builds the context for a `kind` ("qa", "podcast" or "mindmap") prompt from retrieved docs, best first."""
+    passages = _merge_neighbours([_Passage(doc, rank) for rank, doc in enumerate(docs)])
+    passages = _drop_near_duplicates(passages)
+
+    budget = _budget(kind)
+    picked, used = [], 0
+    for passage in _mmr_order(passages):
+        cost = estimate_tokens(passage.text)
+        if used + cost > budget:
+            if picked:
+                continue  # a shorter passage further down may still fit
+            # Never send an empty context: cut the best passage down to the budget.
+            passage.text = passage.text[:budget * CHARS_PER_TOKEN]
+            cost = estimate_tokens(passage.text)
+        picked.append(passage)
+        used += cost
+    return "\n\n".join(passage.text for passage in picked)
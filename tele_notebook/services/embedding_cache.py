@@ -0,0 +1,79 @@
+# services/embedding_cache.py
+
+import asyncio
+import hashlib
+from array import array
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+from tele_notebook.core.config import settings
+from tele_notebook.utils.disk_cache import DiskLRUCache, cache_path
+
+
+def _encode(vector: List[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+def _decode(blob: bytes) -> List[float]:
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embeddings model with a content-addressed on-disk cache, in the
+    spirit of LangChain's CacheBackedEmbeddings. Document vectors are keyed by
+    the model name plus a SHA-256 of the chunk text, so the same chunk is only
+    sent to the API once no matter which user, project or process embeds it.
+    Queries are passed through uncached.
+    """
+
+    def __init__(self, underlying: Embeddings, model_name: str, store: DiskLRUCache):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.store = store
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, texts: List[str]):
+        keys = [self._key(text) for text in texts]
+        cached = self.store.get_many(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+        return keys, cached, missing
+
+    def _assemble(self, keys, cached, missing, vectors) -> List[List[float]]:
+        fresh = dict(zip(missing, vectors))
+        self.store.set_many((key, _encode(vector)) for key, vector in fresh.items())
+        return [fresh[key] if key in fresh else _decode(cached[key]) for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, cached, missing = self._lookup(texts)
+        vectors = self.underlying.embed_documents(list(missing.values())) if missing else []
+        return self._assemble(keys, cached, missing, vectors)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, cached, missing = await asyncio.to_thread(self._lookup, texts)
+        vectors = await self.underlying.aembed_documents(list(missing.values())) if missing else []
+        return await asyncio.to_thread(self._assemble, keys, cached, missing, vectors)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.underlying.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.underlying.aembed_query(text)
+
+    def stats(self) -> dict:
+        return self.store.stats()
+
+
+def with_cache(underlying: Embeddings, model_name: str) -> Embeddings:
+    """Returns `underlying` wrapped in the shared embedding cache, unless it is disabled."""
+    if not settings.EMBEDDING_CACHE_ENABLED:
+        return underlying
+    store = DiskLRUCache(cache_path("embeddings.sqlite3"), settings.EMBEDDING_CACHE_MAX_ENTRIES)
+    return CachedEmbeddings(underlying, model_name, store)
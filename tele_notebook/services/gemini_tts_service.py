@@ -1,78 +1,202 @@
 # tele_notebook/services/gemini_tts_service.py
 
 import asyncio
-from google import genai
+import math
+import re
+import time
+from array import array
+from typing import List, NamedTuple, Optional, Tuple
+
 from google.genai import types
 
 from tele_notebook.core.config import settings
-from tele_notebook.utils.audio_utils import convert_to_wav # We will need this again
+from tele_notebook.services import client_registry
+from tele_notebook.utils import metrics
+from tele_notebook.utils.audio_utils import encode_opus, parse_audio_mime_type, pcm_to_wav
+
+"""
+Podcast text-to-speech.
+
+The script is split into speaker turns ("Speaker 1: ...", "Speaker 2: ...") and
+every turn is synthesized as its own request, with one voice per speaker. Turns
+run concurrently (at most TTS_CONCURRENCY at a time), so the wall time is close
+to the slowest turn rather than the whole script. The raw PCM of each turn is
+then stitched back together in script order with a short pause between turns
+and encoded as an OGG/Opus voice note (or a WAV file, see PODCAST_AUDIO_FORMAT).
+"""
+
+TTS_MODEL = "models/gemini-2.5-pro" # Using a standard text model to generate the audio modality
+DEFAULT_MIME_TYPE = "audio/L16;rate=24000"
+
+# "Speaker 1:", "**Speaker 2:**", "Спикер 1:", "Speaker 1 (Anna):" or a one-word name such as "Anna:".
+_SPEAKER_LINE = re.compile(r"^\W*([^\W\d_]+\s*\d+|[^\W\d_]\w{0,20})(?:\s*\([^)]*\))?\W*:[*_\s]*(.*)$")
+_NUMBERED_SPEAKER = re.compile(r"\d+$")
+
+
+def _speaker_labels(lines: List[str]) -> List[Optional[Tuple[str, str]]]:
+    """
+    The (speaker, rest of line) each line starts with, or None. Numbered labels
+    ("Speaker 2") are always speakers. One-word names are speakers only in a
+    script with no numbered labels, and only if they start at least two lines,
+    so a stray "Note: ..." or "Example: ..." stays part of the current turn.
+    """
+    matches = []
+    for line in lines:
+        match = _SPEAKER_LINE.match(line)
+        matches.append((re.sub(r"\s+", " ", match.group(1)).title(), match.group(2)) if match else None)
+    names = [m[0] for m in matches if m is not None]
+    if any(_NUMBERED_SPEAKER.search(name) for name in names):
+        speakers = {name for name in names if _NUMBERED_SPEAKER.search(name)}
+    else:
+        speakers = {name for name in names if names.count(name) >= 2}
+    return [m if m is not None and m[0] in speakers else None for m in matches]
+
 
-def _blocking_generate_audio(script: str) -> bytes:
+def parse_speaker_turns(script: str) -> List[Tuple[str, str]]:
     """
-    Makes the blocking API call to Gemini TTS using the older, client-based SDK pattern.
-    This matches the provided example and will work with the installed library version.
+    Splits a script into (speaker, text) turns. A line like "Speaker 2: Hi" or
+    "**Anna:** Hi" starts a new turn; unlabelled lines continue the current one.
+    Text before the first label belongs to "Speaker 1".
     """
-    # 1. Instantiate the client. The API key is used automatically from the environment.
-    client = genai.Client()
-
-    # 2. Define the model and contents payload, as per the example.
-    model = "models/gemini-2.5-pro" # Using a standard text model to generate the audio modality
-    contents = [
-        types.Content(
-            role="user",
-            parts=[types.Part.from_text(text=script)],
-        ),
-    ]
-
-    # 3. Define the config to request audio output.
-    # We will use a single, high-quality voice for simplicity, as the multi-speaker
-    # configuration is complex and may not be fully supported in this older pattern
-    # without SSML.
-    generate_content_config = types.GenerateContentConfig(
-        response_modalities=["audio"],
-        speech_config=types.SpeechConfig(
-            voice_config=types.VoiceConfig(
-                prebuilt_voice_config=types.PrebuiltVoiceConfig(
-                    voice_name="Zephyr" # A high-quality standard voice
+    lines = [line.strip() for line in script.splitlines() if line.strip()]
+    turns: List[Tuple[str, List[str]]] = []
+    for line, label in zip(lines, _speaker_labels(lines)):
+        if label is not None:
+            speaker, text = label
+            turns.append((speaker, [text] if text else []))
+        elif turns:
+            turns[-1][1].append(line)
+        else:
+            turns.append(("Speaker 1", [line]))
+    return [(speaker, " ".join(lines)) for speaker, lines in turns if lines]
+
+
+def assign_voices(turns: List[Tuple[str, str]]) -> dict:
+    """Maps every speaker to a voice from TTS_VOICES, in order of first appearance."""
+    voices = [v.strip() for v in settings.TTS_VOICES.split(",") if v.strip()]
+    mapping = {}
+    for speaker, _ in turns:
+        if speaker not in mapping:
+            mapping[speaker] = voices[len(mapping) % len(voices)]
+    return mapping
+
+
+class GeminiTTSBackend:
+    """Synthesizes one turn with Gemini's audio output modality."""
+
+    def synthesize(self, text: str, voice: str) -> Tuple[bytes, str]:
+        """Returns (raw PCM, mime type) for `text` spoken by `voice`. Blocking."""
+        # Reuse the process-wide client. The API key is used automatically from the environment.
+        client = client_registry.get_genai_client()
+        contents = [types.Content(role="user", parts=[types.Part.from_text(text=text)])]
+        generate_content_config = types.GenerateContentConfig(
+            response_modalities=["audio"],
+            speech_config=types.SpeechConfig(
+                voice_config=types.VoiceConfig(
+                    prebuilt_voice_config=types.PrebuiltVoiceConfig(voice_name=voice)
                 )
-            )
-        ),
-    )
-
-    # 4. Call the streaming endpoint and collect the audio data chunks.
-    audio_chunks = []
-    mime_type = "audio/L16;rate=24000" # Default, in case we don't get it from the response
-
-    for chunk in client.models.generate_content_stream(
-        model=model,
-        contents=contents,
-        config=generate_content_config,
-    ):
-        if (
-            chunk.candidates is not None and
-            chunk.candidates[0].content is not None and
-            chunk.candidates[0].content.parts is not None and
-            chunk.candidates[0].content.parts[0].inline_data and
-            chunk.candidates[0].content.parts[0].inline_data.data
-        ):
-            inline_data = chunk.candidates[0].content.parts[0].inline_data
-            audio_chunks.append(inline_data.data)
-            # Store the mime type from the first audio chunk
-            if inline_data.mime_type:
-                mime_type = inline_data.mime_type
-
-    if not audio_chunks:
-        raise ValueError("Failed to generate audio content. No audio data received from Gemini API.")
-
-    # 5. Combine the chunks and create a proper WAV file.
-    raw_audio_data = b"".join(audio_chunks)
-    wav_audio_data = convert_to_wav(raw_audio_data, mime_type)
-    
-    return wav_audio_data
-
-async def generate_podcast_audio(script: str, language: str) -> bytes:
+            ),
+        )
+
+        audio_chunks = []
+        mime_type = DEFAULT_MIME_TYPE # Default, in case we don't get it from the response
+        for chunk in client.models.generate_content_stream(model=TTS_MODEL, contents=contents, config=generate_content_config):
+            if (
+                chunk.candidates is not None and
+                chunk.candidates[0].content is not None and
+                chunk.candidates[0].content.parts is not None and
+                chunk.candidates[0].content.parts[0].inline_data and
+                chunk.candidates[0].content.parts[0].inline_data.data
+            ):
+                inline_data = chunk.candidates[0].content.parts[0].inline_data
+                audio_chunks.append(inline_data.data)
+                # Store the mime type from the first audio chunk
+                if inline_data.mime_type:
+                    mime_type = inline_data.mime_type
+
+        if not audio_chunks:
+            raise ValueError("Failed to generate audio content. No audio data received from Gemini API.")
+        return b"".join(audio_chunks), mime_type
+
+
+class StubTTSBackend:
+    """
+    Offline stand-in for Gemini: returns a sine tone (pitch depends on the voice)
+    whose length follows the text, after sleeping like a real API call would.
+    Used with TTS_BACKEND=stub for local testing and by the TTS benchmark.
+    """
+
+    def __init__(self, latency: float = 0.0, latency_per_char: float = 0.0, chars_per_second: float = 15.0, rate: int = 24000):
+        self.latency = latency
+        self.latency_per_char = latency_per_char
+        self.chars_per_second = chars_per_second
+        self.rate = rate
+
+    def synthesize(self, text: str, voice: str) -> Tuple[bytes, str]:
+        time.sleep(self.latency + self.latency_per_char * len(text))
+        frequency = 180 + sum(map(ord, voice)) % 200
+        samples = int(self.rate * max(len(text), 1) / self.chars_per_second)
+        step = 2 * math.pi * frequency / self.rate
+        pcm = array("h", (int(8000 * math.sin(step * i)) for i in range(samples)))
+        return pcm.tobytes(), f"audio/L16;rate={self.rate}"
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = StubTTSBackend(latency=0.5) if settings.TTS_BACKEND == "stub" else GeminiTTSBackend()
+    return _backend
+
+
+class PodcastAudio(NamedTuple):
+    data: bytes
+    format: str  # "opus" or "wav"
+    duration: int  # seconds
+
+
+async def synthesize_script(script: str, backend=None, concurrency: int = None) -> Tuple[List[bytes], str]:
+    """
+    Synthesizes every speaker turn concurrently. Returns the PCM pieces in playback
+    order (turns with TTS_TURN_PAUSE_MS of silence in between) and their mime type.
+    The pieces are not joined here, so the encoder can consume them without a copy.
+    """
+    backend = backend or get_backend()
+    turns = parse_speaker_turns(script)
+    if not turns:
+        raise ValueError("The podcast script is empty.")
+    voices = assign_voices(turns)
+    semaphore = asyncio.Semaphore(concurrency or settings.TTS_CONCURRENCY)
+
+    async def synthesize_turn(speaker: str, text: str):
+        async with semaphore:
+            return await asyncio.to_thread(backend.synthesize, text, voices[speaker])
+
+    segments = await asyncio.gather(*(synthesize_turn(speaker, text) for speaker, text in turns))
+
+    mime_type = segments[0][1]
+    if any(parse_audio_mime_type(m) != parse_audio_mime_type(mime_type) for _, m in segments):
+        raise ValueError("TTS returned segments with different sample formats.")
+    params = parse_audio_mime_type(mime_type)
+    sample_width = params["bits_per_sample"] // 8
+    pause = bytes(params["rate"] * settings.TTS_TURN_PAUSE_MS // 1000 * sample_width)
+    parts = [segments[0][0]]
+    for pcm, _ in segments[1:]:
+        parts += [pause, pcm]
+    return parts, mime_type
+
+
+async def generate_podcast_audio(script: str, language: str) -> PodcastAudio:
     """
-    Generates podcast audio from a script using Gemini's TTS model.
+    Generates podcast audio from a two-speaker script, encoded per PODCAST_AUDIO_FORMAT.
     """
-    audio_bytes = await asyncio.to_thread(_blocking_generate_audio, script)
-    return audio_bytes
\ No newline at end of file
+    with metrics.span("tts"):
+        parts, mime_type = await synthesize_script(script)
+    params = parse_audio_mime_type(mime_type)
+    duration = round(sum(map(len, parts)) / (params["rate"] * params["bits_per_sample"] // 8))
+    with metrics.span("encode"):
+        if settings.PODCAST_AUDIO_FORMAT == "wav":
+            return PodcastAudio(pcm_to_wav(parts, mime_type), "wav", duration)
+        return PodcastAudio(await encode_opus(parts, mime_type, settings.PODCAST_OPUS_BITRATE), "opus", duration)
@@ -0,0 +1,162 @@
+# services/lexical_index.py
+
+import json
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+from tele_notebook.core.config import settings
+from tele_notebook.utils import sqlite_utils
+
+"""
+Per-project BM25 index over chunk text, for the lexical half of hybrid retrieval.
+
+Each Chroma collection gets its own SQLite file (<CHROMA_DB_PATH>/lexical/<collection>.sqlite3
+by default) holding the chunks plus an FTS5 index over their text; FTS5 ranks
+matches with BM25. Chunk IDs are the same content-addressed IDs used in Chroma,
+so ingest keeps both stores in step by adding and deleting the same IDs.
+
+The schema is created once, when a file is first written. Each thread keeps its
+most recently used connections open; searches go through read-only ones.
+"""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY, chunk_id TEXT UNIQUE NOT NULL, source_id TEXT,
+    content TEXT NOT NULL, metadata TEXT NOT NULL);
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+    content, content='chunks', content_rowid='id', tokenize='unicode61 remove_diacritics 2');
+CREATE TRIGGER IF NOT EXISTS chunks_ai AFTER INSERT ON chunks BEGIN
+    INSERT INTO chunks_fts(rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS chunks_ad AFTER DELETE ON chunks BEGIN
+    INSERT INTO chunks_fts(chunks_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+"""
+
+_MAX_OPEN_PER_THREAD = 16
+
+# (chunk id, source id, text, metadata)
+ChunkRow = Tuple[str, str, str, dict]
+
+
+def index_dir() -> str:
+    return settings.LEXICAL_INDEX_DIR or os.path.join(settings.CHROMA_DB_PATH, "lexical")
+
+
+def index_path(collection_name: str) -> str:
+    return os.path.join(index_dir(), f"{collection_name}.sqlite3")
+
+
+def exists(collection_name: str) -> bool:
+    return os.path.exists(index_path(collection_name))
+
+
+_local = threading.local()
+
+
+def _has_schema(conn: sqlite3.Connection) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunks_fts'").fetchone() is not None
+
+
+def _connection(collection_name: str, write: bool) -> Optional[sqlite3.Connection]:
+    """
+    Returns this thread's cached connection to the project's index. A reader gets
+    None while the index doesn't exist yet; a writer creates it. A cached
+    connection is reopened if the file was replaced or removed since it was opened.
+    """
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = OrderedDict()
+    path = index_path(collection_name)
+    try:
+        inode = os.stat(path).st_ino
+    except FileNotFoundError:
+        inode = None
+    key = (collection_name, write)
+    cached = conns.pop(key, None)
+    if cached is not None:
+        if cached[1] == inode:
+            conns[key] = cached
+            return cached[0]
+        cached[0].close()
+    if inode is None and not write:
+        return None
+    if write:
+        os.makedirs(index_dir(), exist_ok=True)
+        conn = sqlite_utils.connect(path)
+        if not _has_schema(conn):
+            conn.executescript(_SCHEMA)
+        inode = os.stat(path).st_ino
+    else:
+        conn = sqlite_utils.connect(path, read_only=True)
+        if not _has_schema(conn):
+            conn.close()  # created by a writer that hasn't set up the schema yet
+            return None
+    conns[key] = (conn, inode)
+    while len(conns) > _MAX_OPEN_PER_THREAD:
+        conns.popitem(last=False)[1][0].close()
+    return conn
+
+
+def _insert(conn: sqlite3.Connection, rows: Iterable[ChunkRow]) -> None:
+    conn.executemany(
+        "INSERT OR IGNORE INTO chunks (chunk_id, source_id, content, metadata) VALUES (?, ?, ?, ?)",
+        [(chunk_id, source_id, text, json.dumps(metadata, ensure_ascii=False)) for chunk_id, source_id, text, metadata in rows],
+    )
+
+
+def add_chunks(collection_name: str, rows: Iterable[ChunkRow]) -> None:
+    """Indexes chunks; IDs already present are left alone (same ID means same content)."""
+    rows = list(rows)
+    if not rows:
+        return
+    conn = _connection(collection_name, write=True)
+    with conn:
+        _insert(conn, rows)
+
+
+def delete_chunks(collection_name: str, chunk_ids: Iterable[str]) -> None:
+    chunk_ids = [(chunk_id,) for chunk_id in chunk_ids]
+    if not chunk_ids or not exists(collection_name):
+        return
+    conn = _connection(collection_name, write=True)
+    with conn:
+        conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", chunk_ids)
+
+
+def rebuild(collection_name: str, rows: Iterable[ChunkRow]) -> None:
+    """
+    Replaces the project's index with `rows` (used to backfill projects ingested
+    before the index existed). One transaction, so searches see the old or the new index.
+    """
+    conn = _connection(collection_name, write=True)
+    with conn:
+        conn.execute("DELETE FROM chunks")
+        _insert(conn, rows)
+
+
+def build_match_query(query: str) -> str:
+    """An FTS5 query matching any of the query's words (quoted, so user input can't inject FTS syntax)."""
+    terms = dict.fromkeys(term.lower() for term in re.findall(r"\w+", query))
+    return " OR ".join(f'"{term}"' for term in terms)
+
+
+def search(collection_name: str, query: str, k: int) -> List[Tuple[str, str, dict]]:
+    """Top `k` chunks by BM25 as (chunk id, text, metadata), best first."""
+    match = build_match_query(query)
+    if not match:
+        return []
+    conn = _connection(collection_name, write=False)
+    if conn is None:
+        return []
+    rows = conn.execute(
+        "SELECT c.chunk_id, c.content, c.metadata FROM chunks_fts"
+        " JOIN chunks c ON c.id = chunks_fts.rowid"
+        " WHERE chunks_fts MATCH ? ORDER BY rank LIMIT ?",
+        (match, k),
+    ).fetchall()
+    return [(chunk_id, text, json.loads(metadata)) for chunk_id, text, metadata in rows]
@@ -1,63 +1,78 @@
 # services/llm_service.py
 
+import asyncio
+import time
+from typing import AsyncIterator, List, Optional
+
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_community.tools.tavily_search import TavilySearchResults # <-- ADD IMPORT
-from tele_notebook.utils import prompts
-from langchain_core.documents import Document  # <-- ADD THIS IMPORT
-
-import asyncio # <--- ADD THIS IMPORT
-from tavily import TavilyClient # <--- ADD THIS IMPORT
-from tele_notebook.core.config import settings # <--- ADD THIS IMPORT
-
-# REMOVE the global llm object
-# llm = ChatGoogleGenerativeAI(model="gemini-2.5-pro")
-
-async def get_rag_response(retriever, question: str, language: str) -> str:
-    # CREATE the llm object here, inside the async function
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-pro") # Note: I've updated to 1.5-pro as it's generally better.
-    prompt = prompts.get_qa_prompt(language)
-
-    rag_chain = (
-        {"context": retriever, "input": RunnablePassthrough()}
-        | prompt
-        | llm
-        | StrOutputParser()
-    )
-    return await rag_chain.ainvoke(question)
+from langchain_core.runnables import Runnable
+from tele_notebook.core.config import settings
+from tele_notebook.services import client_registry, context_packer, rag_service
+from tele_notebook.utils import metrics, prompts
+
+LLM_MODEL = "gemini-2.5-pro"
+
+_PROMPTS = {
+    "qa": prompts.get_qa_prompt,
+    "podcast": prompts.get_podcast_prompt,
+    "mindmap": prompts.get_mindmap_prompt,
+}
+
+def _get_chain(kind: str, language: str) -> Runnable:
+    """
+    Returns the prompt | llm | parser chain for (kind, language), built once and
+    reused. Chains hold the loop-bound LLM client, so they are cached per event loop.
+    """
+    def build():
+        return _PROMPTS[kind](language) | client_registry.get_chat_model(LLM_MODEL) | StrOutputParser()
+    return client_registry.get_for_loop(("chain", kind, language), build)
+
+def format_docs(docs) -> str:
+    return "\n\n".join(doc.page_content for doc in docs)
+
+def build_context(docs, kind: str) -> str:
+    """The prompt context for retrieved docs: packed to the task's token budget, or plainly joined."""
+    with metrics.span("pack"):
+        if settings.CONTEXT_PACKING:
+            return context_packer.pack_context(docs, kind)
+        return format_docs(docs)
+
+async def _retrieve(retriever, query: str, query_vector: Optional[List[float]] = None):
+    # Only the hybrid retriever takes a precomputed query embedding.
+    kwargs = {"query_vector": query_vector} if query_vector is not None and isinstance(retriever, rag_service.HybridRetriever) else {}
+    with metrics.span("retrieve"):
+        return await retriever.ainvoke(query, **kwargs)
+
+async def _generate(kind: str, language: str, inputs: dict) -> str:
+    with metrics.span("llm"):
+        return await _get_chain(kind, language).ainvoke(inputs)
+
+async def get_rag_response(retriever, question: str, language: str, query_vector: Optional[List[float]] = None) -> str:
+    """`query_vector`, the question's embedding if it was already computed, saves embedding it again."""
+    docs = await _retrieve(retriever, question, query_vector)
+    return await _generate("qa", language, {"context": build_context(docs, "qa"), "input": question})
+
+async def stream_rag_response(retriever, question: str, language: str, query_vector: Optional[List[float]] = None) -> AsyncIterator[str]:
+    """Like get_rag_response(), but yields the answer in chunks as the model generates it."""
+    docs = await _retrieve(retriever, question, query_vector)
+    context = build_context(docs, "qa")
+    # The "llm" stage excludes the time the consumer spends between chunks (editing the Telegram message).
+    started, consumer = time.perf_counter(), 0.0
+    try:
+        async for chunk in _get_chain("qa", language).astream({"context": context, "input": question}):
+            paused = time.perf_counter()
+            yield chunk
+            consumer += time.perf_counter() - paused
+    finally:
+        metrics.record("llm", time.perf_counter() - started - consumer)
 
 async def generate_podcast_script(retriever, topic: str, language:str) -> str:
-    # CREATE the llm object here, inside the async function
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-pro")
-    prompt = prompts.get_podcast_prompt(language)
-
-    def format_docs(docs):
-        return "\n\n".join(doc.page_content for doc in docs)
-
-    chain = (
-        {"context": retriever | format_docs, "topic": RunnablePassthrough()}
-        | prompt
-        | llm
-        | StrOutputParser()
-    )
-    return await chain.ainvoke(topic)
+    docs = await _retrieve(retriever, topic)
+    return await _generate("podcast", language, {"context": build_context(docs, "podcast"), "topic": topic})
 
 async def generate_mindmap_dot(retriever, topic: str, language: str) -> str:
-    # CREATE the llm object here, inside the async function
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-pro")
-    prompt = prompts.get_mindmap_prompt(language)
-
-    def format_docs(docs):
-        return "\n\n".join(doc.page_content for doc in docs)
-
-    chain = (
-        {"context": retriever | format_docs, "topic": RunnablePassthrough()}
-        | prompt
-        | llm
-        | StrOutputParser()
-    )
-    response = await chain.ainvoke(topic)
+    docs = await _retrieve(retriever, topic)
+    response = await _generate("mindmap", language, {"context": build_context(docs, "mindmap"), "topic": topic})
     # Clean up the response to extract only the DOT code
     if "```dot" in response:
         return response.split("```dot")[1].split("```")[0].strip()
@@ -65,12 +80,10 @@ async def generate_mindmap_dot(retriever, topic: str, language: str) -> str:
 
 
 def _blocking_tavily_search(topic: str) -> dict:
-    """Performs a synchronous search using the TavilyClient."""
-    tavily_client = TavilyClient(api_key=settings.TAVILY_API_KEY)
-    
-    # --- THIS IS THE KEY CHANGE ---
-    # We now explicitly ask for the content of each page.
-    # We also specify the number of results we want.
+    """Performs a synchronous search using the shared TavilyClient."""
+    tavily_client = client_registry.get_tavily_client()
+
+    # We explicitly ask for the content of each page and the number of results we want.
     response = tavily_client.search(
         query=topic, 
         search_depth="basic",
@@ -83,6 +96,7 @@ async def discover_sources(topic: str) -> list[dict]:
     """
     Uses Tavily to search for sources and their content on a given topic.
     """
-    response_dict = await asyncio.to_thread(_blocking_tavily_search, topic)
+    with metrics.span("search"):
+        response_dict = await asyncio.to_thread(_blocking_tavily_search, topic)
     # Return the list of results from the JSON response
-    return response_dict.get("results", [])
\ No newline at end of file
+    return response_dict.get("results", [])
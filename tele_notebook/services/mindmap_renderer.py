@@ -0,0 +1,274 @@
+# services/mindmap_renderer.py
+
+import asyncio
+import hashlib
+import math
+import re
+import struct
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from tele_notebook.core.config import settings
+from tele_notebook.services import client_registry
+from tele_notebook.utils import metrics
+from tele_notebook.utils.disk_cache import DiskLRUCache, cache_path
+
+"""
+Renders mind maps from the DOT the model writes, without touching the disk.
+
+The model's reply is reduced to its first graph and normalized: fences, prose
+and comments are dropped, as are attributes that make Graphviz read local files
+(image, shapefile, ...) or pick its own resolution. Braces, quotes and HTML
+labels must balance. The normalized DOT is piped into `dot` and the PNG or SVG
+is read back from its stdout; at most MINDMAP_RENDER_CONCURRENCY `dot`
+processes run at once per worker, each with a timeout. A PNG that is over
+Telegram's photo limits is rendered once more at a lower resolution. Results
+are cached by a hash of the normalized DOT, so the same graph is never
+rendered twice.
+"""
+
+FORMATS = ("png", "svg")
+MIN_DPI = 36
+MAX_PHOTO_ASPECT = 20  # Telegram rejects photos more elongated than this
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Attributes that read local files or override the resolution we render at.
+_DROPPED_ATTRIBUTES = {"image", "imagepath", "shapefile", "fontpath", "dpi", "resolution"}
+# A graph header at the start of a line: [strict] (di)graph [ID] {. The word
+# "graph" in the surrounding prose must not match.
+_GRAPH_START = re.compile(
+    r'(?:^|\n)[ \t]*((?:strict\s+)?(?:di)?graph(?:\s*"(?:[^"\\]|\\.)*"|\s+[\w.]+)?\s*\{)', re.IGNORECASE
+)
+
+_store: Optional[DiskLRUCache] = None
+
+
+class RenderError(Exception):
+    """The mind map could not be rendered; the message is safe to show to the user."""
+
+
+@dataclass
+class RenderedMindmap:
+    data: bytes
+    format: str
+    from_cache: bool
+
+    @property
+    def size(self) -> Optional[Tuple[int, int]]:
+        """(width, height) in pixels of a PNG, None for SVG."""
+        return png_size(self.data) if self.format == "png" else None
+
+    @property
+    def fits_photo(self) -> bool:
+        """Whether Telegram accepts it as a photo (otherwise send it as a document)."""
+        size = self.size
+        return size is not None and max(size) <= MAX_PHOTO_ASPECT * max(1, min(size))
+
+
+def _get_store() -> Optional[DiskLRUCache]:
+    global _store
+    if _store is None and settings.MINDMAP_CACHE_ENABLED:
+        _store = DiskLRUCache(cache_path("mindmaps.sqlite3"), settings.MINDMAP_CACHE_MAX_ENTRIES)
+    return _store
+
+
+def png_size(data: bytes) -> Optional[Tuple[int, int]]:
+    if len(data) < 24 or not data.startswith(PNG_SIGNATURE):
+        return None
+    return struct.unpack(">II", data[16:24])
+
+
+def _tokenize(text: str, start: int) -> List[Tuple[str, str]]:
+    """
+    Splits the graph starting at `start` into (kind, text) tokens, up to and
+    including its closing brace. Kinds: "string" (quoted or HTML), "id", "space"
+    and "punct"; comments are dropped.
+    """
+    tokens: List[Tuple[str, str]] = []
+    depth = 0
+    i = start
+    while i < len(text):
+        c = text[i]
+        if c == '"':
+            end = i + 1
+            while end < len(text) and text[end] != '"':
+                end += 2 if text[end] == "\\" else 1
+            if end >= len(text):
+                raise RenderError("The mind map has an unterminated string.")
+            tokens.append(("string", text[i:end + 1]))
+            i = end + 1
+        elif c == "<":
+            nesting, end = 0, i
+            while end < len(text):
+                nesting += {"<": 1, ">": -1}.get(text[end], 0)
+                if nesting == 0:
+                    break
+                end += 1
+            if nesting:
+                raise RenderError("The mind map has an unterminated HTML label.")
+            tokens.append(("string", text[i:end + 1]))
+            i = end + 1
+        elif text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            if end < 0:
+                raise RenderError("The mind map has an unterminated comment.")
+            i = end + 2
+        elif text.startswith("//", i) or (c == "#" and (i == 0 or text[i - 1] == "\n")):
+            end = text.find("\n", i)
+            i = len(text) if end < 0 else end
+        elif c.isspace():
+            end = i
+            while end < len(text) and text[end].isspace():
+                end += 1
+            tokens.append(("space", "\n" if "\n" in text[i:end] else " "))
+            i = end
+        elif c.isalnum() or c in "_." or ord(c) > 127:
+            end = i
+            while end < len(text) and (text[end].isalnum() or text[end] in "_." or ord(text[end]) > 127):
+                end += 1
+            tokens.append(("id", text[i:end]))
+            i = end
+        else:
+            tokens.append(("punct", c))
+            i += 1
+            if c == "{":
+                depth += 1
+            elif c == "}":
+                depth -= 1
+                if depth == 0:
+                    return tokens
+    raise RenderError("The mind map's braces don't balance.")
+
+
+def _drop_attributes(tokens: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    def next_solid(j: int) -> int:
+        while j < len(tokens) and tokens[j][0] == "space":
+            j += 1
+        return j
+
+    kept = []
+    i = 0
+    while i < len(tokens):
+        kind, value = tokens[i]
+        if kind == "id" and value.lower() in _DROPPED_ATTRIBUTES:
+            eq = next_solid(i + 1)
+            if eq < len(tokens) and tokens[eq] == ("punct", "="):
+                end = next_solid(eq + 1) + 1  # past the value
+                separator = next_solid(end)
+                if separator < len(tokens) and tokens[separator] in (("punct", ","), ("punct", ";")):
+                    end = separator + 1
+                else:
+                    while kept and kept[-1][0] == "space":
+                        kept.pop()
+                    if kept and kept[-1] == ("punct", ","):
+                        kept.pop()  # it was the last attribute of a list
+                i = end
+                continue
+        kept.append(tokens[i])
+        i += 1
+    return kept
+
+
+def _join(tokens: List[Tuple[str, str]]) -> str:
+    """Canonical spacing: a space only where two IDs or strings meet, a line break after ; { and }."""
+    solid = [token for token in tokens if token[0] != "space"]
+    parts = []
+    for previous, (kind, value) in zip([None] + solid, solid):
+        if previous is not None and previous[0] in ("id", "string") and kind in ("id", "string"):
+            parts.append(" ")
+        parts.append(value)
+        if value in (";", "{", "}") and kind == "punct":
+            parts.append("\n")
+    return "".join(parts).strip()
+
+
+def normalize_dot(text: str) -> str:
+    """
+    The first graph in `text` (a model reply, possibly fenced or surrounded by
+    prose) as canonical DOT: comments and unsafe attributes removed and
+    whitespace normalized, so equivalent replies hash alike. Raises RenderError
+    if there is no well-formed graph.
+    """
+    if len(text.encode("utf-8")) > settings.MINDMAP_MAX_DOT_BYTES:
+        raise RenderError(f"The mind map is larger than {settings.MINDMAP_MAX_DOT_BYTES // 1000} KB of DOT.")
+    match = _GRAPH_START.search(text)
+    if match is None:
+        raise RenderError("The model did not return a DOT graph.")
+    return _join(_drop_attributes(_tokenize(text, match.start(1))))
+
+
+def render_key(dot: str, fmt: str) -> str:
+    return hashlib.sha256(f"{fmt}\0{settings.MINDMAP_DPI}\0{dot}".encode("utf-8")).hexdigest()
+
+
+async def _run_dot(dot: bytes, fmt: str, dpi: int) -> bytes:
+    """Pipes `dot` through Graphviz and returns its output, one of at most MINDMAP_RENDER_CONCURRENCY at a time."""
+    slots = client_registry.get_for_loop(("dot_renders",), lambda: asyncio.Semaphore(settings.MINDMAP_RENDER_CONCURRENCY))
+    command = ["dot", f"-T{fmt}"] + ([f"-Gdpi={dpi}"] if fmt == "png" else [])
+    async with slots:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+            )
+        except FileNotFoundError:
+            raise RenderError("Graphviz is not installed on this worker.") from None
+        try:
+            output, errors = await asyncio.wait_for(process.communicate(dot), settings.MINDMAP_RENDER_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise RenderError(f"Rendering took longer than {settings.MINDMAP_RENDER_TIMEOUT:.0f}s.") from None
+        finally:
+            if process.returncode is None:  # timed out or cancelled
+                process.kill()
+                await process.wait()
+    if process.returncode != 0:
+        message = errors.decode(errors="replace").strip().splitlines()
+        raise RenderError(f"Graphviz could not render the mind map: {message[0] if message else process.returncode}")
+    return output
+
+
+def _oversize(data: bytes, fmt: str) -> Optional[float]:
+    """By how much the output's pixel dimensions exceed the limits (None if within them)."""
+    factors = []
+    if len(data) > settings.MINDMAP_MAX_OUTPUT_BYTES:
+        factors.append(math.sqrt(len(data) / settings.MINDMAP_MAX_OUTPUT_BYTES))  # bytes grow with the area
+    size = png_size(data) if fmt == "png" else None
+    if size is not None and sum(size) > settings.MINDMAP_MAX_DIMENSIONS:
+        factors.append(sum(size) / settings.MINDMAP_MAX_DIMENSIONS)
+    return max(factors) * 1.05 if factors else None
+
+
+async def _render_within_limits(dot: bytes, fmt: str) -> bytes:
+    dpi = settings.MINDMAP_DPI
+    data = await _run_dot(dot, fmt, dpi)
+    scale = _oversize(data, fmt)
+    if scale is not None and fmt == "png" and dpi > MIN_DPI:
+        dpi = max(MIN_DPI, int(dpi / scale))
+        data = await _run_dot(dot, fmt, dpi)
+        scale = _oversize(data, fmt)
+    if scale is not None:
+        raise RenderError("The mind map is too large to send. Try a narrower topic.")
+    return data
+
+
+async def render(dot_text: str, fmt: Optional[str] = None) -> RenderedMindmap:
+    """Validates, normalizes and renders the model's DOT to PNG or SVG bytes (MINDMAP_FORMAT by default)."""
+    fmt = fmt or settings.MINDMAP_FORMAT
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported mind map format: {fmt}")
+    dot = await asyncio.to_thread(normalize_dot, dot_text)
+    key = render_key(dot, fmt)
+    store = _get_store()
+    cached = await asyncio.to_thread(store.get, key) if store is not None else None
+    if cached is not None:
+        return RenderedMindmap(cached, fmt, True)
+    with metrics.span("render"):
+        data = await _render_within_limits(dot.encode("utf-8"), fmt)
+    if store is not None:
+        await asyncio.to_thread(store.set, key, data)
+    return RenderedMindmap(data, fmt, False)
+
+
+def stats() -> dict:
+    store = _get_store()
+    return store.stats() if store is not None else {}
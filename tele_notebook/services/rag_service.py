@@ -2,14 +2,30 @@
 
 import chromadb
 from chromadb.config import Settings as ChromaSettings
+from chromadb.types import SegmentScope
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
 from langchain_core.documents import Document
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStoreRetriever
+from langchain_community.document_loaders import TextLoader
 from langchain_community.vectorstores import Chroma
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from tele_notebook.core.config import settings
+from tele_notebook.services import embedding_cache, lexical_index, source_store
+from tele_notebook.utils import metrics
+from tele_notebook.utils.disk_cache import DiskLRUCache, cache_path
+from tele_notebook.utils.residency import ResidencyCache
+import asyncio
+import contextlib
+import hashlib
 import os
 import re # <-- ADD THIS IMPORT
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+from pypdf import PdfReader
 from unidecode import unidecode # <-- ADD THIS IMPORT
 
 client = chromadb.PersistentClient(
@@ -17,7 +33,14 @@ client = chromadb.PersistentClient(
     settings=ChromaSettings(anonymized_telemetry=False)
 )
 
-embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+EMBEDDING_MODEL = "models/embedding-001"
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+embeddings = embedding_cache.with_cache(GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL), EMBEDDING_MODEL)
+
+def embedding_cache_stats() -> dict:
+    """Hit/miss counters of the embedding cache in this process ({} when disabled)."""
+    return embeddings.stats() if isinstance(embeddings, embedding_cache.CachedEmbeddings) else {}
 
 def get_collection_name(user_id: int, project_name: str) -> str:
     """
@@ -37,61 +60,745 @@ def get_collection_name(user_id: int, project_name: str) -> str:
 
     return f"user_{user_id}_{slug}"
 
-# NEW: Create an async version of the document processing function
-async def async_add_document_to_project(user_id: int, project_name: str, file_path: str, file_type: str):
-    """Processes and adds a document to the user's project vector store asynchronously."""
+# Awaited with (pages_done, total_pages) while a document is being ingested.
+ProgressCallback = Callable[[int, int], Awaitable[None]]
+
+@dataclass
+class IngestStats:
+    """Chunk counts from an ingest. `updated` counts new chunks written into a source that was already present."""
+    added: int = 0
+    updated: int = 0
+    skipped: int = 0
+    deleted: int = 0
+
+    def __add__(self, other: "IngestStats") -> "IngestStats":
+        return IngestStats(self.added + other.added, self.updated + other.updated,
+                           self.skipped + other.skipped, self.deleted + other.deleted)
+
+    def summary(self) -> str:
+        summary = f"{self.added} added, {self.updated} updated, {self.skipped} unchanged"
+        return summary + (f", {self.deleted} removed" if self.deleted else "")
+
+# Chroma creates a collection and its segments in separate steps; a concurrent
+# get_or_create can return the collection before its segments exist.
+_collection_lock = threading.Lock()
+
+def _get_collection(collection_name: str):
+    # Vectors are computed by us (through the embedding cache), so Chroma needs no embedding function.
+    with _collection_lock:
+        return client.get_or_create_collection(collection_name, embedding_function=None)
+
+# --- Collection layout ---
+# With COLLECTION_LAYOUT=sharded, projects share COLLECTION_SHARDS collections
+# instead of having one each. A project's chunks carry `user_id` and `project`
+# metadata, every read filters on `project`, and their Chroma IDs are prefixed
+# with the project's collection name so equal chunks of two projects never collide.
+# Everything above Chroma (lexical index, caches, source store) keeps naming a
+# project by get_collection_name(), in both layouts.
+
+SHARD_PREFIX = "shard_"
+
+# Projects known to have no per-project collection. Only consulted in the
+# sharded layout, where such a collection is never created again.
+_without_own_collection: set = set()
+
+@dataclass
+class ProjectLocation:
+    """The collection holding a project's chunks, and how to address them inside it."""
+    collection: Any
+    where: Optional[dict] = None  # selects the project's chunks in a shared collection
+    metadata: Optional[dict] = None  # stamped on every chunk written
+    id_prefix: str = ""
+
+    def filter(self, condition: Optional[dict] = None) -> Optional[dict]:
+        """The project's filter combined with `condition`."""
+        if self.where is None or condition is None:
+            return self.where or condition
+        return {"$and": [self.where, condition]}
+
+    def to_chroma(self, chunk_ids) -> list:
+        return [self.id_prefix + chunk_id for chunk_id in chunk_ids]
+
+    def from_chroma(self, chunk_ids) -> list:
+        return [chunk_id[len(self.id_prefix):] for chunk_id in chunk_ids]
+
+    def stamp(self, metadatas) -> list:
+        return [{**metadata, **(self.metadata or {})} for metadata in metadatas]
+
+    def count(self) -> int:
+        if self.where is None:
+            return self.collection.count()
+        return len(self.collection.get(where=self.where, include=[])["ids"])
+
+def shard_name(collection_name: str) -> str:
+    digest = hashlib.sha256(collection_name.encode("utf-8")).hexdigest()
+    return f"{SHARD_PREFIX}{int(digest[:8], 16) % settings.COLLECTION_SHARDS:03d}"
+
+def _existing_collection(name: str):
+    try:
+        return client.get_collection(name)
+    except ValueError:
+        return None
+
+def sharded_location(collection_name: str, create: bool = True) -> Optional[ProjectLocation]:
+    """The project's place in its shard (None if the shard doesn't exist and `create` is False)."""
+    collection = _open_collection(shard_name(collection_name), create)
+    if collection is None:
+        return None
+    match = re.match(r"user_(\d+)_", collection_name)
+    user_id = int(match.group(1)) if match else 0
+    return ProjectLocation(
+        collection,
+        # The collection name includes the user ID, so it alone isolates the project; one
+        # metadata condition is also markedly cheaper for Chroma than an $and of two.
+        where={"project": collection_name},
+        metadata={"user_id": user_id, "project": collection_name},
+        id_prefix=f"{collection_name}/",
+    )
+
+def locate_project(collection_name: str, create: bool = False) -> Optional[ProjectLocation]:
+    """
+    Where the project's chunks are stored in the configured layout, or None if
+    it has nothing stored yet (`create` makes the collection instead). In the
+    sharded layout, a project whose own collection has not been moved by
+    `manage migrate-layout` yet keeps using that collection.
+    """
+    if settings.COLLECTION_LAYOUT == "sharded":
+        if collection_name not in _without_own_collection:
+            own = _existing_collection(collection_name)
+            if own is not None:
+                return ProjectLocation(own)
+            _without_own_collection.add(collection_name)
+        return sharded_location(collection_name, create)
+    collection = _open_collection(collection_name, create)
+    return ProjectLocation(collection) if collection is not None else None
+
+def _paged_get(collection, where: Optional[dict] = None, include: Optional[list] = None, page_size: int = 1000) -> Iterator[dict]:
+    offset = 0
+    while True:
+        page = collection.get(where=where, offset=offset, limit=page_size, include=include or [])
+        yield page
+        if len(page["ids"]) < page_size:
+            return
+        offset += page_size
+
+def list_project_collections() -> Dict[str, int]:
+    """Chunk counts of every project stored in Chroma, by collection name, in either layout."""
+    own, sharded = {}, {}
+    for collection in client.list_collections():
+        if not collection.name.startswith(SHARD_PREFIX):
+            own[collection.name] = collection.count()
+            continue
+        for page in _paged_get(collection, include=["metadatas"], page_size=5000):
+            for metadata in page["metadatas"]:
+                project = (metadata or {}).get("project")
+                if project:
+                    sharded[project] = sharded.get(project, 0) + 1
+    # A project being migrated is read from its own collection until that is deleted.
+    return {**sharded, **own}
+
+def migrate_collection_to_shard(collection_name: str, max_passes: int = 5) -> Tuple[int, bool]:
+    """
+    Moves a per-project collection into its shard, with its stored embeddings.
+    Each pass copies the chunks the shard is missing and removes the ones the
+    collection no longer has; once a pass finds nothing to do the collection is
+    deleted. Readers keep using the collection until then, so this runs while
+    the bot is serving. Returns (chunks copied, whether the collection was moved);
+    a project still being written to after `max_passes` is left in place.
+    """
+    source = client.get_collection(collection_name)
+    target = sharded_location(collection_name)
+    copied = 0
+    for _ in range(max_passes):
+        source_ids = {chunk_id for page in _paged_get(source) for chunk_id in page["ids"]}
+        target_ids = {
+            chunk_id for page in _paged_get(target.collection, where=target.where)
+            for chunk_id in target.from_chroma(page["ids"])
+        }
+        missing, removed = source_ids - target_ids, target_ids - source_ids
+        if not missing and not removed:
+            client.delete_collection(collection_name)
+            _resident_collections.discard(collection_name)
+            _without_own_collection.add(collection_name)
+            return copied, True
+        for batch in _batched(sorted(missing), settings.INGEST_BATCH_SIZE * 4):
+            rows = source.get(ids=batch, include=["embeddings", "documents", "metadatas"])
+            target.collection.upsert(
+                ids=target.to_chroma(rows["ids"]), embeddings=rows["embeddings"],
+                documents=rows["documents"], metadatas=target.stamp(m or {} for m in rows["metadatas"]),
+            )
+            copied += len(rows["ids"])
+        if removed:
+            target.collection.delete(ids=target.to_chroma(removed))
+    return copied, False
+
+# --- Residency ---
+# Chroma keeps the vector index of every collection a process has touched in
+# memory, so a long-lived worker grows with the number of projects it serves.
+# Opened collections are kept in an LRU bounded by RESIDENT_COLLECTIONS and
+# RESIDENT_COLLECTION_BYTES (the index's size on disk, which is what Chroma
+# loads); an evicted collection's index is unloaded and read back from disk on
+# its next use. Retrievers are reused per project, and the projects asked about
+# most recently are recorded so a restarted worker can load them up front.
+
+ACTIVITY_MAX_ENTRIES = 10000
+
+def _vector_segments(collection) -> list:
+    """The collection's vector segments ([] with a Chroma that doesn't expose its segment manager)."""
+    sysdb = getattr(getattr(client._server, "_manager", None), "_sysdb", None)
+    if sysdb is None:
+        return []
+    return sysdb.get_segments(collection=collection.id, scope=SegmentScope.VECTOR)
+
+def _index_bytes(collection) -> int:
+    total = 0
+    for segment in _vector_segments(collection):
+        for root, _, names in os.walk(os.path.join(settings.CHROMA_DB_PATH, str(segment["id"]))):
+            total += sum(os.path.getsize(os.path.join(root, name)) for name in names)
+    return total
+
+def _unload_collection(name: str, collection) -> None:
+    """
+    Drops the collection's loaded vector index, the way Chroma's own LRU segment
+    cache evicts one. Chroma's LRU (chroma_segment_cache_policy) is not used
+    because in 0.4.24 it re-measures every loaded index on disk at each load.
+    This relies on chromadb 0.4.24's segment manager; with one that lacks these
+    internals, collections are simply left loaded. Only called for unpinned
+    collections, so no query is using the index.
+    """
+    manager = getattr(client._server, "_manager", None)
+    if not all(hasattr(manager, attr) for attr in ("segment_cache", "_instances", "_lock")):
+        return
+    for segment in _vector_segments(collection):
+        manager.segment_cache[SegmentScope.VECTOR].pop(collection.id)
+        with manager._lock:
+            instance = manager._instances.pop(segment["id"], None)
+        if instance is None:
+            continue
+        handles = getattr(manager, "_vector_instances_file_handle_cache", None)
+        if handles is not None and handles.cache.pop(collection.id, None) is not None:
+            instance.close_persistent_index()
+        instance.stop()
+
+_resident_collections: ResidencyCache = ResidencyCache(
+    settings.RESIDENT_COLLECTIONS, settings.RESIDENT_COLLECTION_BYTES, on_evict=_unload_collection
+)
+_resident_retrievers: ResidencyCache = ResidencyCache(settings.RESIDENT_RETRIEVERS)
+metrics.watch_residency("collections", _resident_collections.stats)
+metrics.watch_residency("retrievers", _resident_retrievers.stats)
+_activity: Optional[DiskLRUCache] = None
+
+def _open_collection(name: str, create: bool):
+    def load():
+        collection = _get_collection(name) if create else _existing_collection(name)
+        return (collection, _index_bytes(collection)) if collection is not None else None
+    return _resident_collections.get(name, load)
+
+def _project_keys(collection_name: str) -> list:
+    """The collections a project's chunks can be in: its own and, in the sharded layout, its shard."""
+    keys = [collection_name]
+    if settings.COLLECTION_LAYOUT == "sharded":
+        keys.append(shard_name(collection_name))
+    return keys
+
+def _pinned(collection_name: str):
+    """Keeps the project's collection loaded (never evicted) for the duration of a `with` block."""
+    return _resident_collections.pinned(_project_keys(collection_name))
+
+@contextlib.contextmanager
+def using_project(collection_name: str, create: bool = False) -> Iterator[Optional[ProjectLocation]]:
+    """locate_project() for a block that queries or writes the collection, which stays loaded until it ends."""
+    with _pinned(collection_name):
+        yield locate_project(collection_name, create)
+
+def _note_write(location: ProjectLocation) -> None:
+    """Re-measures a resident collection after writes grew its index."""
+    _resident_collections.resize(location.collection.name, _index_bytes(location.collection))
+
+def _get_activity() -> DiskLRUCache:
+    global _activity
+    if _activity is None:
+        _activity = DiskLRUCache(cache_path("active_projects.sqlite3"), ACTIVITY_MAX_ENTRIES)
+    return _activity
+
+def residency_stats() -> dict:
+    """Residency of opened collections and retrievers in this process."""
+    return {"collections": _resident_collections.stats(), "retrievers": _resident_retrievers.stats()}
+
+def warm_up(limit: Optional[int] = None) -> int:
+    """
+    Loads the vector indexes of the most recently active projects (by any
+    process), so a restarted worker's first questions don't wait for them.
+    Returns the number of projects loaded.
+    """
+    limit = settings.RESIDENCY_WARMUP if limit is None else limit
+    if settings.RESIDENT_COLLECTIONS:
+        limit = min(limit, settings.RESIDENT_COLLECTIONS)
+    if limit <= 0:
+        return 0
+    started = time.perf_counter()
+    loaded = 0
+    # Oldest first, so the most recently active project ends up most recently used.
+    for collection_name in reversed(_get_activity().recent(limit)):
+        with using_project(collection_name) as location:
+            if location is None:
+                continue
+            # Reading a stored embedding makes Chroma load the collection's vector index.
+            location.collection.get(where=location.filter(), limit=1, include=["embeddings"])
+        loaded += 1
+    stats = _resident_collections.stats()
+    print(f"Warmed up {loaded} recently active projects in {time.perf_counter() - started:.1f}s "
+          f"({stats['resident']} collections, {stats['resident_bytes'] / 1e6:.0f} MB resident)")
+    return loaded
+
+def _chunk_id(source_id: str, doc: Document) -> str:
+    """Deterministic chunk ID: the source identity plus the chunk's page and content."""
+    source_hash = hashlib.sha256(source_id.encode("utf-8")).hexdigest()[:16]
+    content_key = f"{doc.metadata.get('page', '')}\0{doc.page_content}"
+    content_hash = hashlib.sha256(content_key.encode("utf-8")).hexdigest()[:32]
+    return f"{source_hash}-{content_hash}"
+
+def _batched(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+async def _abatched(items: list):
+    for batch in _batched(items, settings.INGEST_BATCH_SIZE):
+        yield batch
+
+async def _sync_source_batches(collection_name: str, source_id: str, batches: AsyncIterator[list]) -> IngestStats:
+    """
+    Makes the collection's chunks for `source_id` match the chunks yielded by
+    `batches`: unchanged chunks are skipped, new ones are embedded and upserted
+    batch by batch as they arrive, and chunks that no longer appear in the
+    source are deleted at the end. Only one batch is held in memory at a time.
+    """
+    with _pinned(collection_name):
+        location = await asyncio.to_thread(locate_project, collection_name, True)
+        await asyncio.to_thread(ensure_lexical_index, collection_name)
+        existing = await asyncio.to_thread(location.collection.get, where=location.filter({"source_id": source_id}), include=[])
+        existing_ids = set(location.from_chroma(existing["ids"]))
+        seen_ids = set()
+        stats = IngestStats()
+
+        async for splits in batches:
+            to_add = {}
+            for doc in splits:
+                chunk_id = _chunk_id(source_id, doc)
+                if chunk_id in seen_ids:
+                    continue
+                seen_ids.add(chunk_id)
+                if chunk_id in existing_ids:
+                    stats.skipped += 1
+                else:
+                    doc.metadata["source_id"] = source_id
+                    to_add[chunk_id] = doc
+            if not to_add:
+                continue
+            texts = [doc.page_content for doc in to_add.values()]
+            with metrics.span("embed"):
+                vectors = await embeddings.aembed_documents(texts)
+            with metrics.span("upsert"):
+                await asyncio.to_thread(
+                    location.collection.upsert,
+                    ids=location.to_chroma(to_add), embeddings=vectors, documents=texts,
+                    metadatas=location.stamp(doc.metadata for doc in to_add.values()),
+                )
+                await asyncio.to_thread(
+                    lexical_index.add_chunks, collection_name,
+                    [(chunk_id, source_id, doc.page_content, doc.metadata) for chunk_id, doc in to_add.items()],
+                )
+            if existing_ids:
+                stats.updated += len(to_add)
+            else:
+                stats.added += len(to_add)
+
+        stale_ids = list(existing_ids - seen_ids)
+        if stale_ids:
+            await asyncio.to_thread(location.collection.delete, ids=location.to_chroma(stale_ids))
+            await asyncio.to_thread(lexical_index.delete_chunks, collection_name, stale_ids)
+        stats.deleted = len(stale_ids)
+        await asyncio.to_thread(_note_write, location)
+        return stats
+
+async def _sync_source(collection_name: str, source_id: str, splits: list) -> IngestStats:
+    """_sync_source_batches() for chunks that are already in memory."""
+    return await _sync_source_batches(collection_name, source_id, _abatched(splits))
+
+def _read_pdf_pages(reader: PdfReader, start: int, end: int, source_name: str) -> list:
+    return [
+        Document(page_content=reader.pages[i].extract_text(), metadata={"source": source_name, "page": i})
+        for i in range(start, end)
+    ]
+
+async def _stream_pdf(file_path: str, source_name: str, text_splitter, on_progress: Optional[ProgressCallback]):
+    """Yields chunk batches from a PDF, reading only a few pages at a time."""
+    reader = await asyncio.to_thread(PdfReader, file_path)
+    total_pages = len(reader.pages)
+    step = settings.PDF_PAGES_PER_BATCH
+    for start in range(0, total_pages, step):
+        end = min(start + step, total_pages)
+        with metrics.span("extract"):
+            pages = await asyncio.to_thread(_read_pdf_pages, reader, start, end, source_name)
+            splits = text_splitter.split_documents(pages)
+        for batch in _batched(splits, settings.INGEST_BATCH_SIZE):
+            yield batch
+        if on_progress is not None:
+            await on_progress(end, total_pages)
+
+def _file_source_id(file_path: str) -> str:
+    """Source identity of an uploaded file: a hash of its bytes, so different files with the same name never collide."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return f"file:{digest.hexdigest()[:32]}"
+
+async def async_add_document_to_project(
+    user_id: int, project_name: str, file_path: str, file_type: str,
+    source_name: str = None, on_progress: Optional[ProgressCallback] = None,
+) -> IngestStats:
+    """
+    Processes and adds a document to the user's project vector store asynchronously.
+    The source is identified by a hash of the file's contents: re-uploading the
+    same file is a no-op, while a different file with the same name is a new
+    source. `source_name` (the original file name) is only shown in citations.
+    PDFs are streamed page by page so memory stays bounded regardless of document size;
+    `on_progress(pages_done, total_pages)` is awaited after each page batch.
+    """
     collection_name = get_collection_name(user_id, project_name)
+    source_name = source_name or os.path.basename(file_path)
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
 
     if file_type == 'pdf':
-        loader = PyPDFLoader(file_path)
+        batches = _stream_pdf(file_path, source_name, text_splitter, on_progress)
     elif file_type in ['txt', 'md']:
-        loader = TextLoader(file_path, encoding='utf-8')
+        with metrics.span("extract"):
+            documents = await asyncio.to_thread(TextLoader(file_path, encoding='utf-8').load)
+            for doc in documents:
+                doc.metadata["source"] = source_name
+            batches = _abatched(text_splitter.split_documents(documents))
     else:
         raise ValueError(f"Unsupported file type: {file_type}")
 
-    documents = loader.load()
+    source_id = await asyncio.to_thread(_file_source_id, file_path)
+    stats = await _sync_source_batches(collection_name, source_id, batches)
+    print(f"Ingested '{source_name}' into '{collection_name}': {stats} (embedding cache: {embedding_cache_stats()})")
+    return stats
 
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    splits = text_splitter.split_documents(documents)
+async def async_add_text_to_project(user_id: int, project_name: str, text_content: str, metadata: dict = None) -> IngestStats:
+    """
+    Processes and adds plain text content to the user's project vector store asynchronously.
+    The source is identified by metadata["source"] (its URL) when present.
+    """
+    [result] = await async_add_texts_to_project(user_id, project_name, [(text_content, metadata or {})])
+    if isinstance(result, BaseException):
+        raise result
+    return result
 
-    # Use the async version of the Chroma function
-    await Chroma.afrom_documents(
-        client=client,
-        documents=splits,
-        embedding=embeddings,
-        collection_name=collection_name
-    )
-    print(f"Added {len(splits)} chunks to collection '{collection_name}'")
+async def _embed_batches(texts: list) -> list:
+    """
+    Embeds `texts` in INGEST_BATCH_SIZE batches, running at most EMBED_CONCURRENCY
+    batches at once. Returns one entry per batch: its vectors, or the exception it raised.
+    """
+    semaphore = asyncio.Semaphore(settings.EMBED_CONCURRENCY)
 
-async def async_add_text_to_project(user_id: int, project_name: str, text_content: str, metadata: dict = None):
-    """Processes and adds plain text content to the user's project vector store asynchronously."""
-    if metadata is None:
-        metadata = {}
-        
-    collection_name = get_collection_name(user_id, project_name)
-    
-    # Create a single LangChain Document object from the text
-    doc = Document(page_content=text_content, metadata=metadata)
-    
-    # Split the document into chunks
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    splits = text_splitter.split_documents([doc])
-
-    # Add the chunks to ChromaDB
-    await Chroma.afrom_documents(
-        client=client,
-        documents=splits,
-        embedding=embeddings,
-        collection_name=collection_name
+    async def embed(batch):
+        async with semaphore:
+            return await embeddings.aembed_documents(batch)
+
+    return await asyncio.gather(
+        *(embed(batch) for batch in _batched(texts, settings.INGEST_BATCH_SIZE)), return_exceptions=True
     )
-    print(f"Added {len(splits)} chunks from text to collection '{collection_name}'")
 
-def get_project_retriever(user_id: int, project_name: str):
-    """Gets a retriever for a specific project. This is still synchronous and fine."""
+def _split_source(text_content: str, metadata: dict) -> list:
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    return text_splitter.split_documents([Document(page_content=text_content, metadata=metadata)])
+
+def source_key(text_content: str) -> str:
+    """The global source store key of a text: its hash with everything that shapes its chunks and vectors."""
+    return source_store.content_key(text_content, EMBEDDING_MODEL, str(CHUNK_SIZE), str(CHUNK_OVERLAP))
+
+async def _split_or_reuse(text_content: str, metadata: dict, stored_chunks: Optional[source_store.StoredChunks]) -> list:
+    if stored_chunks is not None:
+        return [Document(page_content=chunk, metadata=dict(metadata)) for chunk, _ in stored_chunks]
+    return await asyncio.to_thread(_split_source, text_content, dict(metadata))
+
+def _update_source_store(collection_name: str, sources: list, source_ids: list, keys: list, stored: dict, results: list, embedded: list) -> None:
+    """Stores the sources that were split and embedded here in full, and links every ingested source to the project."""
+    vectors_by_source: dict = {}
+    for index, _, doc, vector in embedded:
+        vectors_by_source.setdefault(index, []).append((doc.page_content, vector))
+    refs = []
+    for index, result in enumerate(results):
+        if not isinstance(result, IngestStats):
+            continue
+        if keys[index] not in stored:
+            if result.skipped:
+                continue  # part of it was already in the project, so not every vector is at hand
+            source_store.put(keys[index], sources[index][0], vectors_by_source.get(index, []))
+        refs.append((source_ids[index], keys[index]))
+    source_store.link(collection_name, refs)
+
+async def async_add_texts_to_project(user_id: int, project_name: str, sources: list) -> list:
+    """
+    Adds several (text_content, metadata) sources to a project in one pass: sources
+    are split concurrently, their new chunks are embedded together in bounded
+    concurrent batches, and everything is written to Chroma with a single upsert.
+    Sources found in the global source store reuse its chunks and vectors instead.
+    Returns one entry per source, in order: its IngestStats, or the exception that
+    made it fail. A failing source never affects the others.
+    """
+    if not sources:
+        return []
     collection_name = get_collection_name(user_id, project_name)
+    source_ids = [
+        metadata.get("source") or hashlib.sha256(text.encode("utf-8")).hexdigest()
+        for text, metadata in sources
+    ]
+    # Sources already in the global store are rebuilt from their stored chunks, without splitting or embedding.
+    keys = [source_key(text) for text, _ in sources]
+    stored = await asyncio.to_thread(source_store.get_many, keys) if settings.SOURCE_STORE_ENABLED else {}
+    known_vectors = {chunk: vector for chunks in stored.values() for chunk, vector in chunks}
+    with metrics.span("extract"):
+        results: list = await asyncio.gather(
+            *(_split_or_reuse(text, metadata, stored.get(key)) for (text, metadata), key in zip(sources, keys)),
+            return_exceptions=True,
+        )
+
+    with _pinned(collection_name):
+        location = await asyncio.to_thread(locate_project, collection_name, True)
+        await asyncio.to_thread(ensure_lexical_index, collection_name)
+        existing = await asyncio.to_thread(
+            location.collection.get, where=location.filter({"source_id": {"$in": list(set(source_ids))}}), include=["metadatas"]
+        )
+        existing_by_source: dict = {}
+        for chunk_id, metadata in zip(location.from_chroma(existing["ids"]), existing["metadatas"]):
+            existing_by_source.setdefault(metadata.get("source_id"), set()).add(chunk_id)
+
+        # Work out each source's diff and collect the chunks that need embedding.
+        pending = []  # (source index, chunk id, document)
+        embedded = []  # (source index, chunk id, document, vector)
+        seen_ids = set()
+        for index, (source_id, splits) in enumerate(zip(source_ids, results)):
+            if isinstance(splits, BaseException):
+                continue
+            existing_ids = existing_by_source.get(source_id, set())
+            stats = IngestStats()
+            for doc in splits:
+                chunk_id = _chunk_id(source_id, doc)
+                if chunk_id in seen_ids:
+                    continue
+                seen_ids.add(chunk_id)
+                if chunk_id in existing_ids:
+                    stats.skipped += 1
+                else:
+                    doc.metadata["source_id"] = source_id
+                    if doc.page_content in known_vectors:
+                        embedded.append((index, chunk_id, doc, known_vectors[doc.page_content]))
+                    else:
+                        pending.append((index, chunk_id, doc))
+            results[index] = stats
+
+        with metrics.span("embed"):
+            vectors_by_batch = await _embed_batches([doc.page_content for _, _, doc in pending])
+        for batch, batch_vectors in zip(_batched(pending, settings.INGEST_BATCH_SIZE), vectors_by_batch):
+            if not isinstance(batch_vectors, BaseException):
+                embedded.extend((index, chunk_id, doc, vector) for (index, chunk_id, doc), vector in zip(batch, batch_vectors))
+                continue
+            # Retry a failed batch source by source so one bad source doesn't take its batch-mates down.
+            by_source: dict = {}
+            for item in batch:
+                by_source.setdefault(item[0], []).append(item)
+            for index, items in by_source.items():
+                try:
+                    source_vectors = await embeddings.aembed_documents([doc.page_content for _, _, doc in items])
+                except Exception as e:
+                    results[index] = e
+                    continue
+                embedded.extend((index, chunk_id, doc, vector) for (_, chunk_id, doc), vector in zip(items, source_vectors))
+
+        # A source whose embedding failed is left exactly as it was.
+        embedded = [item for item in embedded if isinstance(results[item[0]], IngestStats)]
+        if embedded:
+            with metrics.span("upsert"):
+                await asyncio.to_thread(
+                    location.collection.upsert,
+                    ids=location.to_chroma(chunk_id for _, chunk_id, _, _ in embedded),
+                    embeddings=[vector for _, _, _, vector in embedded],
+                    documents=[doc.page_content for _, _, doc, _ in embedded],
+                    metadatas=location.stamp(doc.metadata for _, _, doc, _ in embedded),
+                )
+                await asyncio.to_thread(
+                    lexical_index.add_chunks, collection_name,
+                    [(chunk_id, source_ids[index], doc.page_content, doc.metadata) for index, chunk_id, doc, _ in embedded],
+                )
+        for index, _, _, _ in embedded:
+            if existing_by_source.get(source_ids[index]):
+                results[index].updated += 1
+            else:
+                results[index].added += 1
+
+        ok = [index for index, result in enumerate(results) if isinstance(result, IngestStats)]
+        stale_ids = set()
+        for index in ok:
+            stale = existing_by_source.get(source_ids[index], set()) - seen_ids
+            results[index].deleted = len(stale)
+            stale_ids |= stale
+        if stale_ids:
+            await asyncio.to_thread(location.collection.delete, ids=location.to_chroma(stale_ids))
+            await asyncio.to_thread(lexical_index.delete_chunks, collection_name, stale_ids)
+
+        if embedded or stale_ids:
+            await asyncio.to_thread(_note_write, location)
+        if settings.SOURCE_STORE_ENABLED:
+            await asyncio.to_thread(_update_source_store, collection_name, sources, source_ids, keys, stored, results, embedded)
+
+        print(f"Ingested {len(ok)}/{len(sources)} sources into '{collection_name}' (embedding cache: {embedding_cache_stats()})")
+        return results
+
+def ensure_lexical_index(collection_name: str, force: bool = False) -> None:
+    """Builds the project's lexical index from Chroma if it is missing (projects ingested before it existed)."""
+    if lexical_index.exists(collection_name) and not force:
+        return
+    rows = []
+    with using_project(collection_name) as location:
+        if location is None:
+            return
+        for page in _paged_get(location.collection, location.where, ["documents", "metadatas"]):
+            rows += [
+                (chunk_id, (metadata or {}).get("source_id", ""), text, metadata or {})
+                for chunk_id, text, metadata in zip(location.from_chroma(page["ids"]), page["documents"], page["metadatas"])
+            ]
+    lexical_index.rebuild(collection_name, rows)
+
+# (chunk id, text, metadata), best match first
+Hits = List[Tuple[str, str, dict]]
+
+def _vector_search(collection_name: str, query_vector: List[float], k: int) -> Hits:
+    with using_project(collection_name) as location:
+        if location is None:
+            return []
+        # A shard's count bounds k too; Chroma returns fewer hits when the filter matches fewer chunks.
+        k = min(k, location.collection.count())
+        if k == 0:
+            return []
+        result = location.collection.query(
+            query_embeddings=[query_vector], n_results=k, where=location.where, include=["documents", "metadatas"]
+        )
+    return list(zip(location.from_chroma(result["ids"][0]), result["documents"][0], result["metadatas"][0]))
+
+def reciprocal_rank_fusion(rankings: List[Hits], k: int) -> List[Document]:
+    """Fuses ranked hit lists: each chunk scores sum(1 / (RRF_K + rank)) over the lists it appears in."""
+    scores: Dict[str, float] = {}
+    hits: Dict[str, Tuple[str, dict]] = {}
+    for ranking in rankings:
+        for rank, (chunk_id, text, metadata) in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (settings.RRF_K + rank)
+            hits[chunk_id] = (text, metadata)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [Document(page_content=hits[chunk_id][0], metadata=hits[chunk_id][1] or {}) for chunk_id in best]
+
+class HybridRetriever(BaseRetriever):
+    """
+    Vector search in Chroma plus BM25 search in the project's lexical index,
+    fused with reciprocal rank fusion. Dense search finds paraphrases; BM25
+    finds exact terms, names and formulas that embeddings tend to blur.
+    Per-stage timings are recorded as "retrieve.<stage>" metrics of the current task.
+    Pass `query_vector` to invoke()/ainvoke() when the query is already embedded.
+    """
+
+    collection_name: str
+    k: int = 4
+    fetch_k: int = 20
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun, query_vector: Optional[List[float]] = None,
+    ) -> List[Document]:
+        ensure_lexical_index(self.collection_name)
+        if query_vector is None:
+            query_vector = embeddings.embed_query(query)
+        vector_hits = _vector_search(self.collection_name, query_vector, self.fetch_k)
+        lexical_hits = lexical_index.search(self.collection_name, query, self.fetch_k)
+        return reciprocal_rank_fusion([vector_hits, lexical_hits], self.k)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun, query_vector: Optional[List[float]] = None,
+    ) -> List[Document]:
+        def lap(stage: str, since: float) -> float:
+            now = time.perf_counter()
+            metrics.record(f"retrieve.{stage}", now - since)
+            return now
+
+        async def vector() -> Hits:
+            t = time.perf_counter()
+            vector = query_vector
+            if vector is None:
+                vector = await embeddings.aembed_query(query)
+                t = lap("embed", t)
+            hits = await asyncio.to_thread(_vector_search, self.collection_name, vector, self.fetch_k)
+            lap("vector", t)
+            return hits
+
+        async def lexical() -> Hits:
+            t = time.perf_counter()
+            await asyncio.to_thread(ensure_lexical_index, self.collection_name)
+            hits = await asyncio.to_thread(lexical_index.search, self.collection_name, query, self.fetch_k)
+            lap("lexical", t)
+            return hits
+
+        # The BM25 lookup runs while the query is being embedded.
+        vector_hits, lexical_hits = await asyncio.gather(vector(), lexical())
+        t = time.perf_counter()
+        docs = reciprocal_rank_fusion([vector_hits, lexical_hits], self.k)
+        lap("fusion", t)
+        return docs
+
+class PinnedVectorRetriever(VectorStoreRetriever):
+    """Vector-only retrieval (RETRIEVAL_MODE=vector) that keeps the project's collection loaded while it searches."""
+
+    project_collection: str
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        with _pinned(self.project_collection):
+            return super()._get_relevant_documents(query, run_manager=run_manager)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        with _pinned(self.project_collection):
+            return await super()._aget_relevant_documents(query, run_manager=run_manager)
+
+def _vector_retriever(collection_name: str, location: ProjectLocation):
     vectorstore = Chroma(
         client=client,
-        collection_name=collection_name,
+        collection_name=location.collection.name,
         embedding_function=embeddings
     )
-    return vectorstore.as_retriever(search_kwargs={"k": 4})
\ No newline at end of file
+    search_kwargs = {"k": settings.RETRIEVAL_K}
+    if location.where is not None:
+        search_kwargs["filter"] = location.where
+    return PinnedVectorRetriever(vectorstore=vectorstore, search_kwargs=search_kwargs, project_collection=collection_name)
+
+def _load_retriever(collection_name: str):
+    if settings.RETRIEVAL_MODE != "vector":
+        return HybridRetriever(collection_name=collection_name, k=settings.RETRIEVAL_K, fetch_k=settings.RETRIEVAL_FETCH_K), 0
+    location = locate_project(collection_name, create=True)
+    if settings.COLLECTION_LAYOUT == "sharded" and location.where is None:
+        return None  # bound to a collection that migrate-layout is about to delete; not worth keeping
+    return _vector_retriever(collection_name, location), 0
+
+def get_project_retriever(user_id: int, project_name: str):
+    """
+    Gets a retriever for a specific project: hybrid BM25 + vector, or vector-only
+    with RETRIEVAL_MODE=vector. Retrievers are reused, and the project is recorded
+    as recently active for warm_up(). Blocking (SQLite, and possibly loading the
+    collection): call it from a thread.
+    """
+    collection_name = get_collection_name(user_id, project_name)
+    _get_activity().set(collection_name, b"")
+    retriever = _resident_retrievers.get((settings.RETRIEVAL_MODE, collection_name), lambda: _load_retriever(collection_name))
+    return retriever if retriever is not None else _vector_retriever(collection_name, locate_project(collection_name, create=True))
+
+def count_project_chunks(user_id: int, project_name: str) -> int:
+    """Returns the number of chunks stored for a project (0 if it has no collection yet)."""
+    with using_project(get_collection_name(user_id, project_name)) as location:
+        return location.count() if location is not None else 0
@@ -0,0 +1,208 @@
+# services/source_store.py
+
+import hashlib
+import sqlite3
+import threading
+import time
+import zlib
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from tele_notebook.core.config import settings
+from tele_notebook.utils import sqlite_utils
+from tele_notebook.utils.disk_cache import cache_path
+
+"""
+Global, content-addressed store of web sources shared by all users.
+
+A source is keyed by a hash of its text (plus the embedding model and the
+splitter settings, see rag_service.source_key) and holds the text, its chunks
+and their vectors exactly once. When the same article reaches a second project,
+through /discover or /addsource, ingestion copies the stored vectors into the
+project's collection instead of splitting and embedding it again. Canonical
+URLs point at the source last fetched from them, so a recent /addsource of the
+same page needs no download at all.
+
+Every project that holds a source has a row in `refs`, keyed by
+(collection, source id); a source's reference count is the number of those
+rows. collect_garbage() removes references to collections that no longer
+exist and then deletes sources nobody references that have not been used for
+a grace period, so a source being linked by a concurrent ingest is never
+collected. Counters of the work avoided are kept in the same file.
+"""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    key TEXT PRIMARY KEY, text BLOB NOT NULL, text_size INTEGER NOT NULL,
+    chunk_count INTEGER NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS chunks (
+    key TEXT NOT NULL, seq INTEGER NOT NULL, text TEXT NOT NULL, vector BLOB NOT NULL,
+    PRIMARY KEY (key, seq));
+CREATE TABLE IF NOT EXISTS refs (
+    collection TEXT NOT NULL, source_id TEXT NOT NULL, key TEXT NOT NULL,
+    PRIMARY KEY (collection, source_id));
+CREATE INDEX IF NOT EXISTS refs_key ON refs (key);
+CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, key TEXT NOT NULL, fetched_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+"""
+
+# Query parameters that only track where a click came from.
+_TRACKING_PARAMS = ("utm_", "fbclid", "gclid", "yclid", "mc_cid", "mc_eid", "ref_src")
+
+# (chunk text, vector), in split order
+StoredChunks = List[Tuple[str, List[float]]]
+
+_local = threading.local()
+
+
+def _conn() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite_utils.connect(cache_path("sources.sqlite3"))
+        conn.executescript(_SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+def _encode(vector: List[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _decode(blob: bytes) -> List[float]:
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+def _count(conn: sqlite3.Connection, **increments: int) -> None:
+    conn.executemany(
+        "INSERT INTO counters (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+        [(name, value) for name, value in increments.items() if value],
+    )
+
+
+def canonical_url(url: str) -> str:
+    """
+    The URL with a lowercase scheme and host, no default port, fragment or
+    tracking parameters, sorted query parameters and no trailing slash.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and (scheme, parts.port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{parts.port}"
+    query = sorted(
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not name.lower().startswith(_TRACKING_PARAMS)
+    )
+    return urlunsplit((scheme, host, parts.path.rstrip("/") or "/", urlencode(query), ""))
+
+
+def content_key(text: str, *context: str) -> str:
+    """Hash of a source's text together with whatever else determines its chunks and vectors."""
+    return hashlib.sha256("\0".join((*context, text)).encode("utf-8")).hexdigest()
+
+
+def get_many(keys: Iterable[str]) -> Dict[str, StoredChunks]:
+    """The stored chunks of every key that is in the store."""
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return {}
+    conn = _conn()
+    found: Dict[str, StoredChunks] = {}
+    placeholders = ",".join("?" * len(keys))
+    for key, text, vector in conn.execute(
+        f"SELECT key, text, vector FROM chunks WHERE key IN ({placeholders}) ORDER BY key, seq", keys
+    ):
+        found.setdefault(key, []).append((text, _decode(vector)))
+    with conn:
+        if found:
+            conn.executemany("UPDATE sources SET last_used = ? WHERE key = ?", [(time.time(), key) for key in found])
+        _count(conn, sources_reused=len(found), chunks_reused=sum(map(len, found.values())),
+               sources_missed=len(keys) - len(found))
+    return found
+
+
+def put(key: str, text: str, chunks: StoredChunks) -> None:
+    """Stores a source's text and chunks (a no-op if the key is already stored)."""
+    now = time.time()
+    conn = _conn()
+    with conn:
+        inserted = conn.execute(
+            "INSERT OR IGNORE INTO sources (key, text, text_size, chunk_count, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, zlib.compress(text.encode("utf-8")), len(text), len(chunks), now, now),
+        ).rowcount
+        if inserted:
+            conn.executemany(
+                "INSERT INTO chunks (key, seq, text, vector) VALUES (?, ?, ?, ?)",
+                [(key, seq, chunk, _encode(vector)) for seq, (chunk, vector) in enumerate(chunks)],
+            )
+            _count(conn, sources_stored=1, chunks_stored=len(chunks))
+
+
+def link(collection: str, refs: Iterable[Tuple[str, str]]) -> None:
+    """Records that `collection` holds each (source id, key); a new key for a source id replaces the old one."""
+    conn = _conn()
+    with conn:
+        conn.executemany(
+            "INSERT INTO refs (collection, source_id, key) VALUES (?, ?, ?)"
+            " ON CONFLICT(collection, source_id) DO UPDATE SET key = excluded.key",
+            [(collection, source_id, key) for source_id, key in refs],
+        )
+
+
+def text_for_url(url: str, max_age: float) -> Optional[str]:
+    """The stored text last fetched from `url` if that was less than `max_age` seconds ago."""
+    conn = _conn()
+    row = conn.execute(
+        "SELECT s.text, s.text_size FROM urls u JOIN sources s ON s.key = u.key WHERE u.url = ? AND u.fetched_at > ?",
+        (canonical_url(url), time.time() - max_age),
+    ).fetchone()
+    with conn:
+        if row is None:
+            _count(conn, url_fetches=1)
+            return None
+        _count(conn, url_fetches_avoided=1, bytes_not_fetched=row[1])
+    return zlib.decompress(row[0]).decode("utf-8")
+
+
+def record_url(url: str, key: str) -> None:
+    conn = _conn()
+    with conn:
+        conn.execute(
+            "INSERT INTO urls (url, key, fetched_at) VALUES (?, ?, ?)"
+            " ON CONFLICT(url) DO UPDATE SET key = excluded.key, fetched_at = excluded.fetched_at",
+            (canonical_url(url), key, time.time()),
+        )
+
+
+def collect_garbage(live_collections: Iterable[str], grace: float) -> dict:
+    """
+    Drops references held by collections not in `live_collections`, then deletes
+    unreferenced sources unused for `grace` seconds. Returns what was removed.
+    """
+    conn = _conn()
+    live = set(live_collections)
+    with conn:
+        stale = [c for (c,) in conn.execute("SELECT DISTINCT collection FROM refs") if c not in live]
+        conn.executemany("DELETE FROM refs WHERE collection = ?", [(c,) for c in stale])
+        keys = [key for (key,) in conn.execute(
+            "SELECT key FROM sources WHERE last_used < ? AND NOT EXISTS (SELECT 1 FROM refs WHERE refs.key = sources.key)",
+            (time.time() - grace,),
+        )]
+        conn.executemany("DELETE FROM chunks WHERE key = ?", [(key,) for key in keys])
+        conn.executemany("DELETE FROM sources WHERE key = ?", [(key,) for key in keys])
+        conn.execute("DELETE FROM urls WHERE key NOT IN (SELECT key FROM sources)")
+    return {"stale_collections": len(stale), "sources_deleted": len(keys)}
+
+
+def stats() -> dict:
+    """Store size, sharing and the counters of work avoided."""
+    conn = _conn()
+    counters = dict(conn.execute("SELECT name, value FROM counters"))
+    sources, chunks, text_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(chunk_count), 0), COALESCE(SUM(text_size), 0) FROM sources").fetchone()
+    refs, shared = conn.execute(
+        "SELECT COALESCE(SUM(n), 0), COALESCE(SUM(n > 1), 0) FROM (SELECT COUNT(*) AS n FROM refs GROUP BY key)"
+    ).fetchone()
+    return {"sources": sources, "chunks": chunks, "text_bytes": text_bytes, "refs": refs, "shared_sources": shared, **counters}
@@ -1,5 +1,5 @@
-import aiohttp
 from tele_notebook.core.config import settings
+from tele_notebook.services import client_registry
 from tele_notebook.utils.prompts import SUPPORTED_LANGUAGES
 
 async def synthesize_audio(text: str, language: str) -> bytes:
@@ -9,7 +9,7 @@ async def synthesize_audio(text: str, language: str) -> bytes:
     
     # The 'ssl=False' parameter is the key change.
     # It explicitly tells aiohttp not to use or verify SSL for this request.
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, data=text.encode('utf-8'), ssl=False) as response:
-            response.raise_for_status()
-            return await response.read()
\ No newline at end of file
+    session = client_registry.get_http_session()
+    async with session.post(url, data=text.encode('utf-8'), ssl=False) as response:
+        response.raise_for_status()
+        return await response.read()
\ No newline at end of file
@@ -1,74 +1,541 @@
+import abc
 import json
+import logging
 import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
 from filelock import FileLock
 from typing import Dict, Optional
 
+from tele_notebook.core.config import settings
+from tele_notebook.utils import metrics, sqlite_utils
+from tele_notebook.utils.cache import TTLCache
+
 """
-Manages user-specific data like active project and language. 
-We'll use a simple JSON file with a file lock to ensure it's 
-process-safe between the bot and workers.
+Manages user-specific data like active project and language.
+
+State lives behind a small backend interface so that every read or write only
+touches the requesting user's record instead of the whole store:
+  - "redis":  one hash per user on REDIS_URL (shared by the bot and workers)
+  - "sqlite": a WAL-mode SQLite database with one row per (user, field)
+  - "json":   the original whole-file JSON store guarded by a FileLock
+Keyed backends import the legacy JSON file once, the first time they start.
+
+The same backend also holds a per-user project registry (display name, main
+topic, collection name, chunk count, last ingest time), so listing or switching
+projects never has to scan every Chroma collection.
+
+Reads are served from a bounded in-process LRU/TTL cache. Writes go through to
+the backend and publish the user id on a Redis channel so that every other
+process (bot or worker) drops its cached copy straight away.
 """
 
+logger = logging.getLogger(__name__)
+
 STATE_FILE = "user_states.json"
+PROJECTS_FILE = "user_projects.json"
 lock = FileLock(f"{STATE_FILE}.lock")
 
-def _load_states() -> Dict:
-    if not os.path.exists(STATE_FILE):
-        return {}
-    with open(STATE_FILE, "r") as f:
-        # Handle empty file case
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
+DEFAULT_STATE = {"active_project": "default", "language": "en"}
+
+
+class StateBackend(abc.ABC):
+    """Per-user keyed state storage. Values are always strings."""
+
+    @abc.abstractmethod
+    def get(self, user_id: int) -> Dict[str, str]:
+        ...
+
+    @abc.abstractmethod
+    def update(self, user_id: int, fields: Dict[str, str]) -> None:
+        """Atomically sets the given fields, leaving all others untouched."""
+
+    @abc.abstractmethod
+    def import_states(self, states: Dict[str, Dict]) -> int:
+        """Imports legacy states without overwriting fields that already exist."""
+
+    def is_migrated(self) -> bool:
+        """True once the legacy JSON file has been imported into this backend."""
+        return True
+
+    def mark_migrated(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    def get_projects(self, user_id: int) -> Dict[str, Dict[str, str]]:
+        """Returns {project_name: fields} for one user's registry."""
+
+    @abc.abstractmethod
+    def update_project(self, user_id: int, name: str, fields: Dict[str, str]) -> None:
+        """Creates the registry entry if needed and atomically sets the given fields."""
+
+    @abc.abstractmethod
+    def incr_project(self, user_id: int, name: str, field: str, amount: int = 1) -> int:
+        """Atomically increments an integer registry field and returns the new value."""
+
+    @abc.abstractmethod
+    def delete_project(self, user_id: int, name: str) -> None:
+        ...
+
+
+class JsonStateBackend(StateBackend):
+    """The original store: the whole file is read and rewritten under one lock."""
+
+    def _load_states(self) -> Dict:
+        if not os.path.exists(STATE_FILE):
             return {}
+        with open(STATE_FILE, "r") as f:
+            # Handle empty file case
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                return {}
 
-def _save_states(states: Dict):
-    with open(STATE_FILE, "w") as f:
-        json.dump(states, f, indent=2)
+    def _save_states(self, states: Dict, path: str = STATE_FILE):
+        with open(path, "w") as f:
+            json.dump(states, f, indent=2)
 
-def get_user_state(user_id: int) -> Dict:
-    with lock:
-        states = _load_states()
-        return states.get(str(user_id), {"active_project": "default", "language": "en"})
+    def _load_projects(self) -> Dict:
+        if not os.path.exists(PROJECTS_FILE):
+            return {}
+        with open(PROJECTS_FILE, "r") as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                return {}
+
+    def get(self, user_id: int) -> Dict[str, str]:
+        with lock:
+            state = self._load_states().get(str(user_id), {})
+        return {k: v for k, v in state.items() if v is not None}
+
+    def update(self, user_id: int, fields: Dict[str, str]) -> None:
+        with lock:
+            states = self._load_states()
+            states.setdefault(str(user_id), {}).update(fields)
+            self._save_states(states)
+
+    def import_states(self, states: Dict[str, Dict]) -> int:
+        return 0
+
+    def get_projects(self, user_id: int) -> Dict[str, Dict[str, str]]:
+        with lock:
+            return self._load_projects().get(str(user_id), {})
+
+    def update_project(self, user_id: int, name: str, fields: Dict[str, str]) -> None:
+        with lock:
+            projects = self._load_projects()
+            projects.setdefault(str(user_id), {}).setdefault(name, {}).update(fields)
+            self._save_states(projects, PROJECTS_FILE)
+
+    def incr_project(self, user_id: int, name: str, field: str, amount: int = 1) -> int:
+        with lock:
+            projects = self._load_projects()
+            project = projects.setdefault(str(user_id), {}).setdefault(name, {})
+            project[field] = str(int(project.get(field, 0)) + amount)
+            self._save_states(projects, PROJECTS_FILE)
+            return int(project[field])
+
+    def delete_project(self, user_id: int, name: str) -> None:
+        with lock:
+            projects = self._load_projects()
+            if projects.get(str(user_id), {}).pop(name, None) is not None:
+                self._save_states(projects, PROJECTS_FILE)
+
+
+class SqliteStateBackend(StateBackend):
+    """One row per (user, field) in a WAL-mode database; readers never block writers."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS user_state ("
+                " user_id TEXT NOT NULL, field TEXT NOT NULL, value TEXT NOT NULL,"
+                " PRIMARY KEY (user_id, field))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS user_project ("
+                " user_id TEXT NOT NULL, name TEXT NOT NULL, field TEXT NOT NULL, value TEXT NOT NULL,"
+                " PRIMARY KEY (user_id, name, field))"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite_utils.connect(self.path)
+            self._local.conn = conn
+        return conn
+
+    def get(self, user_id: int) -> Dict[str, str]:
+        rows = self._conn().execute(
+            "SELECT field, value FROM user_state WHERE user_id = ?", (str(user_id),)
+        ).fetchall()
+        return dict(rows)
+
+    def update(self, user_id: int, fields: Dict[str, str]) -> None:
+        with self._conn() as conn:
+            conn.executemany(
+                "INSERT INTO user_state (user_id, field, value) VALUES (?, ?, ?)"
+                " ON CONFLICT (user_id, field) DO UPDATE SET value = excluded.value",
+                [(str(user_id), field, value) for field, value in fields.items()],
+            )
+
+    def import_states(self, states: Dict[str, Dict]) -> int:
+        rows = [
+            (user_id, field, str(value))
+            for user_id, state in states.items()
+            for field, value in state.items()
+            if value is not None
+        ]
+        with self._conn() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO user_state (user_id, field, value) VALUES (?, ?, ?)", rows
+            )
+        return len(states)
+
+    def is_migrated(self) -> bool:
+        row = self._conn().execute("SELECT 1 FROM meta WHERE key = 'legacy_json_migrated'").fetchone()
+        return row is not None
+
+    def mark_migrated(self) -> None:
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_json_migrated', '1')")
+
+    def get_projects(self, user_id: int) -> Dict[str, Dict[str, str]]:
+        projects: Dict[str, Dict[str, str]] = {}
+        rows = self._conn().execute(
+            "SELECT name, field, value FROM user_project WHERE user_id = ?", (str(user_id),)
+        ).fetchall()
+        for name, field, value in rows:
+            projects.setdefault(name, {})[field] = value
+        return projects
+
+    def update_project(self, user_id: int, name: str, fields: Dict[str, str]) -> None:
+        with self._conn() as conn:
+            conn.executemany(
+                "INSERT INTO user_project (user_id, name, field, value) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (user_id, name, field) DO UPDATE SET value = excluded.value",
+                [(str(user_id), name, field, value) for field, value in fields.items()],
+            )
+
+    def incr_project(self, user_id: int, name: str, field: str, amount: int = 1) -> int:
+        with self._conn() as conn:
+            (value,) = conn.execute(
+                "INSERT INTO user_project (user_id, name, field, value) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (user_id, name, field) DO UPDATE SET value = CAST(value AS INTEGER) + excluded.value"
+                " RETURNING value",
+                (str(user_id), name, field, amount),
+            ).fetchone()
+        return int(value)
+
+    def delete_project(self, user_id: int, name: str) -> None:
+        with self._conn() as conn:
+            conn.execute("DELETE FROM user_project WHERE user_id = ? AND name = ?", (str(user_id), name))
+
+
+class RedisStateBackend(StateBackend):
+    """One Redis hash per user: HGETALL for reads, HSET of only the changed fields for writes."""
+
+    KEY_PREFIX = "lumenote:user_state:"
+    PROJECTS_PREFIX = "lumenote:user_projects:"
+    MIGRATION_KEY = "lumenote:user_state_migrated"
+
+    def __init__(self, url: str):
+        import redis
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+
+    def _key(self, user_id) -> str:
+        return f"{self.KEY_PREFIX}{user_id}"
+
+    def get(self, user_id: int) -> Dict[str, str]:
+        return self.redis.hgetall(self._key(user_id))
+
+    def update(self, user_id: int, fields: Dict[str, str]) -> None:
+        self.redis.hset(self._key(user_id), mapping=fields)
+
+    def import_states(self, states: Dict[str, Dict]) -> int:
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id, state in states.items():
+            for field, value in state.items():
+                if value is not None:
+                    pipe.hsetnx(self._key(user_id), field, str(value))
+        pipe.execute()
+        return len(states)
 
-def set_user_state(user_id: int, project: Optional[str] = None, lang: Optional[str] = None, main_topic: Optional[str] = None): # <-- Add main_topic
+    def is_migrated(self) -> bool:
+        return bool(self.redis.exists(self.MIGRATION_KEY))
+
+    def mark_migrated(self) -> None:
+        self.redis.set(self.MIGRATION_KEY, "1")
+
+    def _project_key(self, user_id, name: str) -> str:
+        return f"{self.PROJECTS_PREFIX}{user_id}:{name}"
+
+    def get_projects(self, user_id: int) -> Dict[str, Dict[str, str]]:
+        # A set of names per user plus one hash per project: O(projects of this user).
+        names = sorted(self.redis.smembers(f"{self.PROJECTS_PREFIX}{user_id}"))
+        if not names:
+            return {}
+        pipe = self.redis.pipeline(transaction=False)
+        for name in names:
+            pipe.hgetall(self._project_key(user_id, name))
+        return dict(zip(names, pipe.execute()))
+
+    def update_project(self, user_id: int, name: str, fields: Dict[str, str]) -> None:
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.sadd(f"{self.PROJECTS_PREFIX}{user_id}", name)
+        pipe.hset(self._project_key(user_id, name), mapping=fields)
+        pipe.execute()
+
+    def incr_project(self, user_id: int, name: str, field: str, amount: int = 1) -> int:
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.sadd(f"{self.PROJECTS_PREFIX}{user_id}", name)
+        pipe.hincrby(self._project_key(user_id, name), field, amount)
+        return int(pipe.execute()[1])
+
+    def delete_project(self, user_id: int, name: str) -> None:
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.srem(f"{self.PROJECTS_PREFIX}{user_id}", name)
+        pipe.delete(self._project_key(user_id, name))
+        pipe.execute()
+
+
+_backend: Optional[StateBackend] = None
+_backend_lock = threading.Lock()
+
+
+def _create_backend(kind: str) -> StateBackend:
+    if kind == "redis":
+        return RedisStateBackend(settings.REDIS_URL)
+    if kind == "sqlite":
+        return SqliteStateBackend(settings.USER_STATE_DB_PATH)
+    if kind == "json":
+        return JsonStateBackend()
+    raise ValueError(f"Unknown user state backend: {kind}")
+
+
+def migrate_legacy_states(backend: StateBackend, force: bool = False) -> int:
+    """
+    Copies user_states.json into a keyed backend. Runs once unless forced; the
+    backend is only marked as migrated after the import succeeds, so a failed
+    import is retried on the next start. Processes racing here may both import,
+    which is harmless because imports never overwrite existing fields.
+    """
+    if isinstance(backend, JsonStateBackend) or not os.path.exists(STATE_FILE):
+        return 0
+    if not force and backend.is_migrated():
+        return 0
     with lock:
-        states = _load_states()
-        user_id_str = str(user_id)
-        if user_id_str not in states:
-            states[user_id_str] = {"active_project": "default", "language": "en", "main_topic": None}
+        states = JsonStateBackend()._load_states()
+    imported = backend.import_states(states)
+    backend.mark_migrated()
+    print(f"Migrated {imported} user states from {STATE_FILE}")
+    return imported
+
+
+def get_backend() -> StateBackend:
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend = _create_backend(settings.USER_STATE_BACKEND)
+                migrate_legacy_states(backend)
+                _backend = backend
+    return _backend
+
+
+INVALIDATION_CHANNEL = "lumenote:user_state:invalidate"
+_process_token = uuid.uuid4().hex
+_cache = TTLCache(settings.USER_STATE_CACHE_SIZE, settings.USER_STATE_CACHE_TTL) if settings.USER_STATE_CACHE_SIZE > 0 else None
+_redis = None
+_subscriber = None
+_subscriber_lock = threading.Lock()
+
 
-        if project is not None:
-            states[user_id_str]["active_project"] = project
-        if lang is not None:
-            states[user_id_str]["language"] = lang
-        # ADD THIS BLOCK
-        if main_topic is not None:
-            states[user_id_str]["main_topic"] = main_topic
+def _get_redis():
+    global _redis
+    if _redis is None:
+        import redis
+        _redis = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _redis
 
-        _save_states(states)
+
+def _on_invalidation(message):
+    token, _, user_id = message["data"].partition(":")
+    if token != _process_token:
+        _cache.invalidate(user_id)
+
+
+def _ensure_subscribed():
+    """Starts the background listener for invalidations published by other processes."""
+    global _subscriber
+    if _subscriber is not None:
+        return
+    with _subscriber_lock:
+        if _subscriber is not None:
+            return
+        try:
+            pubsub = _get_redis().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{INVALIDATION_CHANNEL: _on_invalidation})
+            _subscriber = pubsub.run_in_thread(sleep_time=1, daemon=True)
+        except Exception as e:
+            # Without the channel the cache still works, entries just live until their TTL.
+            logger.warning(f"User state invalidation channel unavailable, relying on TTL: {e}")
+            _subscriber = False
+
+
+def _publish_invalidation(user_id: int):
+    try:
+        _get_redis().publish(INVALIDATION_CHANNEL, f"{_process_token}:{user_id}")
+    except Exception as e:
+        logger.warning(f"Failed to publish user state invalidation for {user_id}: {e}")
+
+
+def cache_stats() -> Dict:
+    """Hit/miss counters of this process's user state cache (also exported as lumenote_user_state_cache_total)."""
+    return _cache.stats() if _cache is not None else {}
+
+
+def get_user_state(user_id: int) -> Dict:
+    """Returns a snapshot of the user's state. Callers may mutate the returned dict."""
+    if _cache is None:
+        return {**DEFAULT_STATE, **get_backend().get(user_id)}
+    _ensure_subscribed()
+    key = str(user_id)
+    state = _cache.get(key)
+    if state is not None:
+        metrics.USER_STATE_CACHE.labels("hit").inc()
+        return dict(state)
+    metrics.USER_STATE_CACHE.labels("miss").inc()
+    # An invalidation landing while the backend is read means the snapshot may be stale; don't cache it.
+    generation = _cache.generation()
+    state = {**DEFAULT_STATE, **get_backend().get(user_id)}
+    _cache.set_if_current(key, state, generation)
+    return dict(state)
+
+def set_user_state(user_id: int, project: Optional[str] = None, lang: Optional[str] = None, main_topic: Optional[str] = None):
+    fields = {}
+    if project is not None:
+        fields["active_project"] = project
+    if lang is not None:
+        fields["language"] = lang
+    if main_topic is not None:
+        fields["main_topic"] = main_topic
+    if not fields:
+        return
+    get_backend().update(user_id, fields)
+    if _cache is not None:
+        key = str(user_id)
+        cached = _cache.peek(key)
+        _cache.invalidate(key)
+        if cached is not None:
+            _cache.set(key, {**cached, **fields})
+        _publish_invalidation(user_id)
+
+# --- PROJECT REGISTRY ---
+
+def _parse_project(fields: Dict[str, str]) -> Dict:
+    project = dict(fields)
+    project["chunk_count"] = int(fields.get("chunk_count", 0))
+    project["version"] = int(fields.get("version", 0))
+    project["last_ingest_at"] = float(fields["last_ingest_at"]) if fields.get("last_ingest_at") else None
+    return project
+
+def get_project_registry(user_id: int) -> Dict[str, Dict]:
+    """
+    Returns {project_name: info} for one user, where info holds display_name,
+    main_topic, collection_name, chunk_count, last_ingest_at and version.
+    """
+    return {name: _parse_project(fields) for name, fields in get_backend().get_projects(user_id).items()}
+
+def get_project(user_id: int, project_name: str) -> Optional[Dict]:
+    return get_project_registry(user_id).get(project_name)
+
+def register_project(user_id: int, project_name: str, main_topic: Optional[str] = None):
+    """Adds (or refreshes) a project in the user's registry. Called by /newproject."""
+    from tele_notebook.services.rag_service import get_collection_name
+    fields = {"display_name": project_name, "collection_name": get_collection_name(user_id, project_name)}
+    if main_topic is not None:
+        fields["main_topic"] = main_topic
+    get_backend().update_project(user_id, project_name, fields)
+
+def record_project_ingest(user_id: int, project_name: str, chunk_count: int):
+    """
+    Stores the collection's current chunk count and the ingest time, and bumps the
+    project version so caches keyed on it (answers, artifacts) stop matching.
+    Called after every ingest.
+    """
+    from tele_notebook.services.rag_service import get_collection_name
+    backend = get_backend()
+    backend.update_project(user_id, project_name, {
+        "display_name": project_name,
+        "collection_name": get_collection_name(user_id, project_name),
+        "chunk_count": str(chunk_count),
+        "last_ingest_at": str(time.time()),
+    })
+    backend.incr_project(user_id, project_name, "version")
+
+def get_project_version(user_id: int, project_name: str) -> int:
+    """The project's content version: incremented on every ingest, 0 if never ingested."""
+    project = get_project(user_id, project_name)
+    return project["version"] if project else 0
+
+def reconcile_projects(user_id: Optional[int] = None) -> int:
+    """
+    Rebuilds the registry from the projects that actually exist in Chroma (in
+    either collection layout), for one user or for every user. Existing entries
+    keep their names and topics; entries whose collection is gone are dropped.
+    Returns the number of projects found.
+    """
+    from tele_notebook.services.rag_service import get_collection_name, list_project_collections
+    collections_by_user: Dict[int, list] = {}
+    for collection_name, count in list_project_collections().items():
+        match = re.match(r"user_(\d+)_", collection_name)
+        if match and (user_id is None or int(match.group(1)) == user_id):
+            collections_by_user.setdefault(int(match.group(1)), []).append((collection_name, count))
+    if user_id is not None:
+        collections_by_user.setdefault(user_id, [])
+
+    backend = get_backend()
+    found = 0
+    for uid, collections in collections_by_user.items():
+        registry = backend.get_projects(uid)
+        state = backend.get(uid)
+        # Map existing names (registry entries and the active project) to their collections.
+        names_by_collection = {fields.get("collection_name"): name for name, fields in registry.items()}
+        active = state.get("active_project")
+        if active and active != "default":
+            names_by_collection.setdefault(get_collection_name(uid, active), active)
+
+        user_prefix = f"user_{uid}_"
+        live_names = set()
+        for collection_name, count in collections:
+            name = names_by_collection.get(collection_name) or collection_name[len(user_prefix):]
+            fields = {"display_name": name, "collection_name": collection_name, "chunk_count": str(count)}
+            if name == active and state.get("main_topic") and not registry.get(name, {}).get("main_topic"):
+                fields["main_topic"] = state["main_topic"]
+            backend.update_project(uid, name, fields)
+            live_names.add(name)
+        for name in set(registry) - live_names:
+            backend.delete_project(uid, name)
+        found += len(live_names)
+    return found
 
 def get_user_projects(user_id: int) -> list:
     """
-    Gets a list of ALL full collection names for a given user.
+    Gets the names of all projects in the user's registry.
     e.g., ['user_123_project-a', 'user_123_project-b']
     """
-    from tele_notebook.services.rag_service import client
-    try:
-        collections = client.list_collections()
-        user_prefix = f"user_{user_id}_"
-        # --- THIS IS THE FIX ---
-        # Return the full collection name, not the shortened version
-        return [col.name for col in collections if col.name.startswith(user_prefix)]
-    except Exception:
-        return []
-
-# --- ADD A NEW FUNCTION FOR DISPLAY ---
+    return list(get_backend().get_projects(user_id))
+
 def get_user_display_projects(user_id: int) -> list:
     """
     Gets a list of user-friendly project names for display.
-    e.g., ['project-a', 'project-b']
     """
-    full_names = get_user_projects(user_id)
-    user_prefix = f"user_{user_id}_"
-    return [name.replace(user_prefix, "", 1) for name in full_names]
\ No newline at end of file
+    return [info.get("display_name") or name for name, info in get_backend().get_projects(user_id).items()]
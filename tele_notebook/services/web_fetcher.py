@@ -0,0 +1,138 @@
+# services/web_fetcher.py
+
+import asyncio
+import json
+import time
+from dataclasses import dataclass
+from typing import Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+from bs4 import BeautifulSoup
+
+from tele_notebook.core.config import settings
+from tele_notebook.services import client_registry
+from tele_notebook.utils import metrics
+from tele_notebook.utils.disk_cache import DiskLRUCache, cache_path
+
+"""
+Fetches web pages for /addsource in the worker.
+
+Pages are downloaded on the worker's pooled aiohttp session with a timeout and
+a size cap (FETCH_MAX_BYTES, checked against Content-Length and again while
+reading). The extracted text is cached per URL together with the response's
+ETag and Last-Modified headers; the next fetch of the same URL is a conditional
+GET, and a 304 reuses the cached text without downloading or parsing anything.
+HTML parsing runs in a thread, off the event loop.
+"""
+
+HTML_TYPES = ("text/html", "application/xhtml+xml")
+READ_CHUNK = 64 * 1024
+
+_store: Optional[DiskLRUCache] = None
+
+
+class FetchError(Exception):
+    """The URL could not be fetched or has no usable text; the message is safe to show to the user."""
+
+
+@dataclass
+class FetchResult:
+    url: str  # final URL after redirects
+    text: str
+    from_cache: bool  # True when the server answered 304 Not Modified
+    size: int  # bytes downloaded (0 for a 304)
+
+
+def _get_store() -> Optional[DiskLRUCache]:
+    global _store
+    if _store is None and settings.FETCH_CACHE_ENABLED:
+        _store = DiskLRUCache(cache_path("web_pages.sqlite3"), settings.FETCH_CACHE_MAX_ENTRIES)
+    return _store
+
+
+def _cached(url: str) -> Optional[dict]:
+    store = _get_store()
+    value = store.get(url) if store is not None else None
+    return json.loads(value) if value is not None else None
+
+
+def _remember(url: str, etag: Optional[str], last_modified: Optional[str], text: str) -> None:
+    store = _get_store()
+    if store is None or not (etag or last_modified):
+        return  # without a validator the entry could never be revalidated
+    entry = {"etag": etag, "last_modified": last_modified, "text": text, "fetched_at": time.time()}
+    store.set(url, json.dumps(entry, ensure_ascii=False).encode("utf-8"))
+
+
+def validate_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    if parts.scheme not in ("http", "https") or not parts.netloc:
+        raise FetchError(f"Not an http(s) URL: {url}")
+    return parts.geturl()
+
+
+def extract_text(body: bytes, content_type: str, charset: Optional[str]) -> str:
+    """Readable text of an HTML or plain-text response body."""
+    if content_type in HTML_TYPES:
+        soup = BeautifulSoup(body, "html.parser", from_encoding=charset)
+        for element in soup(["script", "style", "noscript", "template"]):
+            element.decompose()
+        return soup.get_text(separator="\n", strip=True)
+    if content_type.startswith("text/"):
+        return body.decode(charset or "utf-8", errors="replace").strip()
+    raise FetchError(f"Unsupported content type: {content_type or 'unknown'}")
+
+
+async def _read_capped(response: aiohttp.ClientResponse) -> bytes:
+    limit = settings.FETCH_MAX_BYTES
+    too_large = FetchError(f"The page is larger than {limit / 1_000_000:g} MB.")
+    if response.content_length is not None and response.content_length > limit:
+        raise too_large
+    body = bytearray()
+    async for chunk in response.content.iter_chunked(READ_CHUNK):
+        body += chunk
+        if len(body) > limit:
+            raise too_large
+    return bytes(body)
+
+
+async def fetch(url: str) -> FetchResult:
+    """Downloads `url` (or revalidates the cached copy) and returns its text."""
+    url = validate_url(url)
+    cached = await asyncio.to_thread(_cached, url)
+    headers = {"User-Agent": settings.FETCH_USER_AGENT}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    session = client_registry.get_http_session()
+    try:
+        with metrics.span("fetch"):
+            async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=settings.FETCH_TIMEOUT)) as response:
+                if response.status == 304 and cached:
+                    return FetchResult(str(response.url), cached["text"], True, 0)
+                if response.status >= 400:
+                    raise FetchError(f"The server answered {response.status} {response.reason}.")
+                body = await _read_capped(response)
+                content_type, charset = response.content_type, response.charset
+                etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+                final_url = str(response.url)
+    except asyncio.TimeoutError:
+        raise FetchError(f"The page took longer than {settings.FETCH_TIMEOUT:.0f}s to download.") from None
+    except aiohttp.ClientError as e:
+        raise FetchError(f"Could not download the page: {e}") from e
+
+    with metrics.span("extract"):
+        text = await asyncio.to_thread(extract_text, body, content_type, charset)
+    if not text:
+        raise FetchError("The page has no readable text.")
+    await asyncio.to_thread(_remember, url, etag, last_modified, text)
+    return FetchResult(final_url, text, False, len(body))
+
+
+def stats() -> dict:
+    store = _get_store()
+    return store.stats() if store is not None else {}
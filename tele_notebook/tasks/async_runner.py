@@ -0,0 +1,128 @@
+# tasks/async_runner.py
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, List, Optional
+
+from tele_notebook.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRunner:
+    """
+    Runs coroutines on one persistent event loop that lives in a background thread
+    for the whole life of the worker process.
+
+    Celery runs with the threads pool: each pool thread calls run(), which submits
+    the task's coroutine to the shared loop and blocks until it finishes. Because
+    the Celery task only returns once its coroutine is done, acks_late still acks
+    after the work is complete. At most `max_concurrency` coroutines execute at once.
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+        self._shutdown_hooks: List[Callable[[], Awaitable[None]]] = []
+
+    def _ensure_started(self):
+        if self.loop is not None:
+            return
+        with self._lock:
+            if self.loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            # Blocking helpers (Chroma, SQLite, SDK clients) go through asyncio.to_thread.
+            loop.set_default_executor(ThreadPoolExecutor(max_workers=self.max_concurrency * 2, thread_name_prefix="async-io"))
+            started = threading.Event()
+
+            def run_loop():
+                asyncio.set_event_loop(loop)
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                loop.call_soon(started.set)
+                loop.run_forever()
+
+            self._thread = threading.Thread(target=run_loop, name="async-runner", daemon=True)
+            self._thread.start()
+            started.wait()
+            self.loop = loop
+            logger.info(f"Started shared event loop for async tasks (max concurrency {self.max_concurrency})")
+
+    async def _limited(self, coro: Awaitable, timeout: Optional[float]):
+        async with self._semaphore:
+            # The time limit starts once the task gets a slot, not while it waits for one.
+            return await asyncio.wait_for(coro, timeout)
+
+    def run(self, coro: Awaitable, timeout: Optional[float] = None):
+        """
+        Runs `coro` on the shared loop and blocks the calling thread until it returns.
+        After `timeout` seconds the coroutine is cancelled and TimeoutError raised.
+        """
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(self._limited(coro, timeout), self.loop).result()
+
+    async def run_on_own_loop(self, coro: Awaitable, timeout: Optional[float] = None):
+        """For asyncio.run() mode: awaits `coro`, then runs the shutdown hooks before that loop closes."""
+        try:
+            return await asyncio.wait_for(coro, timeout)
+        finally:
+            await self._run_shutdown_hooks()
+
+    async def _run_shutdown_hooks(self):
+        for hook in self._shutdown_hooks:
+            try:
+                await hook()
+            except Exception as e:
+                logger.warning(f"Async shutdown hook failed: {e}")
+
+    def add_shutdown_hook(self, hook: Callable[[], Awaitable[None]]) -> None:
+        """Registers a coroutine function to await on the loop before it stops (e.g. closing clients)."""
+        self._shutdown_hooks.append(hook)
+
+    async def _drain(self, timeout: float):
+        current = asyncio.current_task()
+        pending = [t for t in asyncio.all_tasks() if t is not current]
+        if pending:
+            logger.info(f"Waiting up to {timeout}s for {len(pending)} in-flight async tasks")
+            _, still_running = await asyncio.wait(pending, timeout=timeout)
+            for task in still_running:
+                task.cancel()
+            await asyncio.gather(*still_running, return_exceptions=True)
+        await self._run_shutdown_hooks()
+        await self.loop.shutdown_asyncgens()
+        await self.loop.shutdown_default_executor()
+
+    def shutdown(self, timeout: float = 30.0) -> None:
+        """Lets in-flight coroutines finish (cancelling them after `timeout`), then stops the loop."""
+        with self._lock:
+            loop, thread = self.loop, self._thread
+            if loop is None:
+                return
+            try:
+                asyncio.run_coroutine_threadsafe(self._drain(timeout), loop).result(timeout + 10)
+            except Exception as e:
+                logger.warning(f"Async runner did not drain cleanly: {e}")
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout=10)
+            loop.close()
+            self.loop = self._thread = None
+
+
+runner = AsyncRunner(settings.ASYNC_TASK_CONCURRENCY)
+
+
+def run_async(coro: Awaitable, timeout: Optional[float] = None):
+    """
+    Executes a task's coroutine. In "loop" mode it runs on the worker's shared
+    event loop; in "run" mode (the old behaviour, for -P solo) on a fresh loop.
+    `timeout` is the task's time limit; Celery's own time limits do not apply
+    to the threads pool, so they are enforced on the coroutine instead.
+    """
+    if settings.CELERY_ASYNC_MODE == "loop":
+        return runner.run(coro, timeout)
+    return asyncio.run(runner.run_on_own_loop(coro, timeout))
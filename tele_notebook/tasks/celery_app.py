@@ -1,4 +1,8 @@
+import threading
+
 from celery import Celery
+from celery.signals import worker_init, worker_process_shutdown, worker_ready, worker_shutdown
+from kombu import Queue
 from tele_notebook.core.config import settings
 
 celery_app = Celery(
@@ -8,6 +12,61 @@ celery_app = Celery(
     include=["tele_notebook.tasks.tasks"]
 )
 
+# Three queues, each consumed by its own worker (see docker-compose.yml), so a
+# long podcast or a big PDF never sits in front of a question:
+#   interactive - Q&A, short and latency-sensitive
+#   ingest      - document processing and source discovery
+#   media       - podcast and mind map generation
+QUEUE_INTERACTIVE = "interactive"
+QUEUE_INGEST = "ingest"
+QUEUE_MEDIA = "media"
+QUEUES = (QUEUE_INTERACTIVE, QUEUE_INGEST, QUEUE_MEDIA)
+
+# With the Redis broker a lower number is served first.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 9
+
 celery_app.conf.update(
     task_track_started=True,
-)
\ No newline at end of file
+    task_queues=[Queue(name) for name in QUEUES],
+    task_default_queue=QUEUE_INTERACTIVE,
+    task_routes={
+        "tele_notebook.tasks.tasks.answer_question_task": {"queue": QUEUE_INTERACTIVE},
+        "tele_notebook.tasks.tasks.process_document_task": {"queue": QUEUE_INGEST},
+        "tele_notebook.tasks.tasks.discover_sources_task": {"queue": QUEUE_INGEST},
+        "tele_notebook.tasks.tasks.add_source_task": {"queue": QUEUE_INGEST},
+        "tele_notebook.tasks.tasks.generate_podcast_task": {"queue": QUEUE_MEDIA},
+        "tele_notebook.tasks.tasks.generate_mindmap_task": {"queue": QUEUE_MEDIA},
+    },
+    task_default_priority=PRIORITY_NORMAL,
+    broker_transport_options={
+        "priority_steps": list(range(10)),
+        "sep": ":",
+        "queue_order_strategy": "priority",
+    },
+)
+
+# Records enqueue times and per-queue wait times.
+import tele_notebook.tasks.queue_stats  # noqa: E402,F401
+# Releases in-flight request keys when tasks finish.
+import tele_notebook.services.admission  # noqa: E402,F401
+
+@worker_init.connect
+def _start_metrics_server(**kwargs):
+    # One /metrics endpoint per worker (-P threads and -P solo run tasks in this process).
+    from tele_notebook.utils import metrics
+    metrics.start_server()
+
+@worker_ready.connect
+def _warm_up_collections(**kwargs):
+    # Load the indexes of recently active projects in the background, before their next question.
+    from tele_notebook.services import rag_service
+    threading.Thread(target=rag_service.warm_up, name="collection-warmup", daemon=True).start()
+
+@worker_shutdown.connect
+@worker_process_shutdown.connect
+def _stop_async_runner(**kwargs):
+    # Let in-flight async task bodies finish before the worker exits.
+    from tele_notebook.tasks.async_runner import runner
+    runner.shutdown(timeout=settings.ASYNC_SHUTDOWN_TIMEOUT)
@@ -0,0 +1,85 @@
+# tasks/queue_stats.py
+
+import time
+from typing import Dict, List
+
+import redis
+from celery.signals import before_task_publish, task_prerun
+
+from tele_notebook.core.config import settings
+from tele_notebook.utils import metrics
+
+"""
+Queue depth and wait-time visibility.
+
+The publisher stamps every task message with an `enqueued_at` header. When a
+worker starts the task, the time it spent in the queue is logged if it is slow
+and pushed onto a short per-queue list in Redis, from which queue_report()
+computes percentiles. Depth is read straight from the broker's Redis lists.
+"""
+
+WAIT_KEY_PREFIX = "lumenote:queue_wait:"
+WAIT_SAMPLES = 500  # most recent waits kept per queue
+PRIORITY_STEPS = range(10)
+
+_redis = None
+
+
+def _get_redis() -> redis.Redis:
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _redis
+
+
+@before_task_publish.connect
+def _stamp_enqueue_time(headers=None, **kwargs):
+    if headers is not None:
+        headers.setdefault("enqueued_at", time.time())
+
+
+@task_prerun.connect
+def _record_wait(task=None, **kwargs):
+    enqueued_at = getattr(task.request, "enqueued_at", None)
+    if enqueued_at is None:
+        return
+    wait = max(time.time() - float(enqueued_at), 0.0)
+    queue = (task.request.delivery_info or {}).get("routing_key") or "unknown"
+    metrics.QUEUE_WAIT_SECONDS.labels(queue).observe(wait)
+    if wait >= settings.QUEUE_WAIT_WARN_SECONDS:
+        print(f"Task {task.name} waited {wait:.1f}s in queue '{queue}'")
+    try:
+        pipe = _get_redis().pipeline(transaction=False)
+        pipe.lpush(f"{WAIT_KEY_PREFIX}{queue}", f"{wait:.3f}")
+        pipe.ltrim(f"{WAIT_KEY_PREFIX}{queue}", 0, WAIT_SAMPLES - 1)
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"Could not record queue wait time: {e}")
+
+
+def queue_depth(queue: str) -> int:
+    """Messages waiting in `queue`, over all of its priority lists."""
+    pipe = _get_redis().pipeline(transaction=False)
+    for priority in PRIORITY_STEPS:
+        # Kombu keeps priority 0 under the bare queue name, the rest as "<queue>:<priority>".
+        pipe.llen(queue if priority == 0 else f"{queue}:{priority}")
+    return sum(pipe.execute())
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def queue_report(queues) -> Dict[str, dict]:
+    """Depth plus p50/p95/max of the recent wait times, per queue."""
+    report = {}
+    for queue in queues:
+        waits = sorted(float(w) for w in _get_redis().lrange(f"{WAIT_KEY_PREFIX}{queue}", 0, -1))
+        report[queue] = {
+            "depth": queue_depth(queue),
+            "samples": len(waits),
+            "wait_p50": _percentile(waits, 0.5) if waits else None,
+            "wait_p95": _percentile(waits, 0.95) if waits else None,
+            "wait_max": waits[-1] if waits else None,
+        }
+    return report
@@ -1,20 +1,32 @@
 # tasks/tasks.py
 
-import os
-import uuid
-import graphviz
 import asyncio
-from telegram import Bot
+import os
+import time
+from telegram.error import BadRequest, TelegramError
 from telegram.helpers import escape_markdown
 
 from tele_notebook.core.config import settings
-from tele_notebook.services import rag_service, llm_service, gemini_tts_service
+from tele_notebook.services import rag_service, llm_service, gemini_tts_service, user_service, client_registry, answer_cache, artifact_cache, mindmap_renderer, source_store, web_fetcher
+from tele_notebook.tasks.async_runner import run_async, runner
 from tele_notebook.tasks.celery_app import celery_app
+from tele_notebook.utils import metrics
+from tele_notebook.utils.telegram_utils import ThrottledMessage
+
+# Close pooled clients (Telegram, HTTP) when the worker's event loop shuts down.
+runner.add_shutdown_hook(client_registry.aclose)
 
 # --- ASYNC HELPERS (The heavy lifting) ---
 
+def _record_ingest(user_id: int, project_name: str):
+    """Refreshes the project's registry entry (chunk count, last ingest time). Blocking: run it in a thread."""
+    try:
+        user_service.record_project_ingest(user_id, project_name, rag_service.count_project_chunks(user_id, project_name))
+    except Exception as e:
+        print(f"Failed to update project registry for '{project_name}': {e}")
+
 async def _async_discover_and_ingest(chat_id: int, user_id: int, project_name: str, main_topic: str):
-    bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
+    bot = await client_registry.get_bot()
     try:
         sources_list = await llm_service.discover_sources(main_topic)
         if not sources_list:
@@ -26,97 +38,230 @@ async def _async_discover_and_ingest(chat_id: int, user_id: int, project_name: s
         found_message += "\nNow processing them\\. This may take a moment\\.\\."
         await bot.send_message(chat_id=chat_id, text=found_message, parse_mode='MarkdownV2', disable_web_page_preview=True)
 
+        sources = [
+            (item['content'], {"source": item.get('url', 'Unknown'), "title": item.get('title', 'Untitled')})
+            for item in sources_list if item.get('content')
+        ]
+        results = await rag_service.async_add_texts_to_project(user_id, project_name, sources)
         tasks_completed = 0
-        for source_item in sources_list:
-            content = source_item.get('content')
-            if content:
-                metadata = {"source": source_item.get('url', 'Unknown'), "title": source_item.get('title', 'Untitled')}
-                await rag_service.async_add_text_to_project(user_id, project_name, content, metadata)
-                tasks_completed += 1
-        
+        stats = rag_service.IngestStats()
+        for (_, metadata), result in zip(sources, results):
+            if isinstance(result, Exception):
+                print(f"Failed to ingest discovered source {metadata['source']}: {result}")
+                continue
+            stats += result
+            tasks_completed += 1
+
+        await asyncio.to_thread(_record_ingest, user_id, project_name)
         if tasks_completed > 0:
-            final_message = f"✅ Success\\! Added {tasks_completed} sources to project `{escape_markdown(project_name, version=2)}`\\. You can now ask questions\\."
+            final_message = (
+                f"✅ Success\\! Added {tasks_completed} sources to project `{escape_markdown(project_name, version=2)}` "
+                f"\\({escape_markdown(stats.summary(), version=2)} chunks\\)\\. You can now ask questions\\."
+            )
             await bot.send_message(chat_id=chat_id, text=final_message, parse_mode='MarkdownV2')
         else:
+            metrics.fail()
             await bot.send_message(chat_id=chat_id, text="Found sources, but couldn't retrieve their content.")
     except Exception as e:
         await bot.send_message(chat_id=chat_id, text=f"❌ A critical error occurred during discovery: {e}")
         raise e # Re-raise to mark task as failed
 
-async def _async_process_document(chat_id: int, user_id: int, project_name: str, file_path: str, file_type: str):
-    bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
+async def _async_process_document(chat_id: int, user_id: int, project_name: str, file_path: str, file_type: str, source_name: str = None):
+    bot = await client_registry.get_bot()
+    progress = ThrottledMessage(bot, chat_id, settings.PROGRESS_UPDATE_INTERVAL)
+
+    async def report_progress(pages_done: int, total_pages: int):
+        await progress.update(f"⏳ Processed {pages_done}/{total_pages} pages...", force=pages_done == total_pages)
+
     try:
-        await rag_service.async_add_document_to_project(user_id, project_name, file_path, file_type)
-        await bot.send_message(chat_id=chat_id, text=f"✅ Successfully added document to project '{project_name}'.")
+        stats = await rag_service.async_add_document_to_project(
+            user_id, project_name, file_path, file_type, source_name, on_progress=report_progress
+        )
+        await asyncio.to_thread(_record_ingest, user_id, project_name)
+        await bot.send_message(chat_id=chat_id, text=f"✅ Successfully added document to project '{project_name}' ({stats.summary()} chunks).")
     except Exception as e:
+        metrics.fail()
         await bot.send_message(chat_id=chat_id, text=f"❌ Error processing document: {e}")
     finally:
         if os.path.exists(file_path): os.remove(file_path)
 
-async def _async_handle_question(chat_id: int, user_id: int, project_name: str, question: str, language: str):
-    bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
+async def _async_add_source(chat_id: int, user_id: int, project_name: str, url: str):
+    bot = await client_registry.get_bot()
+    try:
+        # A page someone fetched recently is taken from the global source store without any request.
+        text = None
+        if settings.SOURCE_STORE_ENABLED:
+            text = await asyncio.to_thread(source_store.text_for_url, url, settings.SOURCE_URL_MAX_AGE)
+        if text is None:
+            page = await web_fetcher.fetch(url)
+            print(f"Fetched {page.url}: {page.size} bytes{' (not modified, cached text)' if page.from_cache else ''}, {len(page.text)} chars of text")
+            text = f"Source URL: {source_store.canonical_url(url)}\n\n{page.text}"
+        else:
+            print(f"Reusing stored text of {url} ({len(text)} chars)")
+        # The text goes straight into ingestion; the source is identified by the URL the user gave.
+        stats = await rag_service.async_add_text_to_project(user_id, project_name, text, {"source": url})
+        if settings.SOURCE_STORE_ENABLED:
+            await asyncio.to_thread(source_store.record_url, url, rag_service.source_key(text))
+        await asyncio.to_thread(_record_ingest, user_id, project_name)
+        await bot.send_message(chat_id=chat_id, text=f"✅ Added {url} to project '{project_name}' ({stats.summary()} chunks).", disable_web_page_preview=True)
+    except web_fetcher.FetchError as e:
+        metrics.fail()
+        await bot.send_message(chat_id=chat_id, text=f"❌ Couldn't add {url}: {e}", disable_web_page_preview=True)
+    except Exception as e:
+        metrics.fail()
+        await bot.send_message(chat_id=chat_id, text=f"❌ Error processing source: {e}")
+
+async def _async_handle_question(chat_id: int, user_id: int, project_name: str, question: str, language: str, placeholder_message_id: int = None):
+    started = time.monotonic()
+    bot = await client_registry.get_bot()
+    # The bot's "Thinking..." message (if any) is edited in place with the answer.
+    reply = ThrottledMessage(bot, chat_id, settings.STREAM_EDIT_INTERVAL, message_id=placeholder_message_id)
     try:
         await bot.send_chat_action(chat_id=chat_id, action='typing')
+        cache = answer_cache.get_answer_cache()
+        embedding = None  # the question's embedding, when the cache lookup computed it
+        if cache is not None:
+            cache_key = rag_service.get_collection_name(user_id, project_name)
+            version = await asyncio.to_thread(user_service.get_project_version, user_id, project_name)
+            with metrics.span("answer_cache"):
+                answer, embedding = await cache.lookup(cache_key, version, language, question, rag_service.embeddings.aembed_query)
+            if answer is not None:
+                print(f"Answer cache hit for '{cache_key}' (stats: {cache.stats()})")
+                await reply.finalize(answer)
+                return
         # FIX: Re-initialize the retriever here to get the latest data
-        retriever = rag_service.get_project_retriever(user_id, project_name)
-        answer = await llm_service.get_rag_response(retriever, question, language)
-        await bot.send_message(chat_id=chat_id, text=answer)
+        retriever = await asyncio.to_thread(rag_service.get_project_retriever, user_id, project_name)
+        first_token_at = None
+        if settings.QA_STREAMING:
+            async def timed_chunks():
+                nonlocal first_token_at
+                async for chunk in llm_service.stream_rag_response(retriever, question, language, embedding):
+                    if first_token_at is None:
+                        first_token_at = time.monotonic()
+                    yield chunk
+            answer = await reply.stream(timed_chunks())
+        else:
+            answer = await llm_service.get_rag_response(retriever, question, language, embedding)
+            await reply.finalize(answer)
+        if first_token_at:
+            metrics.record("first_token", first_token_at - started)
+        ttft = f"{first_token_at - started:.2f}s" if first_token_at else "n/a"
+        print(f"Answered question in '{project_name}': time to first token {ttft}, total {time.monotonic() - started:.2f}s")
+        if cache is not None:
+            await cache.store(cache_key, version, language, question, answer, embedding)
     except Exception as e:
-        await bot.send_message(chat_id=chat_id, text=f"❌ An error occurred: {e}")
+        metrics.fail()
+        await reply.finalize(f"❌ An error occurred: {e}")
+
+async def _get_artifact(user_id: int, project_name: str, kind: str, topic: str, language: str):
+    """Returns (cache key, cached artifact or None) for the project's current version."""
+    version = await asyncio.to_thread(user_service.get_project_version, user_id, project_name)
+    key = artifact_cache.artifact_key(rag_service.get_collection_name(user_id, project_name), version, kind, topic, language)
+    return key, await asyncio.to_thread(artifact_cache.get, key)
+
+async def _send_podcast(bot, chat_id: int, audio, audio_format: str, topic: str, duration: int = None, send_as: str = None):
+    """
+    Sends podcast audio (bytes or a file_id) as a "voice" message or an "audio" file.
+    Returns (file_id, send_as) so a cached file_id can be resent the way it was first sent.
+    """
+    send_as = send_as or ("voice" if audio_format == "opus" else "audio")
+    if send_as == "voice":
+        try:
+            message = await bot.send_voice(chat_id=chat_id, voice=audio, caption=f"Podcast on {topic}", duration=duration, filename=f"{topic}.ogg")
+            return message.voice.file_id, "voice"
+        except BadRequest as e:
+            # Users can forbid voice messages in their privacy settings; send the OGG as a file then.
+            if "voice_messages_forbidden" not in str(e).lower() or isinstance(audio, str):
+                raise
+    message = await bot.send_audio(chat_id=chat_id, audio=audio, title=f"Podcast on {topic}", duration=duration, filename=f"{topic}.{'ogg' if audio_format == 'opus' else 'wav'}")
+    return message.audio.file_id, "audio"
 
 async def _async_generate_podcast(chat_id: int, user_id: int, project_name: str, topic: str, language: str):
-    bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
-    file_name = f"/tmp/{uuid.uuid4()}.wav"
+    bot = await client_registry.get_bot()
     try:
-        retriever = rag_service.get_project_retriever(user_id, project_name)
-        script = await llm_service.generate_podcast_script(retriever, topic, language)
-        audio_bytes = await gemini_tts_service.generate_podcast_audio(script, language)
-        with open(file_name, "wb") as f: f.write(audio_bytes)
-        with open(file_name, "rb") as audio_file:
-            await bot.send_audio(chat_id=chat_id, audio=audio_file, title=f"Podcast on {topic}", filename=f"{topic}.wav")
+        key, cached = await _get_artifact(user_id, project_name, "podcast", topic, language)
+        if cached and cached.get("file_id"):
+            try:
+                await _send_podcast(bot, chat_id, cached["file_id"], settings.PODCAST_AUDIO_FORMAT, topic, send_as=cached.get("send_as"))
+                return
+            except TelegramError as e:
+                print(f"Cached podcast file_id is no longer usable, regenerating: {e}")
+        if cached:
+            script = cached["source"]
+        else:
+            retriever = await asyncio.to_thread(rag_service.get_project_retriever, user_id, project_name)
+            script = await llm_service.generate_podcast_script(retriever, topic, language)
+        audio = await gemini_tts_service.generate_podcast_audio(script, language)
+        # The encoded bytes go straight into the upload; nothing is written to disk.
+        with metrics.span("upload"):
+            file_id, send_as = await _send_podcast(bot, chat_id, audio.data, audio.format, topic, audio.duration)
+        await asyncio.to_thread(artifact_cache.put, key, script, file_id, send_as)
     except Exception as e:
+        metrics.fail()
         await bot.send_message(chat_id=chat_id, text=f"❌ Couldn't generate podcast: {e}")
-    finally:
-        if os.path.exists(file_name): os.remove(file_name)
+
+async def _send_mindmap(bot, chat_id: int, image, topic: str, send_as: str) -> str:
+    """Sends a mind map (bytes or a file_id) as a "photo" or, for SVG and very elongated PNGs, a "document"."""
+    caption = f"Mind Map for '{topic}'"
+    if send_as == "photo":
+        message = await bot.send_photo(chat_id=chat_id, photo=image, caption=caption, filename="mindmap.png")
+        return message.photo[-1].file_id
+    message = await bot.send_document(chat_id=chat_id, document=image, caption=caption, filename=f"mindmap.{settings.MINDMAP_FORMAT}")
+    return message.document.file_id
 
 async def _async_generate_mindmap(chat_id: int, user_id: int, project_name: str, topic: str, language: str):
-    bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
-    file_path_base = f"/tmp/{uuid.uuid4()}"
-    file_path_png = f"{file_path_base}.png"
+    bot = await client_registry.get_bot()
     try:
-        retriever = rag_service.get_project_retriever(user_id, project_name)
-        dot_string = await llm_service.generate_mindmap_dot(retriever, topic, language)
-        if not dot_string or not dot_string.strip().startswith("digraph"): raise ValueError("LLM did not return valid DOT.")
-        graphviz.Source(dot_string).render(file_path_base, format='png', cleanup=True)
-        with open(file_path_png, "rb") as image_file:
-            await bot.send_photo(chat_id=chat_id, photo=image_file, caption=f"Mind Map for '{topic}'")
+        key, cached = await _get_artifact(user_id, project_name, "mindmap", topic, language)
+        if cached and cached.get("file_id"):
+            try:
+                # A file_id can only be resent the way it was first sent.
+                send_as = cached.get("send_as") or ("photo" if settings.MINDMAP_FORMAT == "png" else "document")
+                await _send_mindmap(bot, chat_id, cached["file_id"], topic, send_as)
+                return
+            except TelegramError as e:
+                print(f"Cached mind map file_id is no longer usable, regenerating: {e}")
+        if cached:
+            dot_string = cached["source"]
+        else:
+            retriever = await asyncio.to_thread(rag_service.get_project_retriever, user_id, project_name)
+            dot_string = await llm_service.generate_mindmap_dot(retriever, topic, language)
+        # Rendered in memory by a bounded pool of `dot` processes and uploaded straight from the bytes.
+        mindmap = await mindmap_renderer.render(dot_string)
+        with metrics.span("upload"):
+            send_as = "photo" if mindmap.fits_photo else "document"
+            file_id = await _send_mindmap(bot, chat_id, mindmap.data, topic, send_as)
+        await asyncio.to_thread(artifact_cache.put, key, dot_string, file_id, send_as)
     except Exception as e:
+        metrics.fail()
         await bot.send_message(chat_id=chat_id, text=f"❌ Couldn't generate mind map: {e}")
-    finally:
-        if os.path.exists(file_path_png): os.remove(file_path_png)
 
 # --- CELERY TASK DEFINITIONS ---
 
 @celery_app.task(bind=True, max_retries=0, acks_late=True, ignore_result=True)
 def discover_sources_task(self, chat_id: int, user_id: int, project_name: str, main_topic: str):
     try:
-        asyncio.run(_async_discover_and_ingest(chat_id, user_id, project_name, main_topic))
+        run_async(metrics.traced(_async_discover_and_ingest(chat_id, user_id, project_name, main_topic), "discover"), timeout=settings.INGEST_TASK_TIME_LIMIT)
     except Exception as exc:
         print(f"CRITICAL FAILURE in discover_sources_task: {exc}")
         raise exc # Re-raise to mark task as FAILED in Celery
 
 @celery_app.task(acks_late=True)
-def process_document_task(chat_id: int, user_id: int, project_name: str, file_path: str, file_type: str):
-    asyncio.run(_async_process_document(chat_id, user_id, project_name, file_path, file_type))
+def process_document_task(chat_id: int, user_id: int, project_name: str, file_path: str, file_type: str, source_name: str = None):
+    run_async(metrics.traced(_async_process_document(chat_id, user_id, project_name, file_path, file_type, source_name), "document"), timeout=settings.INGEST_TASK_TIME_LIMIT)
+
+@celery_app.task(acks_late=True)
+def add_source_task(chat_id: int, user_id: int, project_name: str, url: str):
+    run_async(metrics.traced(_async_add_source(chat_id, user_id, project_name, url), "addsource"), timeout=settings.INGEST_TASK_TIME_LIMIT)
 
 @celery_app.task
-def answer_question_task(chat_id: int, user_id: int, project_name: str, question: str, language: str):
-    asyncio.run(_async_handle_question(chat_id, user_id, project_name, question, language))
+def answer_question_task(chat_id: int, user_id: int, project_name: str, question: str, language: str, placeholder_message_id: int = None):
+    run_async(metrics.traced(_async_handle_question(chat_id, user_id, project_name, question, language, placeholder_message_id), "question", language), timeout=settings.INTERACTIVE_TASK_TIME_LIMIT)
 
 @celery_app.task
 def generate_podcast_task(chat_id: int, user_id: int, project_name: str, topic: str, language: str):
-    asyncio.run(_async_generate_podcast(chat_id, user_id, project_name, topic, language))
+    run_async(metrics.traced(_async_generate_podcast(chat_id, user_id, project_name, topic, language), "podcast", language), timeout=settings.MEDIA_TASK_TIME_LIMIT)
 
 @celery_app.task
 def generate_mindmap_task(chat_id: int, user_id: int, project_name: str, topic: str, language: str):
-    asyncio.run(_async_generate_mindmap(chat_id, user_id, project_name, topic, language))
\ No newline at end of file
+    run_async(metrics.traced(_async_generate_mindmap(chat_id, user_id, project_name, topic, language), "mindmap", language), timeout=settings.MEDIA_TASK_TIME_LIMIT)
\ No newline at end of file
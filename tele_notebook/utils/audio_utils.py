@@ -1,15 +1,20 @@
 # tele_notebook/utils/audio_utils.py
 
+import asyncio
 import struct
 import re
+from typing import Iterable
 
 def convert_to_wav(audio_data: bytes, mime_type: str) -> bytes:
     """Generates a WAV file header for the given audio data and parameters."""
+    return wav_header(len(audio_data), mime_type) + audio_data
+
+def wav_header(data_size: int, mime_type: str) -> bytes:
+    """The 44-byte WAV header for `data_size` bytes of mono PCM in the given format."""
     parameters = parse_audio_mime_type(mime_type)
     bits_per_sample = parameters["bits_per_sample"]
     sample_rate = parameters["rate"]
     num_channels = 1
-    data_size = len(audio_data)
     bytes_per_sample = bits_per_sample // 8
     block_align = num_channels * bytes_per_sample
     byte_rate = sample_rate * block_align
@@ -32,7 +37,43 @@ def convert_to_wav(audio_data: bytes, mime_type: str) -> bytes:
         b"data",
         data_size
     )
-    return header + audio_data
+    return header
+
+def pcm_to_wav(pcm_parts: Iterable[bytes], mime_type: str) -> bytes:
+    """Builds a WAV file from PCM pieces with a single copy (header and parts joined at once)."""
+    pcm_parts = list(pcm_parts)
+    return b"".join([wav_header(sum(map(len, pcm_parts)), mime_type), *pcm_parts])
+
+async def encode_opus(pcm_parts: Iterable[bytes], mime_type: str, bitrate: str) -> bytes:
+    """
+    Encodes 16-bit mono PCM to OGG/Opus (what Telegram expects for voice
+    messages) by piping it through ffmpeg. The parts are written to ffmpeg's
+    stdin one by one, so the PCM never has to be stitched into one buffer.
+    """
+    parameters = parse_audio_mime_type(mime_type)
+    if parameters["bits_per_sample"] != 16:
+        raise ValueError(f"Opus encoding expects 16-bit PCM, got {mime_type}")
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-f", "s16le", "-ar", str(parameters["rate"]), "-ac", "1", "-i", "pipe:0",
+        "-c:a", "libopus", "-b:a", bitrate, "-application", "voip", "-f", "ogg", "pipe:1",
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+    )
+
+    async def feed():
+        try:
+            for part in pcm_parts:
+                process.stdin.write(part)
+                await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass # ffmpeg exited early; its stderr explains why
+        finally:
+            process.stdin.close()
+
+    _, ogg, errors = await asyncio.gather(feed(), process.stdout.read(), process.stderr.read())
+    if await process.wait() != 0:
+        raise RuntimeError(f"ffmpeg failed to encode Opus: {errors.decode(errors='replace').strip()}")
+    return ogg
 
 def parse_audio_mime_type(mime_type: str) -> dict[str, int | None]:
     """Parses bits per sample and rate from an audio MIME type string."""
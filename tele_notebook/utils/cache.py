@@ -0,0 +1,104 @@
+# tele_notebook/utils/cache.py
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class TTLCache:
+    """
+    A small thread-safe LRU cache whose entries also expire after `ttl` seconds.
+    Keeps hit/miss/eviction counters so callers can check that it is effective.
+
+    invalidate() also records a generation per key, so a value loaded before an
+    invalidation can be dropped by set_if_current() instead of being cached.
+    Only the last `maxsize` invalidations are remembered; keys that fall out
+    count as invalidated at the newest forgotten generation.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._generation = 0
+        self._invalidated: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._forgotten = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        """Like get(), but without touching recency or the hit/miss counters."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                return None
+            return item[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._set(key, value)
+
+    def _set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def generation(self) -> int:
+        """Take this before loading a value from its source; pass it to set_if_current()."""
+        with self._lock:
+            return self._generation
+
+    def set_if_current(self, key: Hashable, value: Any, generation: int) -> bool:
+        """Caches `value` unless `key` was invalidated after `generation` was taken."""
+        with self._lock:
+            if self._invalidated.get(key, self._forgotten) > generation:
+                return False
+            self._set(key, value)
+            return True
+
+    def invalidate(self, key: Hashable) -> None:
+        """Drops `key` and makes any load of it that is still in flight uncacheable."""
+        with self._lock:
+            self._data.pop(key, None)
+            self._generation += 1
+            self._invalidated[key] = self._generation
+            self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self.maxsize:
+                _, forgotten = self._invalidated.popitem(last=False)
+                self._forgotten = max(self._forgotten, forgotten)
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
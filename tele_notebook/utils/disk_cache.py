@@ -0,0 +1,125 @@
+# tele_notebook/utils/disk_cache.py
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from tele_notebook.core.config import settings
+from tele_notebook.utils import sqlite_utils
+
+
+def cache_path(filename: str) -> str:
+    """Path of a cache file in the shared cache directory (CACHE_DIR, or <CHROMA_DB_PATH>/cache)."""
+    cache_dir = settings.CACHE_DIR or os.path.join(settings.CHROMA_DB_PATH, "cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, filename)
+
+
+class DiskLRUCache:
+    """
+    A bounded key/value store in a WAL-mode SQLite file, safe to share between
+    the bot and worker processes. Once it holds more than `max_entries` rows the
+    least recently used ones are evicted.
+    """
+
+    # Eviction is checked every N writes rather than on every insert.
+    EVICT_EVERY = 256
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite_utils.connect(self.path)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        keys = list(dict.fromkeys(keys))
+        found: Dict[str, bytes] = {}
+        conn = self._conn()
+        # Stay well below SQLite's bound-parameter limit.
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(f"SELECT key, value FROM entries WHERE key IN ({placeholders})", batch).fetchall()
+            found.update(rows)
+        if found:
+            now = time.time()
+            with conn:
+                conn.executemany("UPDATE entries SET last_access = ? WHERE key = ?", [(now, k) for k in found])
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set(self, key: str, value: bytes) -> None:
+        self.set_many([(key, value)])
+
+    def set_many(self, items: Iterable[Tuple[str, bytes]]) -> None:
+        now = time.time()
+        rows = [(key, value, now) for key, value in items]
+        if not rows:
+            return
+        with self._conn() as conn:
+            conn.executemany("INSERT OR REPLACE INTO entries (key, value, last_access) VALUES (?, ?, ?)", rows)
+        with self._lock:
+            self._writes += len(rows)
+            should_evict = self._writes >= self.EVICT_EVERY
+            if should_evict:
+                self._writes = 0
+        if should_evict:
+            self.evict()
+
+    def delete(self, key: str) -> None:
+        with self._conn() as conn:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def recent(self, limit: int) -> list:
+        """The `limit` most recently used keys, most recent first."""
+        rows = self._conn().execute("SELECT key FROM entries ORDER BY last_access DESC LIMIT ?", (limit,)).fetchall()
+        return [key for (key,) in rows]
+
+    def evict(self) -> int:
+        """Drops the least recently used entries above max_entries. Returns how many were removed."""
+        with self._conn() as conn:
+            (count,) = conn.execute("SELECT COUNT(*) FROM entries").fetchone()
+            excess = count - self.max_entries
+            if excess <= 0:
+                return 0
+            conn.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_access LIMIT ?)",
+                (excess,),
+            )
+        with self._lock:
+            self.evictions += excess
+        return excess
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,157 @@
+# utils/metrics.py
+
+import asyncio
+import contextlib
+import contextvars
+import time
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+from tele_notebook.core.config import settings
+
+"""
+Per-stage latency metrics, exported to Prometheus by the bot and every worker.
+
+A task body runs inside traced(coro, command, language). Within it, each stage
+is timed with `with span("llm"):` (or record() for a duration measured
+elsewhere) and observed in lumenote_stage_seconds, labelled with the command
+and language of the surrounding trace. The trace also keeps the stages, so a
+task slower than SLOW_TASK_SECONDS is logged with its breakdown. Trace state
+lives in a context variable, so it follows the task into gather() children
+and asyncio.to_thread() calls. Stages that run concurrently (for example the
+embedding and BM25 halves of a hybrid search) can add up to more than the wall
+time. prometheus_client's default collectors add the process's CPU time,
+resident memory and open file descriptors.
+"""
+
+T = TypeVar("T")
+
+NO_LABEL = "none"
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+STAGE_SECONDS = Histogram(
+    "lumenote_stage_seconds", "Time spent in one stage of a task.", ["command", "language", "stage"], buckets=BUCKETS,
+)
+TASK_SECONDS = Histogram(
+    "lumenote_task_seconds", "End-to-end time of a worker task.", ["command", "language"], buckets=BUCKETS,
+)
+TASKS = Counter("lumenote_tasks_total", "Worker tasks by outcome.", ["command", "language", "status"])
+QUEUE_WAIT_SECONDS = Histogram(
+    "lumenote_queue_wait_seconds", "Time tasks spent in their Celery queue before a worker started them.", ["queue"], buckets=BUCKETS,
+)
+HANDLER_SECONDS = Histogram(
+    "lumenote_handler_seconds", "Time the bot spent handling one update.", ["command", "language"], buckets=BUCKETS,
+)
+HANDLER_REQUESTS = Counter("lumenote_handler_requests_total", "Updates handled by the bot, by outcome.", ["command", "language", "status"])
+RESIDENCY = Gauge(
+    "lumenote_residency", "Loaded objects kept by this process: resident entries and bytes, hits, misses, evictions.", ["cache", "stat"],
+)
+RESIDENCY_STATS = ("resident", "resident_bytes", "hits", "misses", "evictions")
+USER_STATE_CACHE = Counter("lumenote_user_state_cache_total", "User state cache lookups in this process, by result.", ["result"])
+
+
+class Trace:
+    """The command, language, outcome and recorded stages of one task."""
+
+    def __init__(self, command: str, language: Optional[str]):
+        self.command = command
+        self.language = language or NO_LABEL
+        self.status = "ok"
+        self.stages: List[Tuple[str, float]] = []
+
+    def breakdown(self) -> str:
+        totals: Dict[str, float] = {}
+        for stage, seconds in self.stages:
+            totals[stage] = totals.get(stage, 0.0) + seconds
+        return ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in totals.items()) or "no stages recorded"
+
+
+_current: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("lumenote_trace", default=None)
+_server_port: Optional[int] = None
+
+
+def record(stage: str, seconds: float) -> None:
+    """Records a stage duration against the current trace (command "none" outside one)."""
+    trace = _current.get()
+    if trace is None:
+        STAGE_SECONDS.labels(NO_LABEL, NO_LABEL, stage).observe(seconds)
+        return
+    STAGE_SECONDS.labels(trace.command, trace.language, stage).observe(seconds)
+    trace.stages.append((stage, seconds))
+
+
+@contextlib.contextmanager
+def span(stage: str):
+    """Times the enclosed block as `stage`, whether it completes or raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started)
+
+
+@contextlib.contextmanager
+def collect() -> Iterator[Trace]:
+    """Collects the stages recorded inside the block into a fresh trace, without counting it as a task (for benchmarks)."""
+    trace = Trace(NO_LABEL, None)
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+def fail() -> None:
+    """Marks the current task as failed, for task bodies that report errors to the user instead of raising."""
+    trace = _current.get()
+    if trace is not None:
+        trace.status = "error"
+
+
+async def traced(coro: Awaitable[T], command: str, language: Optional[str] = None) -> T:
+    """Awaits a task body as one trace: counts it, times it and logs its stages if it was slow."""
+    trace = Trace(command, language)
+    token = _current.set(trace)
+    started = time.perf_counter()
+    try:
+        return await coro
+    except asyncio.CancelledError:
+        trace.status = "cancelled"  # includes the task time limits enforced by the async runner
+        raise
+    except Exception:
+        trace.status = "error"
+        raise
+    finally:
+        _current.reset(token)
+        elapsed = time.perf_counter() - started
+        TASK_SECONDS.labels(trace.command, trace.language).observe(elapsed)
+        TASKS.labels(trace.command, trace.language, trace.status).inc()
+        if elapsed >= settings.SLOW_TASK_SECONDS:
+            print(f"Slow {trace.command} task ({trace.language}, {trace.status}) took {elapsed:.1f}s: {trace.breakdown()}")
+
+
+def observe_handler(command: str, language: Optional[str], seconds: float, status: str = "ok") -> None:
+    HANDLER_SECONDS.labels(command, language or NO_LABEL).observe(seconds)
+    HANDLER_REQUESTS.labels(command, language or NO_LABEL, status).inc()
+
+
+def watch_residency(cache: str, stats: Callable[[], dict]) -> None:
+    """Exports a residency cache's stats() as lumenote_residency{cache, stat}, read at scrape time."""
+    for stat in RESIDENCY_STATS:
+        RESIDENCY.labels(cache, stat).set_function(lambda stat=stat: stats()[stat])
+
+
+def start_server(port: int = None) -> None:
+    """Serves /metrics on `port` (default METRICS_PORT) from this process. 0 disables; repeated calls are no-ops."""
+    global _server_port
+    port = settings.METRICS_PORT if port is None else port
+    if not port or _server_port is not None:
+        return
+    try:
+        start_http_server(port)
+    except OSError as e:
+        print(f"Could not start the metrics endpoint on port {port}: {e}")
+        return
+    _server_port = port
+    print(f"Serving Prometheus metrics on :{port}/metrics")
@@ -0,0 +1,145 @@
+# tele_notebook/utils/residency.py
+
+import contextlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Generic, Hashable, Iterable, List, Optional, Tuple, TypeVar
+
+V = TypeVar("V")
+
+
+class ResidencyCache(Generic[V]):
+    """
+    A thread-safe LRU map of loaded objects, bounded by entry count and by the
+    total of their sizes (either bound is off when 0). When a new entry pushes
+    the cache over a bound, the least recently used entries are dropped and
+    passed to `on_evict`, which can release whatever they hold. The entry just
+    loaded is never evicted, even if it alone is over the byte bound, and
+    neither is a pinned entry: keys held with pinned() stay until released.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int = 0, on_evict: Optional[Callable[[Hashable, V], None]] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self._entries: "OrderedDict[Hashable, Tuple[V, int]]" = OrderedDict()
+        self._bytes = 0
+        self._pins: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, load: Callable[[], Optional[Tuple[V, int]]]) -> Optional[V]:
+        """
+        The value for `key`, loaded with `load()` -> (value, size) on a miss. A
+        load that returns None is not cached. Loads run outside the lock; if two
+        threads load the same key at once, the first value stored wins.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        loaded = load()
+        if loaded is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry[0]
+            self._entries[key] = loaded
+            self._bytes += loaded[1]
+            evicted = self._evict_over_bounds()
+        self._release(evicted)
+        return loaded[0]
+
+    def resize(self, key: Hashable, size: int) -> None:
+        """Updates the size of a resident entry (e.g. after writes grew it), evicting others if needed."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            self._entries[key] = (entry[0], size)
+            self._bytes += size - entry[1]
+            self._entries.move_to_end(key)
+            evicted = self._evict_over_bounds()
+        self._release(evicted)
+
+    def discard(self, key: Hashable) -> None:
+        """Forgets an entry without calling `on_evict` (its object is gone already)."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+
+    @contextlib.contextmanager
+    def pinned(self, keys: Iterable[Hashable]):
+        """
+        Keeps `keys` from being evicted inside the block, whether or not they are
+        resident yet (a key loaded inside the block is pinned too). Entries over
+        the bounds are evicted once their last pin is released.
+        """
+        keys = list(keys)
+        with self._lock:
+            for key in keys:
+                self._pins[key] = self._pins.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                for key in keys:
+                    if self._pins[key] == 1:
+                        del self._pins[key]
+                    else:
+                        self._pins[key] -= 1
+                evicted = self._evict_over_bounds()
+            self._release(evicted)
+
+    def keys(self) -> List[Hashable]:
+        """Resident keys, most recently used first."""
+        with self._lock:
+            return list(reversed(self._entries))
+
+    def _over_bounds(self) -> bool:
+        return bool(
+            (self.max_entries and len(self._entries) > self.max_entries)
+            or (self.max_bytes and self._bytes > self.max_bytes)
+        )
+
+    def _evict_over_bounds(self) -> list:
+        evicted = []
+        if not self._over_bounds():
+            return evicted
+        newest = next(reversed(self._entries))
+        # Least recently used first, skipping pinned entries and the newest one.
+        for key in [key for key in self._entries if key != newest and key not in self._pins]:
+            if not self._over_bounds():
+                break
+            value, size = self._entries.pop(key)
+            self._bytes -= size
+            self.evictions += 1
+            evicted.append((key, value))
+        return evicted
+
+    def _release(self, evicted: list) -> None:
+        if self.on_evict is None:
+            return
+        for key, value in evicted:
+            self.on_evict(key, value)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "resident": len(self._entries),
+                "resident_bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
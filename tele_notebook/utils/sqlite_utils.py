@@ -0,0 +1,20 @@
+# tele_notebook/utils/sqlite_utils.py
+
+import sqlite3
+
+BUSY_TIMEOUT = 30  # seconds a writer waits for another process's write lock
+
+
+def connect(path: str, read_only: bool = False) -> sqlite3.Connection:
+    """
+    Opens a SQLite database that several threads and processes share: WAL
+    journal (readers never block the writer), NORMAL sync and a busy timeout.
+    Connections are not shared between threads; callers keep one per thread.
+    A read-only connection expects the database to exist and be in WAL mode already.
+    """
+    if read_only:
+        return sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=BUSY_TIMEOUT)
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
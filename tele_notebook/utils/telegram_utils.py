@@ -0,0 +1,89 @@
+# tele_notebook/utils/telegram_utils.py
+
+import asyncio
+import time
+from typing import AsyncIterator, Optional
+
+from telegram import Bot
+from telegram.error import BadRequest, RetryAfter
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+STREAMING_CURSOR = " ▌"
+
+
+class ThrottledMessage:
+    """
+    A Telegram message that is edited in place as work progresses. The first
+    update sends the message; later updates edit it at most once every
+    `min_interval` seconds so we stay under Telegram's edit rate limits.
+    Updates that arrive in between are coalesced: only the latest text matters.
+    """
+
+    def __init__(self, bot: Bot, chat_id: int, min_interval: float, message_id: Optional[int] = None, **send_kwargs):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.min_interval = min_interval
+        self.message_id = message_id
+        self.send_kwargs = send_kwargs
+        self._last_text: Optional[str] = None
+        self._last_edit = 0.0
+
+    async def update(self, text: str, force: bool = False) -> None:
+        if text == self._last_text:
+            return
+        now = time.monotonic()
+        if self.message_id is None:
+            message = await self.bot.send_message(chat_id=self.chat_id, text=text, **self.send_kwargs)
+            self.message_id = message.message_id
+        elif force or now - self._last_edit >= self.min_interval:
+            try:
+                await self._edit(text)
+            except RetryAfter as e:
+                if not force:
+                    # Back off and let the next update (or the final forced one) try again.
+                    self._last_edit = now + e.retry_after
+                    return
+                # The final text must arrive: wait out the flood control once, then
+                # fall back to a new message rather than leaving the partial text.
+                await asyncio.sleep(e.retry_after)
+                try:
+                    await self._edit(text)
+                except RetryAfter:
+                    message = await self.bot.send_message(chat_id=self.chat_id, text=text, **self.send_kwargs)
+                    self.message_id = message.message_id
+                now = time.monotonic()
+        else:
+            return
+        self._last_text = text
+        self._last_edit = now
+
+    async def _edit(self, text: str) -> None:
+        try:
+            await self.bot.edit_message_text(text=text, chat_id=self.chat_id, message_id=self.message_id, **self.send_kwargs)
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+
+    async def finalize(self, text: str) -> None:
+        """
+        Shows the final text. Text that does not fit in one Telegram message is
+        split: the first part replaces the message, the rest is sent as new messages.
+        """
+        parts = [text[i:i + TELEGRAM_MESSAGE_LIMIT] for i in range(0, len(text), TELEGRAM_MESSAGE_LIMIT)] or [""]
+        await self.update(parts[0], force=True)
+        for part in parts[1:]:
+            await self.bot.send_message(chat_id=self.chat_id, text=part, **self.send_kwargs)
+
+    async def stream(self, chunks: AsyncIterator[str]) -> str:
+        """
+        Shows text as it is generated, coalescing edits to the throttle interval.
+        Once the text outgrows one message the edits stop and finalize() sends the rest.
+        Returns the full text.
+        """
+        text = ""
+        async for chunk in chunks:
+            text += chunk
+            if len(text) + len(STREAMING_CURSOR) <= TELEGRAM_MESSAGE_LIMIT:
+                await self.update(text + STREAMING_CURSOR)
+        await self.finalize(text)
+        return text
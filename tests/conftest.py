@@ -0,0 +1,10 @@
+# tests/conftest.py
+
+import os
+import tempfile
+
+# Settings() requires these; the tests never reach the services behind them.
+# Caches and Chroma go to a throwaway directory.
+for name in ("TELEGRAM_BOT_TOKEN", "GOOGLE_API_KEY", "TAVILY_API_KEY", "REDIS_URL"):
+    os.environ.setdefault(name, "offline")
+os.environ.setdefault("CHROMA_DB_PATH", tempfile.mkdtemp(prefix="lumenote-tests-"))
@@ -0,0 +1,26 @@
+# tests/test_lexical_index.py
+
+import os
+import sqlite3
+
+from tele_notebook.services import lexical_index
+
+
+def test_rebuild_replaces_the_index_and_search_keeps_working():
+    lexical_index.add_chunks("rebuilt", [("a", "s1", "old text about apples", {})])
+    assert [hit[0] for hit in lexical_index.search("rebuilt", "apples", 5)] == ["a"]
+
+    lexical_index.rebuild("rebuilt", [("b", "s2", "new text about pears", {"page": 2})])
+    assert lexical_index.search("rebuilt", "apples", 5) == []
+    assert lexical_index.search("rebuilt", "pears", 5) == [("b", "new text about pears", {"page": 2})]
+
+
+def test_search_reads_indexes_written_elsewhere():
+    assert lexical_index.search("elsewhere", "plums", 5) == []
+    os.makedirs(lexical_index.index_dir(), exist_ok=True)
+    conn = sqlite3.connect(lexical_index.index_path("elsewhere"))
+    conn.executescript(lexical_index._SCHEMA)
+    with conn:
+        conn.execute("INSERT INTO chunks (chunk_id, source_id, content, metadata) VALUES ('c', 's', 'ripe plums', '{}')")
+    conn.close()
+    assert lexical_index.search("elsewhere", "plums", 5) == [("c", "ripe plums", {})]
@@ -0,0 +1,30 @@
+# tests/test_mindmap_renderer.py
+
+import pytest
+
+from tele_notebook.services.mindmap_renderer import RenderError, normalize_dot
+
+
+def test_leading_prose_mentioning_graph_is_skipped():
+    reply = "Here is the graph you asked for:\ndigraph G { a -> b; }"
+    assert normalize_dot(reply) == "digraph G{\na->b;\n}"
+
+
+def test_fenced_graph_with_trailing_prose():
+    reply = "Sure! This graph shows it.\n```dot\nstrict digraph \"Mind map\" {\n  a -> b\n}\n```\nThe graph has two nodes."
+    assert normalize_dot(reply) == 'strict digraph "Mind map"{\na->b}'
+
+
+def test_unsafe_attributes_are_dropped():
+    dot = 'digraph { graph [dpi=600]; a [image="/etc/passwd", label="A"]; }'
+    assert normalize_dot(dot) == 'digraph{\ngraph[];\na[label="A"];\n}'
+
+
+@pytest.mark.parametrize("reply", [
+    "No graph here, just prose about a graph.",
+    "digraph G { a -> b;",
+    'digraph G { a [label="open]; }',
+])
+def test_invalid_replies_are_rejected(reply):
+    with pytest.raises(RenderError):
+        normalize_dot(reply)
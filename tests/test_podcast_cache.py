@@ -0,0 +1,64 @@
+# tests/test_podcast_cache.py
+
+import asyncio
+from types import SimpleNamespace
+
+from telegram.error import BadRequest
+
+from tele_notebook.services.gemini_tts_service import PodcastAudio
+from tele_notebook.tasks import tasks
+
+
+class VoiceForbiddenBot:
+    """Rejects every voice message, as Telegram does for users who forbid them."""
+
+    def __init__(self):
+        self.audio_sent = []
+
+    async def send_voice(self, chat_id, voice, **kwargs):
+        raise BadRequest("Voice_messages_forbidden")
+
+    async def send_audio(self, chat_id, audio, **kwargs):
+        self.audio_sent.append(audio)
+        return SimpleNamespace(audio=SimpleNamespace(file_id=f"audio-{len(self.audio_sent)}"))
+
+    async def send_message(self, chat_id, text, **kwargs):
+        raise AssertionError(f"unexpected error message: {text}")
+
+
+def test_voice_forbidden_podcast_is_resent_from_cache_as_audio(monkeypatch):
+    bot = VoiceForbiddenBot()
+    store = {}
+    tts_calls = []
+
+    async def get_bot():
+        return bot
+
+    async def get_artifact(user_id, project_name, kind, topic, language):
+        return "key", store.get("key")
+
+    async def generate_podcast_script(retriever, topic, language):
+        return "Speaker 1: Hi.\nSpeaker 2: Hello."
+
+    async def generate_podcast_audio(script, language):
+        tts_calls.append(script)
+        return PodcastAudio(b"OggS", "opus", 3)
+
+    def put(key, source, file_id=None, send_as=None):
+        store[key] = {"source": source, "file_id": file_id, "send_as": send_as}
+
+    monkeypatch.setattr(tasks.client_registry, "get_bot", get_bot)
+    monkeypatch.setattr(tasks, "_get_artifact", get_artifact)
+    monkeypatch.setattr(tasks.rag_service, "get_project_retriever", lambda user_id, project_name: None)
+    monkeypatch.setattr(tasks.llm_service, "generate_podcast_script", generate_podcast_script)
+    monkeypatch.setattr(tasks.gemini_tts_service, "generate_podcast_audio", generate_podcast_audio)
+    monkeypatch.setattr(tasks.artifact_cache, "put", put)
+    monkeypatch.setattr(tasks.settings, "PODCAST_AUDIO_FORMAT", "opus")
+
+    asyncio.run(tasks._async_generate_podcast(1, 1, "default", "topic", "en"))
+    assert store["key"]["file_id"] == "audio-1" and store["key"]["send_as"] == "audio"
+
+    asyncio.run(tasks._async_generate_podcast(1, 1, "default", "topic", "en"))
+    assert len(tts_calls) == 1
+    assert bot.audio_sent == [b"OggS", "audio-1"]
+    assert store["key"]["file_id"] == "audio-1"
@@ -0,0 +1,22 @@
+# tests/test_speaker_turns.py
+
+from tele_notebook.services.gemini_tts_service import parse_speaker_turns
+
+
+def test_prose_label_stays_in_the_current_turn():
+    script = "Speaker 1: Hi there.\nNote: this is important.\nSpeaker 2: Right.\nSpeaker 1 (Anna): Yes"
+    assert parse_speaker_turns(script) == [
+        ("Speaker 1", "Hi there. Note: this is important."),
+        ("Speaker 2", "Right."),
+        ("Speaker 1", "Yes"),
+    ]
+
+
+def test_named_speakers_without_numbers():
+    script = "**Anna:** Hi\nBen: Hello\nExample: a stray label\nAnna: Bye\nBen: Bye"
+    assert parse_speaker_turns(script) == [
+        ("Anna", "Hi"),
+        ("Ben", "Hello Example: a stray label"),
+        ("Anna", "Bye"),
+        ("Ben", "Bye"),
+    ]
@@ -0,0 +1,48 @@
+# tests/test_user_state_cache.py
+
+from tele_notebook.services import user_service
+from tele_notebook.utils.cache import TTLCache
+
+
+class RacingBackend:
+    """Returns the stored state, letting another process write it during the read."""
+
+    def __init__(self):
+        self.state = {"language": "en"}
+        self.reads = 0
+        self.concurrent_write = None
+
+    def get(self, user_id):
+        self.reads += 1
+        snapshot = dict(self.state)
+        if self.concurrent_write is not None:
+            self.concurrent_write()
+            self.concurrent_write = None
+        return snapshot
+
+
+def test_state_read_during_an_invalidation_is_not_cached(monkeypatch):
+    backend = RacingBackend()
+    monkeypatch.setattr(user_service, "_cache", TTLCache(16, 60))
+    monkeypatch.setattr(user_service, "_subscriber", False)
+    monkeypatch.setattr(user_service, "get_backend", lambda: backend)
+
+    def other_process_sets_language():
+        backend.state["language"] = "ru"
+        user_service._on_invalidation({"data": "other-process:7"})
+
+    backend.concurrent_write = other_process_sets_language
+    assert user_service.get_user_state(7)["language"] == "en"
+    assert user_service.get_user_state(7)["language"] == "ru"
+    assert user_service.get_user_state(7)["language"] == "ru"
+    assert backend.reads == 2
+
+
+def test_forgotten_invalidations_still_block_older_loads():
+    cache = TTLCache(2, 60)
+    generation = cache.generation()
+    for key in ("a", "b", "c"):
+        cache.invalidate(key)
+    assert not cache.set_if_current("a", 1, generation)
+    assert cache.set_if_current("a", 1, cache.generation())
+    assert cache.get("a") == 1